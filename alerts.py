@@ -0,0 +1,281 @@
+"""Monthly control charts of batch processing days per line, and their alerts.
+
+:class:`ControlCharts` keeps a line x month grid of batch ``processing_days``
+statistics: count, sum and sum of squares. Processing days are whole days,
+so these are exact integers. New or changed batches are added to (or
+subtracted from) their cells directly, so an append never rescans the
+batch table, and gives exactly the cells a rebuild would. Means and
+variances are derived from them when read.
+
+Along the months of each line it then keeps running state:
+
+* the running count / sum / sum of squares of every batch in the *earlier*
+  months, the line's baseline;
+* ``z``, the month's mean standardized against that baseline
+  (``(mean - baseline) / (sd / sqrt(n))``). It is undefined until the
+  baseline holds ``MIN_BASELINE`` batches;
+* an EWMA of ``z`` (weight ``EWMA_LAMBDA``) and a two-sided tabular CUSUM of
+  ``z`` (slack ``CUSUM_K``). A CUSUM side restarts at zero after it signals.
+
+A month's state depends only on earlier months. When cells change (an
+append, or a reload that differs from the previous snapshot), only the
+lines with changed cells are recomputed, from their first changed month
+onwards; everything before stays as it was.
+
+:meth:`ControlCharts.alerts` reports, per line and month:
+
+* ``threshold``: the monthly mean is above a fixed number of days;
+* ``shewhart``: ``|z| > SHEWHART_LIMIT``;
+* ``ewma``: the EWMA is outside its time-varying control limit;
+* ``cusum_high`` / ``cusum_low``: a CUSUM side is above ``CUSUM_H``.
+"""
+import numpy as np
+import pandas as pd
+
+from schema import factorize
+
+# "Flag when average monthly processing days exceed 2-3 days"
+ALERT_MEAN_DAYS = 3
+
+# Batches a line's baseline needs before z (and everything built on it) is defined
+MIN_BASELINE = 30
+
+SHEWHART_LIMIT = 3.0
+EWMA_LAMBDA = 0.2
+EWMA_LIMIT = 3.0
+CUSUM_K = 0.5
+CUSUM_H = 5.0
+
+ALERT_KINDS = ("threshold", "shewhart", "ewma", "cusum_high", "cusum_low")
+
+CELLS = ("n", "sum", "sum_sq")
+BASELINE = ("base_n", "base_sum", "base_sum_sq")
+STATE = BASELINE + ("z", "ewma", "steps", "cusum_high", "cusum_low")
+
+
+def moments(n, total, total_sq):
+    """Mean and sum of squared deviations (``m2``) from count, sum and sum of squares."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n > 0, total / n, 0.0)
+        m2 = np.where(n > 0, np.maximum(total_sq - total * mean, 0.0), 0.0)
+    return mean, m2
+
+
+def _cells(batches, lines=None, months=None):
+    """``(lines, months, {n, sum, sum_sq})`` of ``batches`` on a dense line x month grid.
+
+    Labels default to the values present in ``batches``; given labels must
+    cover them.
+    """
+    codes = []
+    for dim, labels in (("LINE_NO", lines), ("month", months)):
+        dim_codes, present = factorize(batches[dim])
+        if labels is None:
+            labels = present
+        else:
+            dim_codes = np.where(dim_codes >= 0, labels.get_indexer(present)[dim_codes], -1)
+        codes.append((dim_codes, labels))
+    (line_codes, lines), (month_codes, months) = codes
+
+    days = batches["processing_days"].to_numpy(dtype=np.float64, na_value=np.nan)
+    keep = (line_codes >= 0) & (month_codes >= 0) & ~np.isnan(days)
+    cell = line_codes[keep].astype(np.intp) * len(months) + month_codes[keep]
+    days = days[keep]
+    size = len(lines) * len(months)
+    shape = (len(lines), len(months))
+
+    # Whole days: the float sums are exact integers (well below 2**53)
+    return lines, months, {
+        name: np.bincount(cell, weights=weights, minlength=size).astype(np.int64).reshape(shape)
+        for name, weights in (("n", None), ("sum", days), ("sum_sq", days * days))
+    }
+
+
+def _realigned(values, old_lines, old_months, lines, months, fill=0.0):
+    """``values`` (old line x month grid) placed on a grid of superset labels."""
+    out = np.full((len(lines), len(months)), fill, dtype=values.dtype)
+    rows, cols = lines.get_indexer(old_lines), months.get_indexer(old_months)
+    out[np.ix_(rows, cols)] = values
+    return out
+
+
+class ControlCharts:
+    """Line x month count / sum / sum-of-squares cells of batch processing days and their running chart state."""
+
+    def __init__(self, lines, months, cells, state):
+        self.lines = lines            # sorted line labels
+        self.months = months          # sorted monthly periods
+        self.cells = cells            # CELLS -> (lines, months) arrays
+        self.state = state            # STATE -> (lines, months) arrays, after each month
+
+    @classmethod
+    def from_batches(cls, batches, previous=None):
+        """Charts of ``batches``; with ``previous``, unchanged lines / months are reused."""
+        lines, months, cells = _cells(batches)
+        if previous is None or not (previous.lines.isin(lines).all() and previous.months.isin(months).all()):
+            return cls(lines, months, cells, {}).recomputed(np.ones(len(lines), dtype=bool), 0)
+
+        old = previous.on(lines, months)
+        changed = np.zeros(cells["n"].shape, dtype=bool)
+        for name in CELLS:
+            changed |= old.cells[name] != cells[name]
+        inserted = ~months.isin(previous.months)
+        return cls(lines, months, cells, old.state).recomputed_from(changed, inserted)
+
+    def on(self, lines, months):
+        """The same charts on a grid of superset labels (new lines / months empty)."""
+        if self.lines.equals(lines) and self.months.equals(months):
+            return self
+
+        def realign(values):
+            return _realigned(values, self.lines, self.months, lines, months)
+
+        return ControlCharts(
+            lines, months,
+            {name: realign(values) for name, values in self.cells.items()},
+            {name: realign(values) for name, values in self.state.items()},
+        )
+
+    def updated(self, removed, added):
+        """New charts with the ``removed`` batches retracted and ``added`` merged in."""
+        lines = self.lines.union(pd.Index(added["LINE_NO"].dropna().unique())).sort_values()
+        months = self.months.union(pd.PeriodIndex(added["month"].dropna().unique(), freq="M")).sort_values()
+        grid = self.on(lines, months)
+
+        cells = {name: values.copy() for name, values in grid.cells.items()}
+        changed = np.zeros(cells["n"].shape, dtype=bool)
+        for batches, sign in ((removed, -1), (added, 1)):
+            if len(batches):
+                _, _, delta = _cells(batches, lines, months)
+                for name in CELLS:
+                    cells[name] += sign * delta[name]
+                changed |= delta["n"] > 0
+        inserted = ~months.isin(self.months)
+        return ControlCharts(lines, months, cells, grid.state).recomputed_from(changed, inserted)
+
+    def recomputed_from(self, changed, inserted):
+        """Recompute the lines with ``changed`` cells from their first changed month.
+
+        ``inserted`` marks months the state has no entry for yet; every line
+        then needs its state carried through them, so all lines are
+        recomputed from the first of those as well.
+        """
+        lines = changed.any(axis=1)
+        start = int(np.argmax(changed.any(axis=0))) if lines.any() else len(self.months)
+        if inserted.any():
+            start = min(start, int(np.argmax(inserted)))
+            lines[:] = True
+        if not lines.any() or start >= len(self.months):
+            return self
+        return self.recomputed(lines, start)
+
+    def recomputed(self, lines, start):
+        """New charts with ``lines`` (a mask) recomputed from month ``start`` onwards."""
+        shape = self.cells["n"].shape
+
+        def dtype(name):
+            return np.int64 if name in BASELINE else np.float64
+
+        state = {
+            name: self.state[name].copy() if name in self.state else np.zeros(shape, dtype=dtype(name))
+            for name in STATE
+        }
+        n, total, total_sq = (self.cells[name][lines] for name in CELLS)
+        mean, _ = moments(n, total, total_sq)
+
+        def before(name):
+            return state[name][lines, start - 1] if start > 0 else np.zeros(int(lines.sum()), dtype=dtype(name))
+
+        base_n, base_sum, base_sum_sq = before("base_n"), before("base_sum"), before("base_sum_sq")
+        ewma, steps = before("ewma"), before("steps")
+        high, low = before("cusum_high"), before("cusum_low")
+        columns = {name: np.zeros((len(base_n), shape[1] - start), dtype=dtype(name)) for name in STATE}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for j, t in enumerate(range(start, shape[1])):
+                base_mean, base_m2 = moments(base_n, base_sum, base_sum_sq)
+                sd = np.sqrt(base_m2 / (base_n - 1))
+                ok = (n[:, t] > 0) & (base_n >= MIN_BASELINE) & (sd > 0)
+                z = np.where(ok, (mean[:, t] - base_mean) / (sd / np.sqrt(n[:, t])), np.nan)
+                steps = steps + ok
+                ewma = np.where(ok, EWMA_LAMBDA * z + (1 - EWMA_LAMBDA) * ewma, ewma)
+                high = np.where(ok, np.maximum(0.0, high + z - CUSUM_K), high)
+                low = np.where(ok, np.maximum(0.0, low - z - CUSUM_K), low)
+                values = {"z": z, "ewma": ewma, "steps": steps, "cusum_high": high, "cusum_low": low}
+                # This month joins the baseline of the next ones
+                base_n, base_sum, base_sum_sq = base_n + n[:, t], base_sum + total[:, t], base_sum_sq + total_sq[:, t]
+                values.update(base_n=base_n, base_sum=base_sum, base_sum_sq=base_sum_sq)
+                for name, column in values.items():
+                    columns[name][:, j] = column
+                # A CUSUM side restarts once it has signalled
+                high = np.where(high > CUSUM_H, 0.0, high)
+                low = np.where(low > CUSUM_H, 0.0, low)
+        for name, values in columns.items():
+            state[name][lines, start:] = values
+        return ControlCharts(self.lines, self.months, self.cells, state)
+
+    def alerts(self, threshold_days=ALERT_MEAN_DAYS, lines=None, since=None, kinds=ALERT_KINDS):
+        """Alert records (newest month first), one per line, month and kind that fired.
+
+        ``lines`` keeps only those lines (string form), ``since`` only months
+        from that ``"YYYY-MM"`` on.
+        """
+        n = self.cells["n"]
+        mean, _ = moments(n, self.cells["sum"], self.cells["sum_sq"])
+        z, ewma = self.state["z"], self.state["ewma"]
+        steps = self.state["steps"]
+        ewma_limit = EWMA_LIMIT * np.sqrt(
+            EWMA_LAMBDA / (2 - EWMA_LAMBDA) * (1 - (1 - EWMA_LAMBDA) ** (2 * steps))
+        )
+        defined = ~np.isnan(z)
+        with np.errstate(invalid="ignore"):
+            checks = {
+                "threshold": (n > 0) & (mean > threshold_days),
+                "shewhart": defined & (np.abs(z) > SHEWHART_LIMIT),
+                "ewma": defined & (np.abs(ewma) > ewma_limit),
+                "cusum_high": defined & (self.state["cusum_high"] > CUSUM_H),
+                "cusum_low": defined & (self.state["cusum_low"] > CUSUM_H),
+            }
+        values = {
+            "threshold": (mean, np.full(n.shape, float(threshold_days))),
+            "shewhart": (z, np.full(n.shape, SHEWHART_LIMIT)),
+            "ewma": (ewma, ewma_limit),
+            "cusum_high": (self.state["cusum_high"], np.full(n.shape, CUSUM_H)),
+            "cusum_low": (self.state["cusum_low"], np.full(n.shape, CUSUM_H)),
+        }
+
+        keep = np.ones(n.shape, dtype=bool)
+        if lines:
+            wanted = {str(line) for line in lines}
+            keep &= np.array([str(line) in wanted for line in self.lines])[:, None]
+        if since is not None:
+            keep &= (self.months >= pd.Period(since, freq="M"))[None, :]
+
+        line_names = [str(line) for line in self.lines]
+        month_names = self.months.strftime("%Y-%m")
+        base_n = self.state["base_n"]
+        base_means, base_m2 = moments(base_n, self.state["base_sum"], self.state["base_sum_sq"])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sd = np.sqrt(base_m2 / (base_n - 1))
+        found = []
+        for k, kind in enumerate(kinds):
+            found.extend((-t, i, k) for i, t in zip(*np.nonzero(checks[kind] & keep)))
+        records = []
+        for t, i, k in sorted(found):  # newest month first, then line, then kind
+            t, kind = -t, kinds[k]
+            value, limit = values[kind]
+            # The baseline a month is compared with is the state after the month before
+            has_base = t > 0 and base_n[i, t - 1] > 0
+            base_mean = base_means[i, t - 1] if has_base else None
+            base_sd = sd[i, t - 1] if has_base else np.nan
+            records.append({
+                "line": line_names[i],
+                "month": month_names[t],
+                "kind": kind,
+                "value": float(value[i, t]),
+                "limit": float(limit[i, t]),
+                "batches": int(n[i, t]),
+                "mean_days": float(mean[i, t]),
+                "baseline_mean_days": None if base_mean is None else float(base_mean),
+                "baseline_sd_days": None if np.isnan(base_sd) else float(base_sd),
+            })
+        return records
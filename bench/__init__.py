@@ -0,0 +1 @@
+"""Benchmarks: synthetic data (:mod:`bench.generate`) and the endpoint harness (:mod:`bench.run`)."""
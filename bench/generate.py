@@ -0,0 +1,129 @@
+"""Synthetic WIP tables shaped like ``batch_details.xlsx``.
+
+Output has the columns the API reads (``WIP_BATCH_ID``, ``LINE_NO``,
+``FORMULA_ID``, ``WIP_ACT_START_DATE``, ``WIP_CMPLT_DATE``,
+``SCRAP_FACTOR``, ``REASON``) and the same quirks as the real data:
+
+* a batch spans several rows. Its rows share the line and formula, and
+  their dates scatter around the batch's start;
+* line and formula volumes are Zipf-skewed. Each formula mostly runs on
+  one home line;
+* processing days are geometric. A few lines are slow, and delays get
+  worse over the covered years;
+* ``REASON`` is mostly filled on delayed rows and mostly empty otherwise;
+* scrap factors are lognormal per formula and rounded to 4 decimals.
+
+The same ``seed`` always gives the same table::
+
+    python -m bench.generate --rows 1m --out bench/.data/wip_1m.csv
+
+Excel stops at 1,048,576 rows, so larger tables are written as CSV, which
+:func:`loader.read_source` also accepts.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+LINES = 26
+FORMULAS = 400
+ROWS_PER_BATCH = 3
+EXCEL_MAX_ROWS = 1_048_575
+
+REASONS = np.array([
+    "Addition and deletion for Batch WIP",
+    "Capacity Constraints",
+    "RM Short",
+    "ERP/WIP Error",
+    "CR.LOW",
+    "HOLD BY SC",
+    "Holidays",
+    "Supply Chain instructions",
+    "Viscosity Variation",
+], dtype=object)
+REASON_WEIGHTS = np.array([40, 14, 12, 10, 6, 6, 5, 4, 3], dtype=np.float64)
+
+
+def parse_size(text):
+    """``"10k"`` -> 10_000, ``"1m"`` -> 1_000_000, ``"2500"`` -> 2500."""
+    text = str(text).strip().lower().replace("_", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def _zipf_weights(n, a, rng):
+    weights = 1.0 / np.arange(1, n + 1) ** a
+    return rng.permutation(weights / weights.sum())
+
+
+def generate(rows, seed=0, start="2022-01-01", years=3):
+    """Return a synthetic WIP frame with ``rows`` rows."""
+    rng = np.random.default_rng(seed)
+    n_batches = max(1, rows // ROWS_PER_BATCH)
+    span_days = int(365 * years)
+
+    # Formulas have a home line; lines inherit their skew from formula volume
+    line_weights = _zipf_weights(LINES, 1.1, rng)
+    formula_line = rng.choice(LINES, size=FORMULAS, p=line_weights)
+    formula_weights = _zipf_weights(FORMULAS, 1.05, rng)
+    formula_scrap = np.exp(rng.normal(np.log(0.02), 0.35, FORMULAS))
+
+    batch_formula = rng.choice(FORMULAS, size=n_batches, p=formula_weights)
+    batch_line = formula_line[batch_formula]
+    moved = rng.random(n_batches) < 0.08  # occasionally run elsewhere
+    batch_line[moved] = rng.choice(LINES, size=int(moved.sum()), p=line_weights)
+    # Volume grows over time
+    batch_day = (rng.power(1.4, n_batches) * span_days).astype(np.int64)
+
+    # Slow lines and a gradual deterioration push the geometric mean up
+    line_slowness = np.where(rng.random(LINES) < 0.12, 3.0, 1.0)
+    trend = 1.0 + 1.5 * batch_day / span_days
+    batch_mean_days = 0.5 * line_slowness[batch_line] * trend
+
+    # Every batch gets at least one row, the rest are spread at random
+    batch_of_row = np.concatenate([
+        np.arange(min(n_batches, rows)),
+        rng.integers(0, n_batches, max(0, rows - n_batches)),
+    ])
+    rng.shuffle(batch_of_row)
+
+    mean_days = batch_mean_days[batch_of_row]
+    row_start = batch_day[batch_of_row] + rng.integers(0, 2, rows)
+    duration = rng.geometric(1.0 / (1.0 + mean_days)) - 1
+    delayed = duration > 2
+
+    reason_codes = rng.choice(len(REASONS), size=rows, p=REASON_WEIGHTS / REASON_WEIGHTS.sum())
+    has_reason = np.where(delayed, rng.random(rows) < 0.85, rng.random(rows) < 0.1)
+    reason = np.where(has_reason, REASONS[reason_codes], None)
+
+    origin = np.datetime64(pd.Timestamp(start).date(), "D")
+    scrap = formula_scrap[batch_formula[batch_of_row]] * np.exp(rng.normal(0.0, 0.1, rows))
+    return pd.DataFrame({
+        "WIP_BATCH_ID": 4_000_000 + rng.permutation(n_batches)[batch_of_row],
+        "LINE_NO": batch_line[batch_of_row] + 1,
+        "FORMULA_ID": 10_000 + batch_formula[batch_of_row],
+        "WIP_ACT_START_DATE": (origin + row_start).astype("datetime64[ns]"),
+        "WIP_CMPLT_DATE": (origin + row_start + duration).astype("datetime64[ns]"),
+        "SCRAP_FACTOR": scrap.round(4),
+        "REASON": reason,
+    })
+
+
+def write(frame, path):
+    """Write ``frame`` as ``.xlsx`` (up to Excel's row limit) or ``.csv``."""
+    if path.lower().endswith(".csv"):
+        frame.to_csv(path, index=False, date_format="%Y-%m-%d")
+    elif len(frame) > EXCEL_MAX_ROWS:
+        raise ValueError(f"{len(frame)} rows do not fit in an Excel sheet; write a .csv instead")
+    else:
+        frame.to_excel(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", default="10k", help="e.g. 10k, 1m, 10m")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help=".csv or .xlsx")
+    args = parser.parse_args()
+    print(write(generate(parse_size(args.rows), seed=args.seed), args.out))
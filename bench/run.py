@@ -0,0 +1,354 @@
+"""Endpoint benchmark over synthetic datasets.
+
+For every dataset size the harness does the following:
+
+1. It generates (or reuses) a synthetic table with :mod:`bench.generate`.
+2. It starts a fresh worker process with ``WIP_SOURCE`` pointing at that
+   table and an empty loader cache. The worker times ``import main``, which
+   is a cold start including parsing. It then drives every GET endpoint
+   in-process through the ASGI interface, with no server and no sockets.
+3. It starts a second worker that only times a warm start from the
+   columnar cache.
+4. It starts a third worker, again with an empty cache, that starts the
+   way a serverless host does: it times ``import serverless`` and then the
+   time to first byte of ``/healthz`` (answered before anything heavy is
+   imported), of the first chart request (which imports ``main`` and builds
+   the dataset) and of a second one.
+
+Each endpoint is measured twice. In ``uncached`` mode the response cache is
+cleared before every request. In ``cached`` mode it is not. Results go to a
+JSON file: p50 / p99 / mean latency, throughput, status codes, peak RSS and
+startup times, plus environment metadata. ``--startup-budget`` fails the
+run when the serverless ``/healthz`` first byte (import included) takes
+longer. With ``--baseline`` a previous results file is compared and
+regressions are reported::
+
+    python -m bench.run --sizes 10k,1m --requests 50 --output bench/results.json
+    python -m bench.run --sizes 10k --baseline bench/results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench.generate import generate, parse_size, write
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Routes that are not charts, or that change state
+SKIPPED_ROUTES = {"/metrics", "/warmup", "/docs", "/redoc", "/openapi.json", "/docs/oauth2-redirect"}
+
+# Routes timed by the serverless cold-start worker, in order
+SERVERLESS_PATHS = ("/healthz", "/delay-share", "/delayed-batches-by-line")
+
+# Query variants worth timing next to each route's defaults
+EXTRA_CASES = [
+    ("/processing-days-histogram", "raw=false"),
+    ("/delayed-batches-by-line", "threshold=5"),
+    ("/cube", "by=month&by=LINE_NO"),
+    ("/cube", "by=LINE_NO&by=REASON&grain=rows"),
+    ("/line-average-delay", "start=2023-01-01&end=2023-03-31"),
+    ("/delay-reasons-by-line", "lines=1&lines=2&formulas=10000"),
+    ("/processing-days-percentiles", "by=month&by=LINE_NO"),
+    ("/aggregate", "by=month&by=FORMULA_ID&metric=mean_days&metric=max_days&sort=max_days&top=20"),
+    ("/aggregate", "grain=rows&by=LINE_NO&by=REASON&metric=count&metric=mean_scrap"),
+]
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)  # bytes on macOS, KiB elsewhere
+
+
+async def asgi_get(app, path, query="", headers=(), marks=None):
+    """Send one GET through ``app``; returns ``(status, body_bytes)``.
+
+    ``marks["first_byte"]``, if given, receives the ``perf_counter()`` of
+    the response start.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")] + [(k.encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    state = {"requested": False, "status": None, "size": 0}
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if not state["requested"]:
+            state["requested"] = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            state["status"] = message["status"]
+            if marks is not None:
+                marks["first_byte"] = time.perf_counter()
+        elif message["type"] == "http.response.body":
+            state["size"] += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return state["status"], state["size"]
+
+
+def _summary(latencies, wall, statuses, size):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else None,
+        "statuses": sorted(set(statuses)),
+        "response_bytes": size,
+    }
+
+
+async def measure(app, path, query, requests, concurrency, clear_cache, headers):
+    from response_cache import response_cache
+
+    for _ in range(2):  # warm-up: imports, first-touch of mmapped pages
+        await asgi_get(app, path, query, headers)
+
+    latencies, statuses, size = [], [], 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal size
+        for _ in remaining:
+            if clear_cache:
+                response_cache.clear()
+            started = time.perf_counter()
+            status, size = await asgi_get(app, path, query, headers)
+            latencies.append(time.perf_counter() - started)
+            statuses.append(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return _summary(latencies, time.perf_counter() - started, statuses, size)
+
+
+def bench_cases(app):
+    paths = sorted(
+        route.path for route in app.routes
+        if "GET" in getattr(route, "methods", ()) and "{" not in route.path and route.path not in SKIPPED_ROUTES
+    )
+    return [(path, "") for path in paths] + [case for case in EXTRA_CASES if case[0] in paths]
+
+
+def worker(args):
+    """Runs inside the child process; prints one JSON document."""
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import main
+    startup = time.perf_counter() - started
+    result = {"startup_s": round(startup, 3), "startup_peak_rss_mb": round(_peak_rss_mb(), 1)}
+    if args.startup_only:
+        print(json.dumps(result))
+        return
+
+    headers = [("accept-encoding", args.accept_encoding)] if args.accept_encoding else []
+    endpoints = {}
+
+    async def drive():
+        for path, query in bench_cases(main.app):
+            name = f"{path}?{query}" if query else path
+            endpoints[name] = {
+                mode: await measure(main.app, path, query, args.requests, args.concurrency, mode == "uncached", headers)
+                for mode in ("uncached", "cached")
+            }
+
+    asyncio.run(drive())
+    snapshot = main.current_snapshot()
+    result.update({
+        "rows": len(snapshot.rows),
+        "batches": len(snapshot.batches),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "endpoints": endpoints,
+    })
+    print(json.dumps(result))
+
+
+def serverless_worker():
+    """Cold start through serverless.py; prints one JSON document."""
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import serverless
+    result = {"import_s": round(time.perf_counter() - started, 3), "first_byte_s": {}}
+
+    async def drive():
+        for path in SERVERLESS_PATHS:
+            marks, sent = {}, time.perf_counter()
+            status, _ = await asgi_get(serverless.app, path, marks=marks)
+            result["first_byte_s"][path] = round(marks["first_byte"] - sent, 4)
+            result.setdefault("statuses", []).append(status)
+
+    asyncio.run(drive())
+    # Process start to the first /healthz byte: what a platform health check sees
+    result["healthz_ready_s"] = round(result["import_s"] + result["first_byte_s"]["/healthz"], 3)
+    result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    print(json.dumps(result))
+
+
+def _child(args, source, cache_dir, startup_only=False, serverless=False):
+    command = [
+        sys.executable, "-m", "bench.run", "--worker",
+        "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+        "--accept-encoding", args.accept_encoding,
+    ]
+    if startup_only:
+        command.append("--startup-only")
+    if serverless:
+        command.append("--serverless")
+    env = {**os.environ, "WIP_SOURCE": source, "WIP_CACHE_DIR": cache_dir, "WIP_WATCH_INTERVAL": "0"}
+    env.pop("WIP_SHARED_DIR", None)
+    done = subprocess.run(command, cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def dataset_path(data_dir, rows, seed, fmt):
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"wip_{rows}_s{seed}.{fmt}")
+    if not os.path.exists(path):
+        print(f"generating {rows:,} rows -> {path}", file=sys.stderr)
+        write(generate(rows, seed=seed), path)
+    return path
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import fastapi
+    import pandas as pd
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "fastapi": fastapi.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Lines describing p50 changes beyond ``tolerance`` (e.g. 0.2 = 20%)."""
+    regressions, lines = 0, []
+    old_runs = {run["rows"]: run for run in baseline["runs"]}
+    for run in current["runs"]:
+        old = old_runs.get(run["rows"])
+        if old is None:
+            continue
+        for name, modes in run["endpoints"].items():
+            for mode, stats in modes.items():
+                before = old["endpoints"].get(name, {}).get(mode)
+                if not before or not before["p50_ms"]:
+                    continue
+                ratio = stats["p50_ms"] / before["p50_ms"]
+                if abs(ratio - 1) > tolerance:
+                    flag = "REGRESSION" if ratio > 1 else "faster"
+                    regressions += ratio > 1
+                    lines.append(
+                        f"{run['rows']:>10,} {name:<45} {mode:<8} "
+                        f"{before['p50_ms']:>9.3f} -> {stats['p50_ms']:>9.3f} ms  x{ratio:.2f} {flag}"
+                    )
+    return regressions, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every endpoint over synthetic datasets.")
+    parser.add_argument("--sizes", default="10k", help="comma separated, e.g. 10k,1m,10m")
+    parser.add_argument("--requests", type=int, default=30, help="measured requests per endpoint and mode")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv", help="synthetic source format")
+    parser.add_argument("--data-dir", default=os.path.join(ROOT, "bench", ".data"))
+    parser.add_argument("--accept-encoding", default="gzip")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench", "results.json"))
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--startup-budget", type=float, help="max seconds to the first serverless /healthz byte")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--startup-only", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--serverless", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        if args.serverless:
+            serverless_worker()
+        else:
+            worker(args)
+        return 0
+
+    baseline = None
+    if args.baseline:  # read first: --output may point at the same file
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    results = {"meta": _metadata(), "settings": {
+        "requests": args.requests, "concurrency": args.concurrency, "seed": args.seed,
+        "format": args.format, "accept_encoding": args.accept_encoding, "startup_budget_s": args.startup_budget,
+    }, "runs": []}
+    over_budget = 0
+    for size in args.sizes.split(","):
+        rows = parse_size(size)
+        source = dataset_path(args.data_dir, rows, args.seed, args.format)
+        with tempfile.TemporaryDirectory(prefix="wip-bench-cache-") as cache_dir:
+            run = _child(args, source, cache_dir)
+            warm = _child(args, source, cache_dir, startup_only=True)
+        with tempfile.TemporaryDirectory(prefix="wip-bench-cache-") as cache_dir:
+            serverless = _child(args, source, cache_dir, serverless=True)
+        run["cold_startup_s"] = run.pop("startup_s")
+        run["warm_startup_s"] = warm["startup_s"]
+        run["warm_startup_peak_rss_mb"] = warm["startup_peak_rss_mb"]
+        run["serverless"] = serverless
+        results["runs"].append(run)
+        print(f"{rows:>10,} rows: cold start {run['cold_startup_s']}s, warm start {run['warm_startup_s']}s, "
+              f"peak RSS {run['peak_rss_mb']} MB", file=sys.stderr)
+        first_chart = serverless["first_byte_s"][SERVERLESS_PATHS[1]]
+        print(f"{'':>10} serverless: import {serverless['import_s']}s, /healthz ready after "
+              f"{serverless['healthz_ready_s']}s, first chart byte after {first_chart}s", file=sys.stderr)
+        if args.startup_budget is not None and serverless["healthz_ready_s"] > args.startup_budget:
+            over_budget += 1
+            print(f"{'':>10} OVER BUDGET: /healthz ready after {serverless['healthz_ready_s']}s "
+                  f"> {args.startup_budget}s", file=sys.stderr)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+    regressions = 0
+    if baseline is not None:
+        regressions, lines = compare(results, baseline, args.tolerance)
+        print("\n".join(lines) or "no p50 change beyond tolerance", file=sys.stderr)
+    return 1 if regressions or over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""Chart payloads computed from a dataset snapshot.
+
+Each function returns the data part of one chart endpoint (without the
+``ai_insights`` text) and reads only prebuilt snapshot structures, or the
+selected facts of a filtered :class:`dataset.SnapshotView`. The
+endpoints in ``main.py`` and the ``/dashboard`` bundle share these functions,
+so a bundle returns exactly what the individual calls would.
+"""
+import numpy as np
+
+from cube import mean_and_std
+from dataset import DELAY_THRESHOLD_DAYS, month_labels
+from engine import aggregate
+from metrics import stage
+
+
+def processing_days_histogram(snapshot, raw=True):
+    batch_processing = snapshot.batches
+
+    # Fixed bins (30 like your matplotlib code)
+    with stage("aggregate", rows=len(batch_processing)):
+        counts, bin_edges = np.histogram(batch_processing["processing_days"], bins=30)
+
+    content = {}
+    if raw:
+        with stage("format"):
+            content["raw_processing_days"] = batch_processing["processing_days"].tolist()  # all values
+    content.update({
+        "counts": counts.tolist(),          # histogram counts (y-axis)
+        "bin_edges": bin_edges.tolist(),    # histogram bin edges (x-axis)
+        "threshold": 2,
+    })
+    return content
+
+
+def delay_share(snapshot, threshold_days=DELAY_THRESHOLD_DAYS):
+    with stage("aggregate"):
+        stats = snapshot.delay_stats(None, threshold_days).iloc[0]
+    total, delayed = int(stats["total_batches"]), int(stats["delayed_batches"])
+
+    return {
+        "categories": ["On Time", "Delayed"],
+        "percentages": [
+            (total - delayed) / total * 100 if total else 0,  # On Time %
+            delayed / total * 100 if total else 0             # Delayed %
+        ],
+        "threshold_days": threshold_days,
+    }
+
+
+def monthly_average_delay(snapshot):
+    # Monthly average processing days of batches, rolled up from the batch cube
+    with stage("aggregate"):
+        (months,), cells = snapshot.rollup("batches", ["month"])
+        avg_delay, _ = mean_and_std(cells)
+
+    with stage("format"):
+        months = month_labels(months)  # e.g., "2024-01"
+
+    return {
+        "months": months,
+        "avg_processing_days": avg_delay.tolist(),  # y-axis values
+        "threshold": 2,  # delay threshold
+    }
+
+
+def line_average_delay(snapshot):
+    # Average processing days of WIP rows per line, rolled up from the row cube
+    with stage("aggregate"):
+        (lines,), cells = snapshot.rollup("rows", ["LINE_NO"])
+        avg_delay, _ = mean_and_std(cells)
+
+    return {
+        "lines": [str(line) for line in lines],       # x-axis labels
+        "avg_processing_days": avg_delay.tolist(),  # y-axis values
+        "threshold": 2,
+    }
+
+
+def line_monthly_average_delay(snapshot):
+    # Roll the batch cube up to month x line (already the pivoted layout)
+    with stage("aggregate"):
+        (months, lines), cells = snapshot.rollup("batches", ["month", "LINE_NO"])
+        avg_delay, _ = mean_and_std(cells)
+        avg_delay = np.nan_to_num(avg_delay, nan=0.0)  # months without batches on a line
+
+    with stage("format"):
+        month_names = month_labels(months)
+        by_line = {str(line): avg_delay[:, i].tolist() for i, line in enumerate(lines)}
+
+    return {
+        "months": month_names,
+        "lines": by_line,
+        "threshold": 2,
+    }
+
+
+def delayed_batches_by_line(snapshot, threshold_days=DELAY_THRESHOLD_DAYS):
+    # Count delayed batches per line (lines without delays are left out)
+    with stage("aggregate"):
+        delayed_by_line = aggregate(
+            snapshot, ["LINE_NO"], ["delayed"], threshold_days=threshold_days,
+            having={"delayed": 1}, sort="delayed",
+        )
+
+    return {
+        "lines": delayed_by_line["LINE_NO"].astype(str).tolist(),        # x-axis
+        "delayed_batches": delayed_by_line["delayed"].tolist(),
+        "threshold_days": threshold_days,
+    }
+
+
+def delayed_vs_total_batches(snapshot, threshold_days=DELAY_THRESHOLD_DAYS):
+    with stage("aggregate"):
+        # Totals and delayed counts per line, largest workload first
+        line_stats = aggregate(
+            snapshot, ["LINE_NO"], ["count", "delayed"], threshold_days=threshold_days, sort="count",
+        )
+
+        # On-time = total - delayed
+        line_stats["on_time_batches"] = line_stats["count"] - line_stats["delayed"]
+
+    return {
+        "lines": line_stats["LINE_NO"].astype(str).tolist(),
+        "total_batches": line_stats["count"].tolist(),
+        "delayed_batches": line_stats["delayed"].tolist(),
+        "on_time_batches": line_stats["on_time_batches"].tolist(),
+        "threshold_days": threshold_days,
+    }
+
+
+def top_delay_formulas(snapshot, threshold_days=DELAY_THRESHOLD_DAYS):
+    with stage("aggregate"):
+        # --- Top 15 formulas by delay rate (%) ---
+        top_formulas = aggregate(
+            snapshot, ["FORMULA_ID"], ["delay_rate"], threshold_days=threshold_days, sort="delay_rate", top=15,
+        )
+
+    return {
+        "formula_ids": top_formulas["FORMULA_ID"].astype(str).tolist(),
+        "delay_rates": top_formulas["delay_rate"].round(2).tolist(),
+        "threshold_days": threshold_days,
+    }
+
+
+def monthly_delay_rate(snapshot, threshold_days=DELAY_THRESHOLD_DAYS):
+    # Monthly delay stats
+    with stage("aggregate"):
+        delay_by_month = snapshot.delay_stats("month", threshold_days)
+        delay_by_month["delay_rate"] = (
+            delay_by_month["delayed_batches"] / delay_by_month["total_batches"] * 100
+        )
+
+    with stage("format"):
+        months = month_labels(delay_by_month["month"])  # Period -> "YYYY-MM"
+
+    return {
+        "months": months,
+        "delay_rates": delay_by_month["delay_rate"].round(2).tolist(),
+        "threshold": 50,
+        "threshold_days": threshold_days,
+    }
+
+
+def line_scrap_factor(snapshot):
+    df = snapshot.rows
+
+    # Group by line to compute mean scrap factor
+    # Averaged in float64 even when the column is stored as float32
+    with stage("aggregate", rows=len(df)):
+        line_scrap = (
+            df["SCRAP_FACTOR"].astype(np.float64)
+            .groupby(df["LINE_NO"], observed=True).mean()
+            .reset_index()
+        )
+
+    return {
+        "lines": line_scrap["LINE_NO"].astype(str).tolist(),
+        "avg_scrap_factor": line_scrap["SCRAP_FACTOR"].round(4).tolist(),
+    }
+
+
+def delay_reasons_by_line(snapshot, top_n_reasons=None, lines=None):
+    # Delayed WIP rows per line x reason: one bincount over the row cube's codes
+    where = {"is_delayed": [True]}
+    if lines:
+        where["LINE_NO"] = lines
+    with stage("aggregate"):
+        (line_labels, reasons), cells = snapshot.rollup("rows", ["LINE_NO", "REASON"], where=where)
+    counts = cells["count"].astype(np.int64)
+    reasons = np.asarray(reasons, dtype=object)
+
+    # Convert to structured JSON, one dict per line with at least one delay
+    with stage("format"):
+        result = {}
+        for i in np.flatnonzero(counts.any(axis=1)):
+            row = counts[i]
+            cols = np.flatnonzero(row)
+            if top_n_reasons is not None and len(cols) > top_n_reasons:
+                # Partial selection, then order just the survivors by count
+                cols = cols[np.argpartition(-row[cols], top_n_reasons - 1)[:top_n_reasons]]
+                cols = cols[np.lexsort((cols, -row[cols]))]
+            result[str(line_labels[i])] = dict(zip(reasons[cols].tolist(), row[cols].tolist()))
+
+    return {
+        "delay_reasons_by_line": result,
+        "threshold_days": 2,
+    }
+
+
+def delay_reasons_top10(snapshot):
+    delayed = snapshot.delayed_rows  # fixed threshold = 2
+
+    with stage("aggregate", rows=len(delayed)):
+        delay_reasons = (
+            delayed.groupby("REASON", observed=True)
+            .size()
+            .reset_index(name="count")
+            .sort_values("count", ascending=False)
+            .head(10)
+        )
+
+    total_delayed = delay_reasons["count"].sum()
+    delay_reasons["share_percent"] = (delay_reasons["count"] / total_delayed * 100).round(2)
+
+    return {
+        "top_delay_reasons": delay_reasons.to_dict(orient="records"),
+        "threshold_days": 2,
+    }
+
+
+# Chart name (= endpoint path without "/") -> payload function
+CHARTS = {
+    "processing-days-histogram": processing_days_histogram,
+    "delay-share": delay_share,
+    "monthly-average-delay": monthly_average_delay,
+    "line-average-delay": line_average_delay,
+    "line-monthly-average-delay": line_monthly_average_delay,
+    "delayed-batches-by-line": delayed_batches_by_line,
+    "delayed-vs-total-batches": delayed_vs_total_batches,
+    "top-delay-formulas": top_delay_formulas,
+    "monthly-delay-rate": monthly_delay_rate,
+    "line-scrap-factor": line_scrap_factor,
+    "delay-reasons-by-line": delay_reasons_by_line,
+    "delay-reasons-top10": delay_reasons_top10,
+}
+
+# Charts whose delay threshold is a parameter (the others use the fixed 2 days)
+THRESHOLD_CHARTS = {
+    "delay-share", "delayed-batches-by-line", "delayed-vs-total-batches", "top-delay-formulas",
+    "monthly-delay-rate",
+}
+
+
+def render(name, snapshot, threshold_days=DELAY_THRESHOLD_DAYS, **options):
+    """Payload of chart ``name``; ``options`` are that chart's own parameters."""
+    if name in THRESHOLD_CHARTS:
+        return CHARTS[name](snapshot, threshold_days, **options)
+    return CHARTS[name](snapshot, **options)
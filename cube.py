@@ -0,0 +1,267 @@
+"""Pre-aggregated cube of processing days over categorical dimensions.
+
+A :class:`Cube` stores ``count``, ``sum`` and ``sum_sq`` of
+``processing_days`` for every non-empty combination of its dimensions
+(e.g. month x line x formula x reason x delayed). Dimension values are
+dictionary encoded as integer codes, so any slice, dice or roll-up is a
+mask plus one ``np.bincount`` per measure over the stored cells, never a
+pass over the underlying rows.
+"""
+import numpy as np
+
+from schema import factorize
+
+MEASURES = ("size", "count", "sum", "sum_sq")
+
+# Refuse roll-ups whose dense result would be unreasonably large
+MAX_DENSE_CELLS = 2_000_000
+
+
+class Cube:
+    """Size / count / sum / sum-of-squares cells keyed by dimension codes.
+
+    ``labels[dim]`` holds the sorted values of each dimension; code ``-1``
+    stands for a missing value. ``size`` counts facts, ``count`` only facts
+    with a ``processing_days`` value, so ``sum / count`` is the mean.
+    """
+
+    def __init__(self, dims, labels, codes, size, count, sum_, sum_sq):
+        self.dims = list(dims)
+        self.labels = labels
+        self.codes = codes          # shape (len(dims), n_cells)
+        self.size = size
+        self.count = count
+        self.sum = sum_
+        self.sum_sq = sum_sq
+
+    @classmethod
+    def from_frame(cls, frame, dims, value="processing_days"):
+        labels, columns = {}, []
+        for dim in dims:
+            codes, uniques = factorize(frame[dim])
+            labels[dim] = uniques
+            columns.append(codes)
+
+        values = frame[value].to_numpy(dtype=np.float64, na_value=np.nan)
+        has_value = ~np.isnan(values)
+        values = np.where(has_value, values, 0.0)
+        measures = {
+            "size": np.ones(len(frame)),
+            "count": has_value.astype(np.float64),
+            "sum": values,
+            "sum_sq": values * values,
+        }
+        return cls._from_cells(dims, labels, columns, measures, len(frame))
+
+    @classmethod
+    def _from_cells(cls, dims, labels, columns, measures, n):
+        """Aggregate per-fact (or per-cell) measures into unique cells.
+
+        Cells whose measures all cancel out to zero are dropped and labels no
+        cell uses any more are pruned, so the result is exactly what
+        :meth:`from_frame` would build from the underlying facts.
+        """
+        # Shift codes by one so missing values (-1) get their own slot
+        shape = tuple(len(labels[dim]) + 1 for dim in dims)
+        cell_ids = _cell_ids([codes + 1 for codes in columns], shape, n)
+        cells, inverse = np.unique(cell_ids, return_inverse=True)
+        sums = {
+            name: np.bincount(inverse, weights=measures[name], minlength=len(cells))
+            for name in MEASURES
+        }
+
+        # A retracted and re-added fact can cancel the size but not the sums
+        keep = np.any([sums[name] != 0 for name in MEASURES], axis=0)
+        cells = cells[keep]
+        sums = {name: values[keep] for name, values in sums.items()}
+        codes = np.array(np.unravel_index(cells, shape), dtype=np.int32).reshape(len(dims), len(cells)) - 1
+
+        # Drop labels left without cells (e.g. after retracting facts)
+        labels = dict(labels)
+        for d, dim in enumerate(dims):
+            used = np.unique(codes[d][codes[d] >= 0])
+            if len(used) < len(labels[dim]):
+                remap = np.full(len(labels[dim]), -1, dtype=np.int32)
+                remap[used] = np.arange(len(used), dtype=np.int32)
+                present = codes[d] >= 0
+                codes[d][present] = remap[codes[d][present]]
+                labels[dim] = labels[dim][used]
+        return cls(dims, labels, codes, sums["size"], sums["count"], sums["sum"], sums["sum_sq"])
+
+    def merge(self, other, sign=1):
+        """New cube holding the cells of both; ``sign=-1`` retracts ``other``.
+
+        Labels are unioned (and stay sorted), codes of both sides are mapped
+        onto the union and equal cells are summed. The cost depends on the
+        number of stored cells, not on the number of underlying facts.
+        """
+        labels, columns = {}, []
+        for d, dim in enumerate(self.dims):
+            union = self.labels[dim].union(other.labels[dim])
+            labels[dim] = union
+            columns.append(np.concatenate([
+                _recode(self.codes[d], self.labels[dim], union),
+                _recode(other.codes[d], other.labels[dim], union),
+            ]))
+        measures = {
+            name: np.concatenate([getattr(self, name), sign * getattr(other, name)])
+            for name in MEASURES
+        }
+        n = self.codes.shape[1] + other.codes.shape[1]
+        return Cube._from_cells(self.dims, labels, columns, measures, n)
+
+    def codes_for(self, dim, values):
+        """Codes of the labels of ``dim`` whose string form is in ``values``."""
+        wanted = {str(v) for v in values}
+        return np.flatnonzero([str(label) in wanted for label in self.labels[dim]])
+
+    def rollup(self, keep, where=None):
+        """Reduce the cube onto the ``keep`` dimensions.
+
+        ``where`` maps a dimension to the label values to keep (matched on
+        their string form). Cells with a missing value in a kept dimension
+        are dropped, like ``groupby`` does. Returns ``(labels, measures)``:
+        the labels of each kept dimension and a dense array per measure with
+        one axis per kept dimension.
+        """
+        self._check_dims(keep, where)
+        shape = tuple(len(self.labels[dim]) for dim in keep)
+        size = int(np.prod(shape, dtype=np.int64))
+        if size > MAX_DENSE_CELLS:
+            raise ValueError(f"Roll-up onto {list(keep)} would produce more than {MAX_DENSE_CELLS} cells")
+
+        mask, axes = self._selected(keep, where)
+        ids = _cell_ids([codes[mask] for codes in axes], shape, int(mask.sum()))
+        measures = {
+            name: np.bincount(ids, weights=getattr(self, name)[mask], minlength=size).reshape(shape)
+            for name in MEASURES
+        }
+        return [self.labels[dim] for dim in keep], measures
+
+    def sparse_rollup(self, keep, where=None):
+        """Like :meth:`rollup`, but only the non-empty ``keep`` combinations.
+
+        Returns ``(labels, codes, measures)``: the labels of each kept
+        dimension, the codes of each combination (shape ``(len(keep), n)``,
+        in label order) and one value per combination and measure. It costs
+        a sort of the selected cells, whatever the number of possible
+        combinations, so it has no ``MAX_DENSE_CELLS`` limit.
+        """
+        mask, axes = self._selected(keep, where)
+        codes, measures = _sorted_groups(
+            [axis[mask] for axis in axes], {name: getattr(self, name)[mask] for name in MEASURES}, int(mask.sum()),
+        )
+        return [self.labels[dim] for dim in keep], codes, measures
+
+    def _check_dims(self, keep, where):
+        unknown = [dim for dim in list(keep) + list(where or {}) if dim not in self.dims]
+        if unknown:
+            raise ValueError(f"Unknown cube dimension(s): {', '.join(map(str, unknown))}")
+
+    def _selected(self, keep, where):
+        """``(mask of the cells matching where with no missing keep value, keep code arrays)``."""
+        self._check_dims(keep, where)
+        mask = np.ones(self.codes.shape[1], dtype=bool)
+        for dim, values in (where or {}).items():
+            mask &= np.isin(self.codes[self.dims.index(dim)], self.codes_for(dim, values))
+        axes = [self.codes[self.dims.index(dim)] for dim in keep]
+        for codes in axes:
+            mask &= codes >= 0
+        return mask, axes
+
+
+def rollup_frame(frame, keep, where=None, value="processing_days"):
+    """What ``Cube.from_frame(frame, dims).rollup(keep, where)`` returns, without the cube.
+
+    One ``np.bincount`` per measure straight over the facts of ``frame``.
+    This is cheaper than building a cube that is rolled up only once (e.g.
+    for a filtered subset). Labels are the values present in ``frame``.
+    """
+    labels, axes, weights = _frame_facts(frame, keep, where, value)
+    shape = tuple(len(uniques) for uniques in labels)
+    size = int(np.prod(shape, dtype=np.int64))
+    if size > MAX_DENSE_CELLS:
+        raise ValueError(f"Roll-up onto {list(keep)} would produce more than {MAX_DENSE_CELLS} cells")
+
+    ids = _cell_ids(axes, shape, len(weights["size"]))
+    measures = {
+        name: np.bincount(ids, weights=weights[name], minlength=size).reshape(shape)
+        for name in MEASURES
+    }
+    return labels, measures
+
+
+def sparse_rollup_frame(frame, keep, where=None, value="processing_days"):
+    """What ``Cube.from_frame(frame, dims).sparse_rollup(keep, where)`` returns, without the cube."""
+    labels, axes, weights = _frame_facts(frame, keep, where, value)
+    codes, measures = _sorted_groups(axes, weights, len(weights["size"]))
+    return labels, codes, measures
+
+
+def _frame_facts(frame, keep, where, value):
+    """``(labels, codes, measures)`` of each fact of ``frame`` matching ``where`` with every ``keep`` value."""
+    mask = np.ones(len(frame), dtype=bool)
+    for dim, values in (where or {}).items():
+        codes, uniques = factorize(frame[dim])
+        wanted = {str(v) for v in values}
+        mask &= np.isin(codes, np.flatnonzero([str(label) in wanted for label in uniques]))
+    labels, axes = [], []
+    for dim in keep:
+        codes, uniques = factorize(frame[dim])
+        labels.append(uniques)
+        axes.append(codes)
+        mask &= codes >= 0
+
+    values = frame[value].to_numpy(dtype=np.float64, na_value=np.nan)[mask]
+    has_value = ~np.isnan(values)
+    values = np.where(has_value, values, 0.0)
+    weights = {
+        "size": np.ones(len(values)), "count": has_value.astype(np.float64), "sum": values, "sum_sq": values * values,
+    }
+    return labels, [codes[mask] for codes in axes], weights
+
+
+def _recode(codes, labels, new_labels):
+    """Map codes into ``labels`` onto positions in ``new_labels``."""
+    lookup = new_labels.get_indexer(labels)
+    out = np.full(len(codes), -1, dtype=np.int32)
+    present = codes >= 0
+    out[present] = lookup[codes[present]]
+    return out
+
+
+def _sorted_groups(columns, measures, n):
+    """Sort facts (or cells) by their code ``columns`` and sum the measures of equal codes."""
+    codes = np.empty((len(columns), n), dtype=np.intp)
+    for d, column in enumerate(columns):
+        codes[d] = column
+    order = np.lexsort(codes[::-1]) if columns else np.arange(n)
+    codes = codes[:, order]
+    starts = run_starts(codes)
+    return codes[:, starts], {
+        name: np.add.reduceat(values[order], starts) if n else np.zeros(0) for name, values in measures.items()
+    }
+
+
+def run_starts(codes):
+    """Where each run of equal columns of sorted ``codes`` (shape ``(dims, n)``) starts."""
+    first = np.ones(codes.shape[1], dtype=bool)
+    first[1:] = (codes[:, 1:] != codes[:, :-1]).any(axis=0)
+    return np.flatnonzero(first)
+
+
+def _cell_ids(columns, shape, n):
+    """Linear cell id of each fact; every fact shares cell 0 when there are no dims."""
+    if not columns:
+        return np.zeros(n, dtype=np.intp)
+    return np.ravel_multi_index(columns, shape)
+
+
+def mean_and_std(measures):
+    """Per-cell mean and sample standard deviation (NaN where undefined)."""
+    count, sum_, sum_sq = measures["count"], measures["sum"], measures["sum_sq"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sum_ / count
+        var = (sum_sq - sum_ * mean) / (count - 1)
+    std = np.where(count < 2, np.nan, np.sqrt(np.clip(var, 0, None)))
+    return mean, std
@@ -0,0 +1,463 @@
+"""Dataset snapshots shared by all chart endpoints.
+
+Most charts work on batches rather than raw WIP rows: a batch starts at the
+earliest ``WIP_ACT_START_DATE`` of its rows and completes at the latest
+``WIP_CMPLT_DATE``. The batch table and every derived column are built once
+per loaded dataset and wrapped in a read-only :class:`Snapshot`. Handlers grab
+the current snapshot once per request and only read from it, so concurrent
+requests never write to shared frames.
+"""
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from alerts import ControlCharts
+from cube import Cube, rollup_frame, sparse_rollup_frame
+from drilldown import BatchIndex
+from filter_index import FilterIndex, day_number
+from quantiles import build_sketch
+from schema import codes_in, compact, date_values, factorize, memory_report
+
+log = logging.getLogger(__name__)
+
+# Batches taking longer than this many days count as delayed
+DELAY_THRESHOLD_DAYS = 2
+
+# Dimensions with a prebuilt DelayIndex (None = all batches)
+INDEXED_DIMENSIONS = (None, "LINE_NO", "FORMULA_ID", "month")
+
+# Cube dimensions; is_delayed is the bucket at DELAY_THRESHOLD_DAYS
+BATCH_CUBE_DIMENSIONS = ("month", "LINE_NO", "FORMULA_ID", "is_delayed")
+ROW_CUBE_DIMENSIONS = ("month", "LINE_NO", "FORMULA_ID", "REASON", "is_delayed")
+CUBE_DIMENSIONS = {"batches": BATCH_CUBE_DIMENSIONS, "rows": ROW_CUBE_DIMENSIONS}
+
+
+def build_batch_table(df, threshold_days=DELAY_THRESHOLD_DAYS):
+    """Collapse WIP rows into one row per ``WIP_BATCH_ID``.
+
+    Columns: ``WIP_BATCH_ID``, ``LINE_NO``, ``FORMULA_ID``,
+    ``WIP_ACT_START_DATE``, ``WIP_CMPLT_DATE``, ``processing_days``,
+    ``month`` and ``is_delayed``. A batch runs on a single line with a single
+    formula, so those are taken from its first row.
+    """
+    batches = (
+        df.groupby("WIP_BATCH_ID", observed=True)
+          .agg({
+              "LINE_NO": "first",
+              "FORMULA_ID": "first",
+              "WIP_ACT_START_DATE": "min",
+              "WIP_CMPLT_DATE": "max",
+          })
+          .reset_index()
+    )
+    return add_derived_columns(batches, threshold_days)
+
+
+def add_derived_columns(frame, threshold_days=DELAY_THRESHOLD_DAYS):
+    """Add ``processing_days``, ``month`` and ``is_delayed`` to WIP rows or batches."""
+    start = date_values(frame["WIP_ACT_START_DATE"])
+    days = (date_values(frame["WIP_CMPLT_DATE"]) - start).dt.days
+    if days.dtype.kind == "i":  # no missing dates: narrowest integer type
+        days = pd.to_numeric(days, downcast="integer")
+    frame["processing_days"] = days
+    frame["month"] = start.dt.to_period("M")
+    frame["is_delayed"] = frame["processing_days"] > threshold_days
+    return frame
+
+
+def month_labels(months):
+    """Format a Series/Index of monthly periods as ``"YYYY-MM"`` strings."""
+    return pd.PeriodIndex(months, freq="M").strftime("%Y-%m").tolist()
+
+
+class DelayIndex:
+    """Batches grouped by one dimension, sorted by ``processing_days``.
+
+    All groups live in one array of ``group * span + days`` keys, so the
+    delayed count of every group for any threshold is a single vectorized
+    ``searchsorted`` instead of a rescan of the batch table.
+    """
+
+    # Spare room in the key range so appended batches rarely force a rebuild
+    DAY_HEADROOM = 366
+
+    def __init__(self, batches, by=None):
+        self.by = by
+        if by is None:
+            self.labels = pd.Index([None])
+            codes = np.zeros(len(batches), dtype=np.intp)
+        else:
+            codes, self.labels = factorize(batches[by])
+
+        # Totals count every batch of the group, like groupby(...).count()
+        self.totals = np.bincount(codes[codes >= 0], minlength=len(self.labels))
+
+        days = batches["processing_days"].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = (codes >= 0) & ~np.isnan(days)
+        codes, days = codes[valid], days[valid]
+        self._low = days.min() if len(days) else 0.0
+        self._span = (days.max() - self._low if len(days) else 0.0) + 2 + self.DAY_HEADROOM
+        self._keys = np.sort(codes * self._span + (days - self._low))
+        self._counts = np.bincount(codes, minlength=len(self.labels))
+        self._ends = np.cumsum(self._counts)
+
+    def delayed_counts(self, threshold_days=DELAY_THRESHOLD_DAYS):
+        """Number of batches per group with ``processing_days > threshold_days``."""
+        # Clip so the probe always lands inside its own group's key range
+        offset = min(max(threshold_days - self._low, -0.5), self._span - 1)
+        probes = np.arange(len(self.labels)) * self._span + offset
+        return self._ends - np.searchsorted(self._keys, probes, side="right")
+
+    def _encode(self, batches):
+        """Group codes and keys of ``batches``; None if a label is unknown."""
+        if self.by is None:
+            codes = np.zeros(len(batches), dtype=np.intp)
+        else:
+            values = batches[self.by]
+            codes = codes_in(self.labels, values)
+            if ((codes < 0) & values.notna().to_numpy()).any():
+                return None
+        days = batches["processing_days"].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = (codes >= 0) & ~np.isnan(days)
+        if (days[valid] < self._low).any() or (days[valid] > self._low + self._span - 2).any():
+            return None
+        return codes, codes[valid], np.sort(codes[valid] * self._span + (days[valid] - self._low))
+
+    def updated(self, removed, added):
+        """Copy with the ``removed`` batches taken out and ``added`` put in.
+
+        Costs O(len(removed) + len(added)) searches plus one array copy.
+        Returns None when the group labels or the day range would change;
+        the caller then builds a fresh index.
+        """
+        old, new = self._encode(removed), self._encode(added)
+        if old is None or new is None:
+            return None
+        n = len(self.labels)
+        totals = (
+            self.totals
+            - np.bincount(old[0][old[0] >= 0], minlength=n)
+            + np.bincount(new[0][new[0] >= 0], minlength=n)
+        )
+        if (totals == 0).any():
+            return None  # a group disappeared, labels change
+
+        old_keys = old[2]
+        # Position of every removed key, duplicates resolved to consecutive slots
+        first = np.searchsorted(self._keys, old_keys, side="left")
+        nth = np.arange(len(old_keys)) - np.searchsorted(old_keys, old_keys, side="left")
+        keys = np.delete(self._keys, first + nth)
+        keys = np.insert(keys, np.searchsorted(keys, new[2]), new[2])
+
+        index = object.__new__(DelayIndex)
+        index.by, index.labels, index.totals = self.by, self.labels, totals
+        index._low, index._span, index._keys = self._low, self._span, keys
+        index._counts = (
+            self._counts
+            - np.bincount(old[1], minlength=n)
+            + np.bincount(new[1], minlength=n)
+        )
+        index._ends = np.cumsum(index._counts)
+        return index
+
+
+class Snapshot:
+    """One immutable, versioned view of the dataset.
+
+    ``rows`` holds the WIP rows with row-level ``processing_days``, ``month``
+    and ``is_delayed``; ``batches`` the table from :func:`build_batch_table`;
+    ``delayed_rows`` the delayed rows that carry a ``REASON``;
+    ``delay_index`` a :class:`DelayIndex` per entry of ``INDEXED_DIMENSIONS``;
+    ``batch_cube`` / ``row_cube`` the pre-aggregated :class:`cube.Cube` of
+    batches and of WIP rows; ``quantile_sketch`` the processing-day
+    percentile sketch of :mod:`quantiles`; ``control_charts`` the per-line
+    monthly :class:`alerts.ControlCharts`. None of these may be modified once published;
+    build a new snapshot instead.
+    """
+
+    __slots__ = (
+        "version", "loaded_at", "rows", "batches", "delayed_rows", "delay_index",
+        "batch_cube", "row_cube", "quantile_sketch", "control_charts", "_lazy_indexes",
+    )
+
+    # Filters a view was cut with (see filtered()); a snapshot itself has none
+    filters = None
+
+    def __init__(self, version, rows, batches, delayed_rows,
+                 delay_index=None, batch_cube=None, row_cube=None, quantile_sketch=None, control_charts=None):
+        # Derived structures not handed in (e.g. by incremental ingest) are built here
+        set_ = super().__setattr__
+        set_("version", version)
+        set_("loaded_at", time.time())
+        set_("rows", rows)
+        set_("batches", batches)
+        set_("delayed_rows", delayed_rows)
+        set_("delay_index", delay_index or {by: DelayIndex(batches, by) for by in INDEXED_DIMENSIONS})
+        set_("batch_cube", batch_cube or Cube.from_frame(batches, BATCH_CUBE_DIMENSIONS))
+        set_("row_cube", row_cube or Cube.from_frame(rows, ROW_CUBE_DIMENSIONS))
+        set_("quantile_sketch", quantile_sketch or build_sketch(batches))
+        set_("control_charts", control_charts or ControlCharts.from_batches(batches))
+        set_("_lazy_indexes", {})  # built on first use, see _lazy_index()
+
+    def delay_stats(self, by=None, threshold_days=DELAY_THRESHOLD_DAYS):
+        """Total and delayed batch counts per ``by`` group, one row per group."""
+        index = self.delay_index[by]
+        return _delay_stats_frame(by, index.labels, index.totals, index.delayed_counts(threshold_days))
+
+    def rollup(self, grain, keep, where=None):
+        """:meth:`cube.Cube.rollup` of the ``"batches"`` or ``"rows"`` cube."""
+        return (self.batch_cube if grain == "batches" else self.row_cube).rollup(keep, where)
+
+    def sparse_rollup(self, grain, keep, where=None):
+        """:meth:`cube.Cube.sparse_rollup` of the ``"batches"`` or ``"rows"`` cube."""
+        return (self.batch_cube if grain == "batches" else self.row_cube).sparse_rollup(keep, where)
+
+    def _lazy_index(self, key, build):
+        return _lazy(self._lazy_indexes, key, build)
+
+    def filter_index(self, table):
+        """:class:`FilterIndex` of ``"rows"``, ``"batches"`` or ``"delayed_rows"``.
+
+        Built on first use, so snapshots nobody filters never pay for it.
+        """
+        return self._lazy_index(table, lambda: FilterIndex(getattr(self, table)))
+
+    def batch_index(self):
+        """:class:`drilldown.BatchIndex` for paging through batches, built on first use."""
+        return self._lazy_index("batch_index", lambda: BatchIndex(self.batches, self.rows))
+
+    def filtered(self, start=None, end=None, lines=None, formulas=None, months=None):
+        """:class:`SnapshotView` of the rows and batches matching every given filter.
+
+        ``start`` / ``end`` bound ``WIP_ACT_START_DATE`` (inclusive dates; a
+        batch starts at its earliest row). Lines, formulas and months
+        (``"YYYY-MM"``) match on their string form, like the cube's ``where``.
+        Without filters the snapshot itself is returned.
+        """
+        filters = {
+            name: value
+            for name, value in (("start", start), ("end", end), ("lines", lines),
+                                ("formulas", formulas), ("months", months))
+            if value
+        }
+        if not filters:
+            return self
+        query = {
+            "start": None if start is None else day_number(start),
+            "end": None if end is None else day_number(end),
+            "months": months,
+            "LINE_NO": lines or None,
+            "FORMULA_ID": formulas or None,
+        }
+        return SnapshotView(self, filters, query)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Snapshot is read-only, cannot set {name!r}")
+
+    def __repr__(self):
+        return f"<Snapshot {self.version} rows={len(self.rows)} batches={len(self.batches)}>"
+
+
+class SnapshotView:
+    """The rows and batches of a :class:`Snapshot` that match some filters.
+
+    Nothing is rebuilt for the subset. Positions come from the parent's
+    :meth:`Snapshot.filter_index`, and a table is taken from the parent on
+    first use. Delay counts and cube roll-ups are one ``np.bincount`` over
+    the selected facts, and :func:`engine.aggregate` runs on the parent with
+    the view's filters. Charts read a view like a snapshot.
+    """
+
+    __slots__ = ("parent", "filters", "version", "loaded_at", "_query", "_tables")
+
+    def __init__(self, parent, filters, query):
+        set_ = super().__setattr__
+        set_("parent", parent)
+        set_("filters", filters)
+        set_("version", parent.version)
+        set_("loaded_at", parent.loaded_at)
+        set_("_query", query)  # FilterIndex.select() arguments
+        set_("_tables", {})
+
+    def positions(self, table):
+        """Sorted positions of the selected facts in the parent's ``table``."""
+        return _lazy(self._tables, ("positions", table), lambda: self.parent.filter_index(table).select(**self._query))
+
+    def _table(self, table):
+        return _lazy(self._tables, table, lambda: getattr(self.parent, table).iloc[self.positions(table)])
+
+    @property
+    def rows(self):
+        return self._table("rows")
+
+    @property
+    def batches(self):
+        return self._table("batches")
+
+    @property
+    def delayed_rows(self):
+        return self._table("delayed_rows")
+
+    def delay_stats(self, by=None, threshold_days=DELAY_THRESHOLD_DAYS):
+        """Like :meth:`Snapshot.delay_stats`, counted over the selected batches."""
+        batches = self.batches
+        if by is None:
+            codes, labels = np.zeros(len(batches), dtype=np.intp), pd.Index([None])
+        else:
+            codes, labels = factorize(batches[by])
+        days = batches["processing_days"].to_numpy(dtype=np.float64, na_value=np.nan)
+        kept = codes >= 0
+        with np.errstate(invalid="ignore"):
+            late = days[kept] > threshold_days
+        totals = np.bincount(codes[kept], minlength=len(labels))
+        delayed = np.bincount(codes[kept], weights=late, minlength=len(labels)).astype(np.int64)
+        return _delay_stats_frame(by, labels, totals, delayed)
+
+    def rollup(self, grain, keep, where=None):
+        """Like :meth:`Snapshot.rollup`, over the selected batches or rows."""
+        _check_cube_dims(grain, keep, where)
+        return rollup_frame(self._table(grain), keep, where)
+
+    def sparse_rollup(self, grain, keep, where=None):
+        """Like :meth:`Snapshot.sparse_rollup`, over the selected batches or rows."""
+        _check_cube_dims(grain, keep, where)
+        return sparse_rollup_frame(self._table(grain), keep, where)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"SnapshotView is read-only, cannot set {name!r}")
+
+    def __repr__(self):
+        return f"<SnapshotView {self.version} {self.filters}>"
+
+
+def _check_cube_dims(grain, keep, where):
+    unknown = [dim for dim in list(keep) + list(where or {}) if dim not in CUBE_DIMENSIONS[grain]]
+    if unknown:
+        raise ValueError(f"Unknown cube dimension(s): {', '.join(map(str, unknown))}")
+
+
+def _delay_stats_frame(by, labels, totals, delayed):
+    stats = pd.DataFrame({"total_batches": totals, "delayed_batches": delayed})
+    if by is not None:
+        stats.insert(0, by, labels)
+    return stats
+
+
+def _lazy(cache, key, build):
+    """``cache[key]``, built once with ``build()`` on first use."""
+    value = cache.get(key)
+    if value is None:
+        with _lazy_index_lock:
+            value = cache.get(key)
+            if value is None:
+                value = cache[key] = build()
+    return value
+
+
+_sequence = itertools.count(1)
+_lazy_index_lock = threading.RLock()  # a view's tables build on its parent's filter index
+
+
+def build_snapshot(df, version=None, threshold_days=DELAY_THRESHOLD_DAYS, previous=None):
+    """Derive every table the endpoints need from the raw WIP rows.
+
+    The rows are first converted to the compact dtypes of :mod:`schema`. The
+    version defaults to the source hash recorded by :func:`loader.load_wip`.
+    With ``previous`` (the snapshot being replaced), control-chart state of
+    lines and months whose batches did not change is carried over.
+    """
+    if version is None:
+        source_key = df.attrs.get("source_key")
+        version = source_key[:12] if source_key else f"local-{next(_sequence)}"
+
+    raw, df = df, compact(df)
+    if log.isEnabledFor(logging.INFO):
+        report = memory_report(raw, df)
+        log.info("Compact schema: %d -> %d bytes", report["bytes_before"].sum(), report["bytes_after"].sum())
+    del raw
+    add_derived_columns(df, threshold_days)
+    delayed_rows = df[df["is_delayed"]].dropna(subset=["REASON"])
+
+    batches = build_batch_table(df, threshold_days)
+    control_charts = None
+    if previous is not None:
+        control_charts = ControlCharts.from_batches(batches, previous=previous.control_charts)
+    return Snapshot(version, df, batches, delayed_rows, control_charts=control_charts)
+
+
+_current = None
+_publish_lock = threading.Lock()
+_publish_listeners = []
+_first_use_load = None
+_first_use_lock = threading.Lock()
+_pinned = contextvars.ContextVar("pinned_snapshot", default=None)
+
+
+def on_publish(callback):
+    """Call ``callback(snapshot)`` every time a new snapshot is published."""
+    _publish_listeners.append(callback)
+    return callback
+
+
+def publish(snapshot, replaces=None):
+    """Make ``snapshot`` the one new requests see.
+
+    With ``replaces``, publish only if that snapshot is still the current
+    one (a compare-and-swap for read-modify-publish callers such as
+    ingest). Returns ``snapshot``, or None when it was not published.
+    """
+    global _current
+    with _publish_lock:
+        if replaces is not None and _current is not replaces:
+            return None
+        _current = snapshot
+        for callback in _publish_listeners:
+            callback(snapshot)
+    return snapshot
+
+
+def publish_on_first_use(load):
+    """Publish ``load()`` when a snapshot is first needed instead of now."""
+    global _first_use_load
+    _first_use_load = load
+
+
+def loaded_snapshot():
+    """The published snapshot, or None; never triggers a first-use load."""
+    return _current
+
+
+def current_snapshot():
+    """Return the active snapshot; keep the reference for the whole request."""
+    pinned = _pinned.get()
+    if pinned is not None:
+        return pinned
+    if _current is None:
+        with _first_use_lock:
+            if _current is None and _first_use_load is not None:
+                publish(_first_use_load())
+        if _current is None:
+            raise RuntimeError("No dataset snapshot has been published yet")
+    return _current
+
+
+@contextlib.contextmanager
+def pinned_snapshot(snapshot=None):
+    """Pin ``snapshot`` (default: the current one) for everything running in this context.
+
+    A publish in the middle of a request then cannot mix two versions.
+    """
+    if snapshot is None:
+        snapshot = current_snapshot()
+    token = _pinned.set(snapshot)
+    try:
+        yield snapshot
+    finally:
+        _pinned.reset(token)
@@ -0,0 +1,208 @@
+"""Keyset-paginated listing of individual batches.
+
+A :class:`BatchIndex` keeps the batch table pre-sorted for every sort key
+and direction, with ``WIP_BATCH_ID`` as the tie-breaker. Each batch therefore
+has a unique position, and a page cursor only carries the sort value and
+the id of the last batch returned. The next page starts at a binary search
+for that pair. It then scans forward in chunks, testing the filters on the
+chunk's codes, until the page is full. The cost depends on the page size and
+on how selective the filters are, not on how deep the page is. Only the
+returned batches are ever turned into records.
+
+Cursors stay valid across reloads: a batch added or removed before the
+cursor just does not shift the following pages.
+"""
+import base64
+import json
+
+import numpy as np
+
+from schema import codes_in, date_values, factorize
+
+SORT_KEYS = ("processing_days", "date")
+
+# First chunk scanned per page (grows while the filters keep rejecting)
+MIN_CHUNK = 1024
+
+
+def encode_cursor(sort, order, value, batch_id):
+    raw = json.dumps([sort, order, value, batch_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """``(sort, order, value, batch_id)``; ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort, order, value, batch_id = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("invalid cursor") from exc
+    return sort, order, value, batch_id
+
+
+class BatchIndex:
+    """Sorted orders, filter codes and batch reasons of one batch table."""
+
+    def __init__(self, batches, rows):
+        self.batches = batches
+        self.ids, self.id_labels = factorize(batches["WIP_BATCH_ID"])  # batch ids are unique: code = rank
+
+        start = date_values(batches["WIP_ACT_START_DATE"])
+        self.keys = {
+            "processing_days": batches["processing_days"].to_numpy(dtype=np.float64, na_value=np.nan),
+            # Seconds since the epoch; NaT -> NaN like a missing processing_days
+            "date": np.where(start.isna(), np.nan, start.to_numpy().astype("datetime64[s]").astype(np.float64)),
+        }
+        self._orders = {}
+
+        # Label codes of the filterable dimensions
+        self.dimensions = {}
+        for dim in ("LINE_NO", "FORMULA_ID", "month"):
+            codes, labels = factorize(batches[dim])
+            self.dimensions[dim] = (codes, [str(label) for label in labels])
+
+        # Distinct (batch, reason) pairs of the rows, once sorted by batch and once by reason
+        batch_of_row = codes_in(self.id_labels, rows["WIP_BATCH_ID"])
+        reason_codes, reason_labels = factorize(rows["REASON"])
+        keep = (batch_of_row >= 0) & (reason_codes >= 0)
+        pairs = np.unique(batch_of_row[keep].astype(np.int64) * len(reason_labels) + reason_codes[keep])
+        pair_batch, pair_reason = np.divmod(pairs, max(len(reason_labels), 1))
+        self.reason_labels = [str(label) for label in reason_labels]
+        # Reasons of the batch with id code c: reasons_of[bounds[c]:bounds[c + 1]]
+        self.reasons_of = pair_reason
+        self.reason_bounds = np.searchsorted(pair_batch, np.arange(len(self.id_labels) + 1))
+        by_reason = np.lexsort((pair_batch, pair_reason))
+        self.batches_with = pair_batch[by_reason]  # id codes, grouped by reason, ascending
+        self.reason_ends = np.searchsorted(pair_reason[by_reason], np.arange(len(reason_labels) + 1))
+
+    def _order(self, sort, descending):
+        """Positions sorted by (key, id); missing keys last in both directions."""
+        cached = self._orders.get((sort, descending))
+        if cached is None:
+            sign = -1 if descending else 1
+            key, ids = sign * self.keys[sort], sign * self.ids
+            order = np.lexsort((ids, key))  # NaN sorts last
+            cached = self._orders[(sort, descending)] = (order, key[order], ids[order])
+        return cached
+
+    def _start(self, sort, descending, cursor):
+        """First sorted rank after the cursor's (value, id)."""
+        _, keys, ids = self._order(sort, descending)
+        if cursor is None:
+            return 0
+        value, batch_id = cursor
+        sign = -1 if descending else 1
+        value = np.nan if value is None else sign * float(value)
+        lo, hi = np.searchsorted(keys, value, side="left"), np.searchsorted(keys, value, side="right")
+        # Rank of the cursor's id; an id that is gone sits half-way between its neighbours
+        rank = int(self.id_labels.searchsorted(batch_id))
+        found = rank < len(self.id_labels) and self.id_labels[rank] == batch_id
+        threshold = sign * (rank if found else rank - 0.5)
+        return int(lo + np.searchsorted(ids[lo:hi], threshold, side="right"))
+
+    def _mask(self, positions, wanted, reasons, min_days):
+        keep = np.ones(len(positions), dtype=bool)
+        for dim, table in wanted.items():
+            keep &= table[self.dimensions[dim][0][positions]]
+        if min_days is not None:
+            keep &= self.keys["processing_days"][positions] >= min_days
+        if reasons is not None:
+            if len(reasons):
+                ids = self.ids[positions]
+                at = np.minimum(np.searchsorted(reasons, ids), len(reasons) - 1)
+                keep &= reasons[at] == ids
+            else:
+                keep[:] = False
+        return keep
+
+    def page(self, sort="processing_days", order="desc", limit=50, cursor=None,
+             lines=None, formulas=None, months=None, reasons=None, min_days=None):
+        """``(positions, next_cursor)`` of one page; ``cursor`` as returned before.
+
+        Lines, formulas, months (``"YYYY-MM"``) and reasons match on their
+        string form. A batch matches a reason when any of its rows has it.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        descending = order == "desc"
+        if cursor is not None:
+            c_sort, c_order, value, batch_id = decode_cursor(cursor)
+            if (c_sort, c_order) != (sort, order):
+                raise ValueError("cursor belongs to a different sort order")
+            cursor = (value, batch_id)
+
+        # label -> allowed, as a lookup table over each dimension's codes (-1 = missing)
+        wanted = {}
+        for dim, values in (("LINE_NO", lines), ("FORMULA_ID", formulas), ("month", months)):
+            if values:
+                names = {str(v) for v in values}
+                wanted[dim] = np.array([label in names for label in self.dimensions[dim][1]] + [False])
+        if reasons:
+            names = {str(v) for v in reasons}
+            codes = [i for i, label in enumerate(self.reason_labels) if label in names]
+            reasons = np.unique(np.concatenate(
+                [self.batches_with[self.reason_ends[c]:self.reason_ends[c + 1]] for c in codes] or [[]]
+            ).astype(np.int64))
+        else:
+            reasons = None
+
+        positions, keys, _ = self._order(sort, descending)
+        begin, end = self._start(sort, descending, cursor), len(positions)
+        if sort == "processing_days" and min_days is not None:
+            # min_days bounds the scan directly on this key
+            if descending:
+                end = int(np.searchsorted(keys, -min_days, side="right"))
+            else:
+                begin = max(begin, int(np.searchsorted(keys, min_days, side="left")))
+
+        found, chunk = [], max(MIN_CHUNK, 4 * limit)
+        needed = limit + 1  # one extra tells whether another page exists
+        while begin < end and needed > 0:
+            candidates = positions[begin:min(end, begin + chunk)]
+            hits = candidates[self._mask(candidates, wanted, reasons, min_days)][:needed]
+            found.append(hits)
+            needed -= len(hits)
+            begin += len(candidates)
+            chunk *= 2
+
+        selected = np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+        next_cursor = None
+        if len(selected) > limit:
+            selected = selected[:limit]
+            last = selected[-1]
+            value = self.keys[sort][last]
+            batch_id = self.id_labels[self.ids[last]]
+            next_cursor = encode_cursor(
+                sort, order, None if np.isnan(value) else float(value),
+                batch_id.item() if isinstance(batch_id, np.generic) else batch_id,
+            )
+        return selected, next_cursor
+
+    def batch_reasons(self, position):
+        """Distinct reasons of the rows of the batch at ``position``."""
+        code = self.ids[position]
+        return [self.reason_labels[r] for r in self.reasons_of[self.reason_bounds[code]:self.reason_bounds[code + 1]]]
+
+    def records(self, positions):
+        """JSON-ready dicts of the batches at ``positions`` (a page, not the table)."""
+        page = self.batches.iloc[positions]
+
+        def plain(series):
+            return series.astype(object).where(series.notna(), None).tolist()
+
+        def timestamps(column):
+            values = date_values(page[column])
+            return plain(values.dt.strftime("%Y-%m-%dT%H:%M:%S").where(values.notna()))
+
+        columns = {
+            "WIP_BATCH_ID": plain(page["WIP_BATCH_ID"]),
+            "LINE_NO": plain(page["LINE_NO"]),
+            "FORMULA_ID": plain(page["FORMULA_ID"]),
+            "start": timestamps("WIP_ACT_START_DATE"),
+            "completed": timestamps("WIP_CMPLT_DATE"),
+            "processing_days": plain(page["processing_days"]),
+            "month": plain(page["month"].dt.strftime("%Y-%m")),
+            "is_delayed": plain(page["is_delayed"]),
+            "reasons": [self.batch_reasons(position) for position in positions],
+        }
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
@@ -0,0 +1,200 @@
+"""One vectorized group-by engine for batch and row metrics.
+
+``aggregate(snapshot, by, metrics, ...)`` is the pipeline behind the
+per-dimension charts and ``/aggregate``:
+
+1. rows are selected through the snapshot's filter index (positions only);
+2. every ``by`` column becomes integer codes. The combined code of a row is
+   its group, with empty groups dropped like ``groupby`` does;
+3. each metric is one ``np.bincount`` (or a ``np.minimum.at`` for min / max)
+   over the group codes;
+4. ``sort`` + ``top`` pick the first groups with a partial selection
+   (``np.argpartition``), then order only those.
+
+Counts and delayed counts of one indexed dimension over all batches come
+straight from the snapshot's :class:`dataset.DelayIndex` without a scan. A
+:class:`dataset.SnapshotView` is answered from its parent, with the view's
+filters.
+Ties in the sort key always keep label order, so results are deterministic.
+"""
+import numpy as np
+import pandas as pd
+
+from dataset import DELAY_THRESHOLD_DAYS, INDEXED_DIMENSIONS
+from filter_index import day_number
+from schema import factorize
+
+METRICS = ("count", "delayed", "delay_rate", "mean_days", "min_days", "max_days", "mean_scrap")
+GRAINS = ("batches", "rows")
+DIMENSIONS = {
+    "batches": ("month", "LINE_NO", "FORMULA_ID"),
+    "rows": ("month", "LINE_NO", "FORMULA_ID", "REASON"),
+}
+
+# Metrics the delay index answers without a scan
+INDEX_METRICS = {"count", "delayed", "delay_rate"}
+
+# Group id spaces up to this size use a dense bincount, larger ones np.unique
+DENSE_GROUPS = 4_000_000
+
+
+def validate(by, metrics, grain, sort=None):
+    """ValueError describing the first unsupported argument."""
+    if grain not in GRAINS:
+        raise ValueError(f"grain must be one of {', '.join(GRAINS)}")
+    unknown = [dim for dim in by if dim not in DIMENSIONS[grain]]
+    if unknown or len(set(by)) != len(by):
+        raise ValueError(f"by must be distinct values of {', '.join(DIMENSIONS[grain])} for {grain}")
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric(s): {', '.join(unknown)}; available: {', '.join(METRICS)}")
+    if grain == "batches" and "mean_scrap" in metrics:
+        raise ValueError("mean_scrap is a row metric; use grain=rows")
+    if sort is not None and sort not in metrics:
+        raise ValueError("sort must be one of the requested metrics")
+
+
+def uses_index(by, metrics, grain="batches", filters=None):
+    """True when :func:`aggregate` is answered from the delay index (cheap)."""
+    return (
+        grain == "batches" and not filters and len(by) <= 1
+        and (by[0] if by else None) in INDEXED_DIMENSIONS and set(metrics) <= INDEX_METRICS
+    )
+
+
+def _select(snapshot, table, filters):
+    if not filters:
+        return None
+    return snapshot.filter_index(table).select(
+        start=None if filters.get("start") is None else day_number(filters["start"]),
+        end=None if filters.get("end") is None else day_number(filters["end"]),
+        months=filters.get("months"),
+        LINE_NO=filters.get("lines"),
+        FORMULA_ID=filters.get("formulas"),
+    )
+
+
+def _groups(frame, by, positions):
+    """``(group of each kept fact, kept mask, label columns)``; groups in label order."""
+    n = len(frame) if positions is None else len(positions)
+    codes, labels = [], []
+    for dim in by:
+        column = frame[dim] if positions is None else frame[dim].iloc[positions]
+        dim_codes, dim_labels = factorize(column)
+        codes.append(dim_codes)
+        labels.append(dim_labels)
+
+    kept = np.ones(n, dtype=bool)
+    for dim_codes in codes:
+        kept &= dim_codes >= 0
+    shape = tuple(len(dim_labels) for dim_labels in labels)
+    if not by:
+        return np.zeros(int(kept.sum()), dtype=np.intp), kept, {}
+    ids = np.ravel_multi_index([dim_codes[kept] for dim_codes in codes], shape)
+
+    size = int(np.prod(shape, dtype=np.int64))
+    if size <= DENSE_GROUPS:
+        present = np.flatnonzero(np.bincount(ids, minlength=size))
+        remap = np.zeros(size, dtype=np.intp)
+        remap[present] = np.arange(len(present))
+        group = remap[ids]
+    else:
+        present, group = np.unique(ids, return_inverse=True)
+    axes = np.unravel_index(present, shape)
+    columns = {dim: dim_labels[axis] for dim, dim_labels, axis in zip(by, labels, axes)}
+    return group, kept, columns
+
+
+def _reduce(frame, positions, kept, group, n_groups, metrics, threshold_days):
+    def column(name):
+        values = frame[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        if positions is not None:
+            values = values[positions]
+        return values[kept]
+
+    out = {}
+    count = np.bincount(group, minlength=n_groups)
+    days = column("processing_days") if set(metrics) - {"count", "mean_scrap"} else None
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for metric in metrics:
+            if metric == "count":
+                out[metric] = count
+            elif metric in ("delayed", "delay_rate"):
+                delayed = np.bincount(group, weights=days > threshold_days, minlength=n_groups).astype(np.int64)
+                out[metric] = delayed if metric == "delayed" else delayed / count * 100
+            elif metric in ("mean_days", "mean_scrap"):
+                values = days if metric == "mean_days" else column("SCRAP_FACTOR")
+                has = ~np.isnan(values)
+                total = np.bincount(group[has], weights=values[has], minlength=n_groups)
+                out[metric] = total / np.bincount(group[has], minlength=n_groups)
+            else:  # min_days / max_days
+                has = ~np.isnan(days)
+                fill, reduce = (np.inf, np.minimum) if metric == "min_days" else (-np.inf, np.maximum)
+                extreme = np.full(n_groups, fill)
+                reduce.at(extreme, group[has], days[has])
+                out[metric] = np.where(np.isinf(extreme), np.nan, extreme)
+    return out
+
+
+def top_k(key, k=None, descending=True):
+    """Positions of the ``k`` first entries of ``key`` (NaN last, ties by position).
+
+    A partial selection finds the ``k`` entries, and only those are sorted.
+    """
+    key = np.asarray(key, dtype=np.float64)
+    key = np.where(np.isnan(key), np.inf, -key if descending else key)
+    if k is None or k >= len(key):
+        return np.lexsort((np.arange(len(key)), key))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    kth = np.partition(key, k - 1)[k - 1]
+    below = np.flatnonzero(key < kth)
+    chosen = np.concatenate([below, np.flatnonzero(key == kth)[:k - len(below)]])
+    return chosen[np.lexsort((chosen, key[chosen]))]
+
+
+def aggregate(snapshot, by, metrics=("count",), grain="batches", threshold_days=DELAY_THRESHOLD_DAYS,
+              filters=None, having=None, sort=None, descending=True, top=None):
+    """Metrics per ``by`` group as a DataFrame (``by`` columns first).
+
+    ``filters`` takes the chart filters (``start``, ``end``, ``lines``,
+    ``formulas``) plus ``months``. ``having`` maps a metric to the minimum a
+    group needs to be kept. ``sort`` names a metric, and ``top`` keeps only
+    the first groups in that order. Without ``sort``, groups come in label
+    order.
+    """
+    by, metrics = list(by), list(metrics)
+    validate(by, metrics, grain, sort)
+    if snapshot.filters:
+        # A filtered view: select through its parent's index with the view's filters
+        if filters:
+            raise ValueError("filters cannot be combined with a filtered view")
+        snapshot, filters = snapshot.parent, snapshot.filters
+    needed = list(dict.fromkeys(metrics + list(having or {})))
+
+    if uses_index(by, needed, grain, filters):
+        stats = snapshot.delay_stats(by[0] if by else None, threshold_days)
+        columns = {dim: stats[dim].to_numpy() for dim in by}
+        count = stats["total_batches"].to_numpy()
+        delayed = stats["delayed_batches"].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = {"count": count, "delayed": delayed, "delay_rate": delayed / count * 100}
+        values = {metric: values[metric] for metric in needed}
+    else:
+        frame = getattr(snapshot, grain)
+        positions = _select(snapshot, grain, filters)
+        group, kept, columns = _groups(frame, by, positions)
+        n_groups = len(next(iter(columns.values()))) if by else int(len(group) > 0)
+        values = _reduce(frame, positions, kept, group, n_groups, needed, threshold_days)
+
+    result = pd.DataFrame({**columns, **values})
+    if having:
+        keep = np.ones(len(result), dtype=bool)
+        for metric, minimum in having.items():
+            keep &= (result[metric] >= minimum).to_numpy()
+        result = result[keep]
+    if sort is not None:
+        result = result.iloc[top_k(result[sort].to_numpy(), top, descending)]
+    elif top is not None:
+        result = result.head(top)
+    return result[by + metrics].reset_index(drop=True)
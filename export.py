@@ -0,0 +1,113 @@
+"""Chunked NDJSON / CSV export of the batch table and its aggregates.
+
+Exports are generators of encoded chunks. Only one chunk of rows is
+formatted at a time, so memory stays flat whatever the table size, and the
+client starts receiving rows while later chunks are still being produced.
+"""
+import numpy as np
+import pandas as pd
+
+from cube import mean_and_std, run_starts
+from schema import date_values
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Rows formatted per chunk
+CHUNK_ROWS = 20_000
+
+# Dimensions an aggregate export can group by (all in the batch cube)
+AGGREGATE_DIMENSIONS = ("month", "LINE_NO", "FORMULA_ID")
+
+BATCH_COLUMNS = (
+    "WIP_BATCH_ID", "LINE_NO", "FORMULA_ID", "WIP_ACT_START_DATE", "WIP_CMPLT_DATE",
+    "processing_days", "month", "is_delayed",
+)
+
+
+def _encode(frame, fmt, first):
+    if fmt == "csv":
+        return frame.to_csv(index=False, header=first, lineterminator="\n").encode()
+    if frame.empty:
+        return b""
+    return frame.to_json(orient="records", lines=True, force_ascii=False, double_precision=15).encode()
+
+
+def _strings(values):
+    # numpy formats datetimes in C; Series.dt.strftime goes row by row
+    text = np.datetime_as_string(values).astype(object)
+    text[np.isnat(values)] = None
+    return text
+
+
+def _timestamps(series):
+    return _strings(date_values(series).to_numpy().astype("datetime64[s]"))
+
+
+def _months(series):
+    return _strings(series.array.asi8.astype("datetime64[M]"))  # monthly ordinals count from 1970-01
+
+
+def batch_chunks(batches, positions=None, fmt="ndjson", chunk_rows=CHUNK_ROWS):
+    """Encoded chunks of ``batches`` (only the rows at ``positions`` if given)."""
+    total = len(batches) if positions is None else len(positions)
+    if total == 0 and fmt == "csv":
+        yield ",".join(BATCH_COLUMNS).encode() + b"\n"
+    for start in range(0, total, chunk_rows):
+        if positions is None:
+            chunk = batches.iloc[start:start + chunk_rows]
+        else:
+            chunk = batches.iloc[positions[start:start + chunk_rows]]
+        frame = pd.DataFrame({
+            "WIP_BATCH_ID": chunk["WIP_BATCH_ID"].to_numpy(),
+            "LINE_NO": chunk["LINE_NO"].to_numpy(),
+            "FORMULA_ID": chunk["FORMULA_ID"].to_numpy(),
+            "WIP_ACT_START_DATE": _timestamps(chunk["WIP_ACT_START_DATE"]),
+            "WIP_CMPLT_DATE": _timestamps(chunk["WIP_CMPLT_DATE"]),
+            "processing_days": chunk["processing_days"].to_numpy(),
+            "month": _months(chunk["month"]),
+            "is_delayed": chunk["is_delayed"].to_numpy(),
+        })
+        yield _encode(frame, fmt, first=start == 0)
+
+
+def aggregate_chunks(snapshot, by, where=None, fmt="ndjson", chunk_rows=CHUNK_ROWS):
+    """Encoded chunks of one row per non-empty ``by`` group of a snapshot's (or view's) batches.
+
+    Columns: the ``by`` labels (months as ``"YYYY-MM"``), ``total_batches``,
+    ``delayed_batches`` (at the cube's delay threshold) and the mean and
+    standard deviation of ``processing_days``. Groups come in label order.
+    Only populated cells are rolled up, so memory follows the number of
+    groups, not the product of the label counts.
+    """
+    labels, codes, cells = snapshot.sparse_rollup("batches", list(by) + ["is_delayed"], where=where)
+    late = np.asarray(labels[-1], dtype=bool)[codes[-1]]
+    cells["delayed"] = np.where(late, cells["size"], 0.0)
+    # Cells come in label order with is_delayed last: sum the runs of equal by codes
+    starts = run_starts(codes[:-1])
+    cells = {name: np.add.reduceat(values, starts) if len(starts) else values for name, values in cells.items()}
+    nonempty = cells["size"] > 0
+    codes = codes[:-1, starts[nonempty]]
+    cells = {name: values[nonempty] for name, values in cells.items()}
+    mean, std = mean_and_std(cells)
+    flat = {
+        "total_batches": cells["size"].astype(np.int64),
+        "delayed_batches": cells["delayed"].astype(np.int64),
+        "avg_processing_days": mean,
+        "std_processing_days": std,
+    }
+    names = [
+        pd.PeriodIndex(values, freq="M").strftime("%Y-%m") if dim == "month" else pd.Index(values)
+        for dim, values in zip(by, labels)
+    ]
+
+    columns = list(by) + list(flat)
+    total = len(flat["total_batches"])
+    if total == 0 and fmt == "csv":
+        yield ",".join(columns).encode() + b"\n"
+    for start in range(0, total, chunk_rows):
+        ids = slice(start, start + chunk_rows)
+        frame = pd.DataFrame({
+            **{dim: names[i][codes[i, ids]] for i, dim in enumerate(by)},
+            **{name: values[ids] for name, values in flat.items()},
+        }, columns=columns)
+        yield _encode(frame, fmt, first=start == 0)
@@ -0,0 +1,186 @@
+"""Incremental ingestion of new WIP rows.
+
+Instead of re-reading the workbook and regrouping the whole history, an
+append only regroups the new rows. The work is:
+
+* the new rows are grouped per batch and merged into the batch table: the
+  start becomes the earlier of the old and new starts, and completion the
+  later of the two completions;
+* the cubes (and the quantile sketch) get a small delta cube. The old facts of changed batches are
+  retracted and their new facts are added;
+* the sorted delay indexes get the changed keys removed and inserted.
+
+Existing frames are copied into the new snapshot once. No pass over the
+history groups, sorts or factorizes. The resulting snapshot equals a full
+rebuild from all rows.
+
+Appended rows live in memory only; a workbook reload replaces them.
+"""
+import hashlib
+import io
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cube import Cube
+from dataset import (
+    BATCH_CUBE_DIMENSIONS, DELAY_THRESHOLD_DAYS, INDEXED_DIMENSIONS, ROW_CUBE_DIMENSIONS,
+    DelayIndex, Snapshot, add_derived_columns, build_batch_table, current_snapshot, loaded_snapshot, publish,
+)
+from loader import DATE_COLUMNS, WIP_COLUMNS
+from quantiles import build_sketch
+from schema import compact, harmonize, value_dtype
+
+REQUIRED_COLUMNS = ["WIP_BATCH_ID", "LINE_NO", "FORMULA_ID", "WIP_ACT_START_DATE", "WIP_CMPLT_DATE"]
+
+PARQUET_MEDIA_TYPES = ("application/vnd.apache.parquet", "application/x-parquet", "application/parquet")
+
+# Appends are read-modify-publish; two at once would lose one of them. A
+# reload can still publish in between, so the merge is published only if its
+# base is still current (and redone on the new snapshot otherwise).
+_ingest_lock = threading.Lock()
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+def read_rows(body, content_type):
+    """Parse an uploaded CSV, JSON (records or ``{"rows": [...]}``) or Parquet body."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return pd.read_csv(io.BytesIO(body))
+    if media_type == "application/json":
+        data = json.loads(body)
+        if isinstance(data, dict) and "rows" in data:
+            data = data["rows"]
+        return pd.DataFrame(data)
+    if media_type in PARQUET_MEDIA_TYPES:
+        try:
+            return pd.read_parquet(io.BytesIO(body))
+        except ImportError as exc:
+            raise UnsupportedFormat("Parquet ingest needs pyarrow installed") from exc
+    raise UnsupportedFormat(f"Unsupported content type {media_type or '(none)'!r}; send CSV, JSON or Parquet")
+
+
+def normalize_rows(delta, like):
+    """Select the WIP columns of ``delta`` and parse them as the values of ``like``."""
+    missing = [col for col in REQUIRED_COLUMNS if col not in delta.columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    delta = delta.reindex(columns=WIP_COLUMNS)
+    for col in WIP_COLUMNS:
+        if col in DATE_COLUMNS:
+            delta[col] = pd.to_datetime(delta[col])
+        elif col in like.columns and value_dtype(like[col]) != object:
+            delta[col] = delta[col].astype(value_dtype(like[col]))
+        else:
+            delta[col] = delta[col].astype(object).where(delta[col].notna(), np.nan)
+    return delta
+
+
+def _id_keys(ids):
+    """Batch ids as sortable values; harmonized string ids compare by their (sorted) category codes."""
+    if isinstance(ids.dtype, pd.CategoricalDtype):
+        return ids.cat.codes.to_numpy()
+    return ids.to_numpy()
+
+
+def merge_rows(snapshot, delta, threshold_days=DELAY_THRESHOLD_DAYS):
+    """Return ``(new_snapshot, summary)`` with ``delta`` rows appended."""
+    if not len(delta):
+        raise ValueError("No rows to ingest")
+    delta = compact(normalize_rows(delta, snapshot.rows))
+    delta.index = pd.RangeIndex(len(snapshot.rows), len(snapshot.rows) + len(delta))
+    add_derived_columns(delta, threshold_days)
+
+    # New categories or wider values change the history's dtypes as well
+    old_rows, delta = harmonize(snapshot.rows, delta)
+    old_delayed, delayed = harmonize(snapshot.delayed_rows, delta[delta["is_delayed"]].dropna(subset=["REASON"]))
+    rows = pd.concat([old_rows, delta])
+    delayed_rows = pd.concat([old_delayed, delayed])
+
+    # --- Batch-level state: regroup only the batches the delta touches ---
+    old_batches, touched = harmonize(snapshot.batches, build_batch_table(delta, threshold_days))
+    old_ids = _id_keys(old_batches["WIP_BATCH_ID"])
+    touched_ids = _id_keys(touched["WIP_BATCH_ID"])
+    pos = np.searchsorted(old_ids, touched_ids)
+    exists = pos < len(old_ids)
+    exists[exists] = old_ids[pos[exists]] == touched_ids[exists]
+
+    before = old_batches.iloc[pos[exists]].reset_index(drop=True)
+    after = before.copy()
+    incoming = touched[exists].reset_index(drop=True)
+    for col, combine in (("WIP_ACT_START_DATE", np.fmin), ("WIP_CMPLT_DATE", np.fmax)):
+        after[col] = combine(before[col].to_numpy(), incoming[col].to_numpy())  # NaT-aware
+    for col in ("LINE_NO", "FORMULA_ID"):  # "first" keeps the old value unless it was missing
+        after[col] = before[col].where(before[col].notna(), incoming[col])
+    add_derived_columns(after, threshold_days)
+
+    keys = ["LINE_NO", "FORMULA_ID", "WIP_ACT_START_DATE", "WIP_CMPLT_DATE"]
+    same = before[keys].eq(after[keys]) | (before[keys].isna() & after[keys].isna())
+    changed = ~same.all(axis=1).to_numpy()
+    removed, updated = before[changed], after[changed]
+    new_batches = touched[~exists]
+
+    batches, updated, new_batches = harmonize(old_batches.copy(), updated, new_batches)
+    if changed.any():
+        changed_pos = pos[exists][changed]
+        for i, col in enumerate(batches.columns):
+            batches.iloc[changed_pos, i] = updated[col].to_numpy()
+    if len(new_batches):
+        # Keep the table ordered by batch id, as a full groupby would
+        n = len(batches)
+        order = np.insert(np.arange(n), pos[~exists], np.arange(n, n + len(new_batches)))
+        batches = pd.concat([batches, new_batches], ignore_index=True).take(order).reset_index(drop=True)
+
+    # --- Aggregates: retract the old facts of changed batches, add the new ones ---
+    added = pd.concat([updated, new_batches], ignore_index=True)
+    batch_delta = Cube.from_frame(added, BATCH_CUBE_DIMENSIONS).merge(
+        Cube.from_frame(removed, BATCH_CUBE_DIMENSIONS), sign=-1
+    )
+    delay_index = {}
+    for by in INDEXED_DIMENSIONS:
+        index = snapshot.delay_index[by].updated(removed, added)
+        delay_index[by] = index if index is not None else DelayIndex(batches, by)
+
+    digest = hashlib.sha1(snapshot.version.encode())
+    digest.update(pd.util.hash_pandas_object(delta, index=False).to_numpy().tobytes())
+
+    new_snapshot = Snapshot(
+        digest.hexdigest()[:12],
+        rows,
+        batches,
+        delayed_rows,
+        delay_index=delay_index,
+        batch_cube=snapshot.batch_cube.merge(batch_delta),
+        row_cube=snapshot.row_cube.merge(Cube.from_frame(delta, ROW_CUBE_DIMENSIONS)),
+        quantile_sketch=snapshot.quantile_sketch.merge(
+            build_sketch(added).merge(build_sketch(removed), sign=-1)
+        ),
+        control_charts=snapshot.control_charts.updated(removed, added),
+    )
+    summary = {
+        "version": new_snapshot.version,
+        "rows_added": len(delta),
+        "batches_added": len(new_batches),
+        "batches_updated": len(updated),
+    }
+    return new_snapshot, summary
+
+
+def append_rows(delta, threshold_days=DELAY_THRESHOLD_DAYS):
+    """Merge ``delta`` into the current snapshot and publish the result.
+
+    If another snapshot (e.g. a workbook reload) is published while the
+    merge runs, ``delta`` is merged again into that one.
+    """
+    with _ingest_lock:
+        while True:
+            base = loaded_snapshot() or current_snapshot()  # the published one, even inside a pinned request
+            snapshot, summary = merge_rows(base, delta, threshold_days)
+            if publish(snapshot, replaces=base) is not None:
+                return summary
@@ -0,0 +1,196 @@
+"""Columnar on-disk cache for the WIP workbook.
+
+Parsing ``batch_details.xlsx`` with openpyxl is by far the slowest part of
+starting the API. The workbook is parsed once, dates are converted, and every
+column is written as its own ``.npy`` file. Later loads memory-map those files
+and never touch Excel.
+
+Cache entries are keyed on the workbook's size, mtime and SHA-1, so a new
+entry is only built when the workbook actually changes.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Only the columns the API reads are cached
+WIP_COLUMNS = [
+    "WIP_BATCH_ID",
+    "LINE_NO",
+    "FORMULA_ID",
+    "WIP_ACT_START_DATE",
+    "WIP_CMPLT_DATE",
+    "SCRAP_FACTOR",
+    "REASON",
+]
+DATE_COLUMNS = ["WIP_ACT_START_DATE", "WIP_CMPLT_DATE"]
+
+# Bump when the on-disk layout changes so old entries are ignored
+CACHE_FORMAT = 1
+
+
+def read_source(path):
+    """Parse the workbook (or a CSV export of it) and convert the date columns."""
+    if path.lower().endswith(".csv"):
+        frame = pd.read_csv(path, usecols=WIP_COLUMNS)
+    else:
+        frame = pd.read_excel(path, usecols=WIP_COLUMNS)
+    for col in DATE_COLUMNS:
+        frame[col] = pd.to_datetime(frame[col])
+    return frame
+
+
+def file_fingerprint(path, known=None):
+    """Return ``{"size", "mtime_ns", "sha1"}`` for ``path``.
+
+    When ``known`` has the same size and mtime the stored hash is reused, so
+    an unchanged workbook is never re-read just to be hashed.
+    """
+    st = os.stat(path)
+    if known and known.get("size") == st.st_size and known.get("mtime_ns") == st.st_mtime_ns:
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": known["sha1"]}
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": digest.hexdigest()}
+
+
+def write_columns(frame, directory):
+    """Write each column of ``frame`` as ``<directory>/<column>.npy``.
+
+    Object columns are dictionary encoded (int32 codes plus a category list in
+    ``meta.json``) so that every file can be memory-mapped.
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for col in frame.columns:
+        series = frame[col]
+        entry = {"name": col}
+        if series.dtype == object:
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            values = codes.astype(np.int32)
+            entry["categories"] = uniques.tolist()
+        else:
+            values = series.to_numpy()
+        np.save(os.path.join(directory, f"{col}.npy"), values, allow_pickle=False)
+        columns.append(entry)
+
+    with open(os.path.join(directory, "meta.json"), "w") as fh:
+        json.dump({"format": CACHE_FORMAT, "rows": len(frame), "columns": columns}, fh)
+
+
+def read_columns(directory, mmap=True):
+    """Rebuild the frame written by :func:`write_columns`.
+
+    With ``mmap``, numeric and date columns stay views of their mapped files
+    (one block per column, nothing is copied). Dictionary encoded columns
+    are decoded into memory.
+    """
+    with open(os.path.join(directory, "meta.json")) as fh:
+        meta = json.load(fh)
+
+    data = {}
+    for entry in meta["columns"]:
+        col = entry["name"]
+        values = np.load(os.path.join(directory, f"{col}.npy"), mmap_mode="r" if mmap else None)
+        if "categories" in entry:
+            # Decode back to the object column read_excel produced, NaN for -1
+            lookup = np.array(entry["categories"] + [np.nan], dtype=object)
+            values = lookup[values]
+        data[col] = values
+    # copy=False keeps each column as its own block instead of consolidating (copying) them
+    return pd.DataFrame(data, copy=False)
+
+
+def default_cache_dir(path):
+    return os.environ.get("WIP_CACHE_DIR") or os.path.join(
+        os.path.dirname(os.path.abspath(path)), ".wip_cache"
+    )
+
+
+def _read_index(index_path):
+    try:
+        with open(index_path) as fh:
+            index = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("format") == CACHE_FORMAT else None
+
+
+def _write_index(index_path, index):
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(index, fh)
+    os.replace(tmp, index_path)  # atomic, readers never see a half-written index
+
+
+def _try_write_index(index_path, index):
+    try:
+        _write_index(index_path, index)
+    except OSError:
+        pass
+
+
+def _build_entry(frame, cache_dir, stem, fingerprint):
+    entry = f"{stem}-{fingerprint['sha1'][:16]}"
+    target = os.path.join(cache_dir, entry)
+
+    # Write into a scratch directory first so a crash never leaves a partial entry
+    scratch = tempfile.mkdtemp(prefix=f".{entry}-", dir=cache_dir)
+    try:
+        write_columns(frame, scratch)
+        os.chmod(scratch, 0o755)  # mkdtemp is owner-only
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(scratch, target)
+    except BaseException:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    return entry
+
+
+def load_wip(path="batch_details.xlsx", cache_dir=None):
+    """Load the WIP rows, going through the columnar cache when possible.
+
+    The SHA-1 of the source is stored in ``frame.attrs["source_key"]``.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    index_path = os.path.join(cache_dir, f"{stem}.json")
+
+    index = _read_index(index_path)
+    fingerprint = file_fingerprint(path, known=index)
+
+    if index and index["sha1"] == fingerprint["sha1"]:
+        try:
+            frame = read_columns(os.path.join(cache_dir, index["entry"]))
+        except (OSError, ValueError, KeyError) as exc:
+            log.warning("WIP cache entry %s unreadable (%s), rebuilding", index["entry"], exc)
+        else:
+            if index["mtime_ns"] != fingerprint["mtime_ns"]:
+                # Touched but unchanged: refresh the stat so the hash is skipped next time
+                _try_write_index(index_path, {**index, **fingerprint})
+            frame.attrs["source_key"] = fingerprint["sha1"]
+            return frame
+
+    frame = read_source(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        entry = _build_entry(frame, cache_dir, stem, fingerprint)
+        _write_index(index_path, {"format": CACHE_FORMAT, "entry": entry, **fingerprint})
+        if index and index["entry"] != entry:
+            shutil.rmtree(os.path.join(cache_dir, index["entry"]), ignore_errors=True)
+    except OSError as exc:
+        # Read-only deployments (e.g. serverless) still work, just without the cache
+        log.warning("WIP cache at %s not writable (%s), serving without it", cache_dir, exc)
+
+    frame.attrs["source_key"] = fingerprint["sha1"]
+    return frame
@@ -1,18 +1,123 @@
 
-from fastapi.responses import JSONResponse
+import asyncio
+import contextlib
+import itertools
+import logging
+import os
+import sqlite3
+from datetime import date
+import time
+
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 
 # main.py
-from fastapi import FastAPI
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
 
-import pandas as pd
 import numpy as np
-import uvicorn
+
+import metrics
+import alerts
+import charts
+import engine
+import export
+from cube import mean_and_std
+from dataset import (
+    DELAY_THRESHOLD_DAYS, Snapshot, build_snapshot, current_snapshot, loaded_snapshot, month_labels, on_publish,
+    pinned_snapshot, publish, publish_on_first_use,
+)
+from filter_index import day_number
+from ingest import UnsupportedFormat, append_rows, read_rows
+from loader import load_wip
+from metrics import TimedJSONResponse as JSONResponse, stage
+from offload import OffloadTimeout, Offloader
+from quantiles import EXACT_DAYS, RELATIVE_ACCURACY, SKETCH_DIMENSIONS, quantile_name, quantiles
+from reloader import WorkbookWatcher
+from response_cache import CachedResponse, cache_key, response_cache
+from responses import BINARY_MEDIA_TYPE, encoded_response, etag, not_modified, pack_int32, prefers_binary
+from shared_store import shared_snapshot
+from singleflight import AsyncSingleFlight, SingleFlight
+from sqlstore import QueryTimeout, SQLStore
+
+log = logging.getLogger(__name__)
+
+SOURCE_PATH = os.environ.get("WIP_SOURCE", "batch_details.xlsx")
+# Multi-worker deployments: set WIP_SHARED_DIR so one process builds the snapshot
+# and every worker maps the same file instead of holding its own copy
+SHARED_DIR = os.environ.get("WIP_SHARED_DIR")
+# Serverless (set by serverless.py): the workbook is loaded by the first request
+# that needs it, or by /warmup, instead of while the module is imported
+LAZY_START = os.environ.get("WIP_LAZY_START") == "1"
+
+
+# Heavy chart computations (row scans, filtered views) run in a bounded process
+# pool so they can't stall cheap requests; see offload.py for the settings
+offloader = Offloader.from_env()
+
+# Concurrent loads of the same workbook (startup, watcher, manual refresh) share one build
+_loads = SingleFlight()
+
+
+def _load_snapshot(path):
+    started = time.perf_counter()
+    if SHARED_DIR:
+        snapshot = shared_snapshot(path, SHARED_DIR)
+    else:
+        # Control charts of unchanged lines / months carry over from the current snapshot
+        snapshot = build_snapshot(load_wip(path), previous=loaded_snapshot())
+    metrics.dataset_load_seconds.observe(time.perf_counter() - started)
+    return snapshot
+
+
+def load_snapshot(path):
+    snapshot, _ = _loads.do(os.path.abspath(path), _load_snapshot, path)
+    return snapshot
+
+
+async def request_snapshot():
+    """``current_snapshot()`` for async code: a first-use load runs on a thread, not the event loop."""
+    if loaded_snapshot() is None:
+        return await run_in_threadpool(current_snapshot)
+    return current_snapshot()
+
+
+def _log_warm_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.error("Warming up the dataset and offload workers failed", exc_info=future.exception())
+
+
+# Optional hot reload: WIP_WATCH_INTERVAL=<seconds> polls SOURCE_PATH (or the
+# newest .xlsx in WIP_DROP_DIR) and swaps in a rebuilt snapshot off the request path
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    interval = float(os.environ.get("WIP_WATCH_INTERVAL", "0"))
+    watcher = None
+    if interval > 0:
+        watcher = WorkbookWatcher(
+            SOURCE_PATH, drop_dir=os.environ.get("WIP_DROP_DIR"), interval=interval, load=load_snapshot,
+        )
+        watcher.start()
+    app.state.watcher = watcher
+    # Worker start-up and the first spool file (and with LAZY_START, the load
+    # itself) are paid in the background
+    warming = asyncio.get_running_loop().run_in_executor(None, lambda: offloader.warm(current_snapshot()))
+    warming.add_done_callback(_log_warm_failure)
+    yield
+    if watcher is not None:
+        watcher.stop()
+    await asyncio.wait([warming])  # the pool it starts must not outlive close()
+    offloader.close()
+    if sql_store is not None:
+        sql_store.close()
+
 
 app = FastAPI(
     title="Manufacturing Analytics API",
     version="3.0",
     servers=[{"url": "/"}],   # <= use relative base
+    lifespan=lifespan,
 )
 
 # If your function is served under /api (common on Vercel):
@@ -24,32 +129,231 @@ app.add_middleware(
     allow_credentials=False,  # "*" + credentials is invalid; set to False unless needed
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Value-Count", "X-Cache", "Server-Timing"],
 )
-# Load and preprocess data
-df = pd.read_excel("batch_details.xlsx")
-df["WIP_ACT_START_DATE"] = pd.to_datetime(df["WIP_ACT_START_DATE"])
-df["WIP_CMPLT_DATE"] = pd.to_datetime(df["WIP_CMPLT_DATE"])
-
-batch_processing = (
-    df.groupby("WIP_BATCH_ID")
-      .agg({"WIP_ACT_START_DATE": "min", "WIP_CMPLT_DATE": "max"})
-      .reset_index()
+# gzip for clients that accept it (bodies already brotli-encoded pass through)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Chart routes whose output depends only on their query and the dataset version
+CACHED_ROUTES = {
+    "/processing-days-histogram",
+    "/delay-share",
+    "/monthly-average-delay",
+    "/line-average-delay",
+    "/line-monthly-average-delay",
+    "/delayed-batches-by-line",
+    "/delayed-vs-total-batches",
+    "/top-delay-formulas",
+    "/monthly-delay-rate",
+    "/line-scrap-factor",
+    "/delay-reasons-by-line",
+    "/delay-reasons-top10",
+    "/cube",
+    "/dashboard",
+    "/batches",
+    "/processing-days-percentiles",
+    "/aggregate",
+    "/alerts",
+}
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request):
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+# Identical chart requests that miss the cache together (dashboard load, or
+# everyone right after a reload cleared it) are computed once and shared
+_renders = AsyncSingleFlight()
+
+
+async def _render_entry(request, call_next, key, version):
+    response = await call_next(request)
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    entry = CachedResponse(response.status_code, headers, body)
+    if response.status_code == 200:
+        headers.setdefault("etag", etag(version, *key[:3]))
+        response_cache.put(key, entry)
+    return entry
+
+
+# Serve chart responses as stored bytes (already compressed) when the same
+# route + query was answered for the current dataset version. Registered after
+# GZip so it wraps it and caches the final encoded body.
+@app.middleware("http")
+async def serve_cached_response(request: Request, call_next):
+    # Streamed dashboards are sent as they are computed, never buffered
+    if request.method != "GET" or request.url.path not in CACHED_ROUTES or wants_ndjson(request):
+        return await call_next(request)
+
+    with pinned_snapshot(await request_snapshot()) as snapshot:  # a reload mid-request can't mix versions
+        version = snapshot.version
+        key = cache_key(request, version)
+        entry = response_cache.get(key)
+        cache_status = "HIT"
+        if entry is None:
+            entry, shared = await _renders.do(key, lambda: _render_entry(request, call_next, key, version))
+            cache_status = "COALESCED" if shared else "MISS"
+
+    if entry.status_code == 200 and not_modified(request, entry.headers["etag"]):
+        return Response(status_code=304, headers={"ETag": entry.headers["etag"], "X-Cache": cache_status})
+    return Response(
+        content=entry.body,
+        status_code=entry.status_code,
+        headers={**entry.headers, "X-Cache": cache_status},
+    )
+
+
+# Outermost: latency histogram per route and a Server-Timing header listing the
+# stages the handler recorded (cache hits report no stages, just the total)
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    route = request.url.path if request.url.path in ROUTE_PATHS else "other"
+    with metrics.request_timings(route) as timings:
+        started = time.perf_counter()
+        response = await call_next(request)
+        elapsed = time.perf_counter() - started
+    metrics.request_seconds.observe(elapsed, route, request.method, str(response.status_code))
+    response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed, response.headers.get("x-cache"))
+    return response
+
+
+# Load and preprocess data (parsed once, then served from the columnar cache).
+# All derived tables live in a read-only snapshot; handlers take a reference to
+# the current one and never write to it.
+on_publish(lambda snapshot: response_cache.clear())
+# Each published version is spooled for the offload workers in the background,
+# so no heavy request waits on (or holds a lock around) writing it
+if __name__ != "__mp_main__":
+    on_publish(offloader.spool)
+# Optional embedded SQL copy for ad-hoc /query calls: WIP_SQL_DIR=<dir> writes
+# each published snapshot to an indexed SQLite file (see sqlstore.py)
+sql_store = SQLStore.from_env()
+if sql_store is not None and __name__ != "__mp_main__":
+    on_publish(sql_store.refresh)
+# Offload pool workers import the launching script as __mp_main__; they attach
+# to spooled snapshots and must not load the workbook themselves
+if __name__ != "__mp_main__":
+    if LAZY_START:
+        publish_on_first_use(lambda: load_snapshot(SOURCE_PATH))
+    else:
+        publish(load_snapshot(SOURCE_PATH))
+
+
+DATASET_ROWS = metrics.Gauge("wip_dataset_size", "Rows and batches in the served snapshot.", ("table",))
+DATASET_LOADED_AT = metrics.Gauge("wip_dataset_loaded_timestamp_seconds", "When the served snapshot was built.")
+CACHE_STATS = metrics.Gauge(
+    "wip_response_cache", "Response cache entries, bytes, hits, misses, evictions and hit_ratio.", ("stat",),
 )
-batch_processing["processing_days"] = (
-    (batch_processing["WIP_CMPLT_DATE"] - batch_processing["WIP_ACT_START_DATE"]).dt.days
+OFFLOAD = metrics.Gauge("wip_offload", "Offload pool size, limits, in-flight, completed and timed-out calls.", ("stat",))
+SQL_STORE = metrics.Gauge("wip_sql_store", "SQL store pool size, idle connections, queries and timeouts.", ("stat",))
+COALESCED = metrics.Gauge(
+    "wip_singleflight_calls", "Single-flight calls that computed (leader) or waited (shared).", ("flight", "role"),
 )
 
-# API endpoint (NO inputs, fixed for your chart)
-@app.get("/processing-days-histogram")
-def get_histogram():
-    # Fixed bins (30 like your matplotlib code)
-    counts, bin_edges = np.histogram(batch_processing["processing_days"], bins=30)
 
-    return JSONResponse(content={
-        "raw_processing_days": batch_processing["processing_days"].tolist(),  # all values
-        "counts": counts.tolist(),          # histogram counts (y-axis)
-        "bin_edges": bin_edges.tolist(),    # histogram bin edges (x-axis)
-        "threshold": 2 ,
+@metrics.collector
+def collect_dataset_and_cache():
+    snapshot = loaded_snapshot()  # a scrape must not trigger a lazy load
+    if snapshot is not None:
+        DATASET_ROWS.set(len(snapshot.rows), "rows")
+        DATASET_ROWS.set(len(snapshot.batches), "batches")
+        DATASET_LOADED_AT.set(snapshot.loaded_at)
+    for name, value in response_cache.stats().items():
+        CACHE_STATS.set(value, name)
+    for name, value in offloader.stats().items():
+        OFFLOAD.set(value, name)
+    if sql_store is not None:
+        for name, value in sql_store.stats().items():
+            SQL_STORE.set(value, name)
+    for name, flight in (("render", _renders), ("load", _loads)):
+        COALESCED.set(flight.leaders, name, "leader")
+        COALESCED.set(flight.shared, name, "shared")
+
+# Delay threshold in days, answered from the snapshot's sorted indexes for any value
+ThresholdDays = Query(
+    DELAY_THRESHOLD_DAYS,
+    alias="threshold",
+    ge=0,
+    description="Batches taking longer than this many days count as delayed",
+)
+
+
+def chart_filters(
+    start: date = Query(None, description="Only batches / rows starting on or after this date"),
+    end: date = Query(None, description="Only batches / rows starting on or before this date"),
+    lines: list[str] = Query(None, description="Only these lines"),
+    formulas: list[str] = Query(None, description="Only these formulas"),
+):
+    """The filters every chart endpoint accepts, as ``Snapshot.filtered`` arguments."""
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    filters = {"start": start, "end": end, "lines": lines, "formulas": formulas}
+    return {name: value for name, value in filters.items() if value}
+
+
+ChartFilters = Depends(chart_filters)
+
+
+def filtered_snapshot(filters: dict = ChartFilters):
+    """The current snapshot, or a view of it cut to the chart filters.
+
+    Matching rows come from the snapshot's time-partitioned index, so a date
+    range only reads the months it covers.
+    """
+    snapshot = current_snapshot()
+    if not filters:
+        return snapshot
+    with stage("filter", rows=len(snapshot.rows)):
+        return snapshot.filtered(**filters)
+
+
+ChartSnapshot = Depends(filtered_snapshot)
+
+
+async def chart_data(name, filters, threshold_days=DELAY_THRESHOLD_DAYS, **options):
+    """Payload of one chart; heavy ones run in the offload pool (504 past its timeout)."""
+    try:
+        payloads = await offloader.run(await request_snapshot(), [name], filters, threshold_days, **options)
+    except OffloadTimeout as exc:
+        raise HTTPException(status_code=504, detail=str(exc))
+    return payloads[name]
+
+
+# API endpoint for the processing-days histogram. The raw values are by far the
+# largest payload we serve, so this one negotiates its representation:
+#   * JSON (default), gzip/brotli compressed when the client accepts it
+#   * ?raw=false to get only the histogram counts and bin edges
+#   * ?format=binary or "Accept: application/octet-stream" for the raw values
+#     packed as little-endian int32
+# The ETag follows the dataset version and the filters, so unchanged data answers 304.
+@app.get("/processing-days-histogram")
+def get_histogram(
+    request: Request,
+    raw: bool = Query(True, description="Include raw_processing_days (false = histogram only)"),
+    format: str = Query(None, pattern="^(json|binary)$", description="Overrides Accept negotiation"),
+    snapshot: Snapshot = ChartSnapshot,
+):
+    batch_processing = snapshot.batches
+    if format is None:
+        format = "binary" if prefers_binary(request) else "json"
+
+    tag = etag(snapshot.version, "processing-days-histogram", format, raw, snapshot.filters)
+    if not_modified(request, tag):
+        return Response(status_code=304, headers={"ETag": tag, "Vary": "Accept, Accept-Encoding"})
+
+    if format == "binary":
+        with stage("serialize", rows=len(batch_processing)):
+            body = pack_int32(batch_processing["processing_days"])
+        return encoded_response(request, body, BINARY_MEDIA_TYPE, headers={
+            "ETag": tag,
+            "X-Value-Count": str(len(body) // 4),
+        })
+
+    content = charts.processing_days_histogram(snapshot, raw=raw)
+    content.update({
          "ai_insights":"""
          # What this chart shows
 - A **histogram** of batch-level processing times (`processing_days`).  
@@ -77,21 +381,14 @@ def get_histogram():
          """
     })
 
+    body = JSONResponse(content=content).body
+    return encoded_response(request, body, "application/json", headers={"ETag": tag})
+
 # API endpoint for delayed vs on-time share
 @app.get("/delay-share")
-def get_delay_share():
-    threshold_days = 2  # fixed threshold for delay
-    batch_processing["is_delayed"] = batch_processing["processing_days"] > threshold_days
-
-    delay_counts = batch_processing["is_delayed"].value_counts(normalize=True) * 100
-
+async def get_delay_share(threshold_days: int = ThresholdDays, filters: dict = ChartFilters):
     return JSONResponse(content={
-        "categories": ["On Time", "Delayed"],
-        "percentages": [
-            delay_counts.get(False, 0),  # On Time %
-            delay_counts.get(True, 0)    # Delayed %
-        ],
-        "threshold_days": threshold_days,
+        **await chart_data("delay-share", filters, threshold_days),
         "ai_insights": """
         # What this chart shows
 - A **bar chart** comparing the percentage of **on-time vs delayed batches**.  
@@ -120,24 +417,9 @@ def get_delay_share():
     })
 # API endpoint for monthly average processing days
 @app.get("/monthly-average-delay")
-def get_monthly_average_delay():
-    # Extract month from start date
-    batch_processing["month"] = batch_processing["WIP_ACT_START_DATE"].dt.to_period("M")
-
-    # Monthly average processing days
-    monthly_delay = (
-        batch_processing.groupby("month")["processing_days"]
-        .mean()
-        .reset_index()
-    )
-
-    # Convert Period to Timestamp (string for JSON)
-    monthly_delay["month"] = monthly_delay["month"].dt.to_timestamp()
-
+async def get_monthly_average_delay(filters: dict = ChartFilters):
     return JSONResponse(content={
-        "months": monthly_delay["month"].dt.strftime("%Y-%m").tolist(),  # e.g., "2024-01"
-        "avg_processing_days": monthly_delay["processing_days"].tolist(), # y-axis values
-        "threshold": 2 , # delay threshold
+        **await chart_data("monthly-average-delay", filters),
         "ai_insights": """
         
         # What this chart shows
@@ -173,17 +455,9 @@ def get_monthly_average_delay():
 
 # API endpoint for average processing days by line
 @app.get("/line-average-delay")
-def get_line_average_delay():
-    # Calculate processing_days if not already in df
-    df["processing_days"] = (df["WIP_CMPLT_DATE"] - df["WIP_ACT_START_DATE"]).dt.days
-
-    # Group by line to compute average processing days
-    delay_by_line = df.groupby("LINE_NO")["processing_days"].mean().reset_index()
-
+async def get_line_average_delay(filters: dict = ChartFilters):
     return JSONResponse(content={
-        "lines": delay_by_line["LINE_NO"].astype(str).tolist(),       # x-axis labels
-        "avg_processing_days": delay_by_line["processing_days"].tolist(),  # y-axis values
-        "threshold": 2,
+        **await chart_data("line-average-delay", filters),
         "ai_insights": """
         # What this chart shows
 - A **bar chart of average processing days by production line**.  
@@ -223,36 +497,9 @@ def get_line_average_delay():
 
 # API endpoint for monthly average processing days by line
 @app.get("/line-monthly-average-delay")
-def get_line_monthly_average_delay():
-    # Batch-level processing days per line
-    batch_processing = (
-        df.groupby(["WIP_BATCH_ID", "LINE_NO"])
-          .agg({"WIP_ACT_START_DATE": "min", "WIP_CMPLT_DATE": "max"})
-          .reset_index()
-    )
-    batch_processing["processing_days"] = (
-        (batch_processing["WIP_CMPLT_DATE"] - batch_processing["WIP_ACT_START_DATE"]).dt.days
-    )
-    batch_processing["month"] = batch_processing["WIP_ACT_START_DATE"].dt.to_period("M")
-
-    # Group by line & month
-    avg_delay = (
-        batch_processing.groupby(["month", "LINE_NO"])["processing_days"]
-        .mean()
-        .reset_index()
-    )
-
-    # Convert month Period -> Timestamp -> String
-    avg_delay["month"] = avg_delay["month"].dt.to_timestamp()
-    avg_delay["month"] = avg_delay["month"].dt.strftime("%Y-%m")
-
-    # Pivot to create structure: line_no -> list of avg values aligned with months
-    pivoted = avg_delay.pivot(index="month", columns="LINE_NO", values="processing_days").fillna(0)
-
+async def get_line_monthly_average_delay(filters: dict = ChartFilters):
     return JSONResponse(content={
-        "months": pivoted.index.tolist(),
-        "lines": {str(col): pivoted[col].tolist() for col in pivoted.columns},
-        "threshold": 2,
+        **await chart_data("line-monthly-average-delay", filters),
         "ai_insights": """
         
         # What this chart shows
@@ -303,32 +550,9 @@ That would make spotting problematic months & lines much clearer than overlappin
 
 # API endpoint for delayed batches per line
 @app.get("/delayed-batches-by-line")
-def get_delayed_batches_by_line():
-    # Step 1: Compute batch-level processing_days
-    batch_processing = (
-        df.groupby(["WIP_BATCH_ID", "LINE_NO"])
-          .agg({"WIP_ACT_START_DATE": "min", "WIP_CMPLT_DATE": "max"})
-          .reset_index()
-    )
-    batch_processing["processing_days"] = (
-        (batch_processing["WIP_CMPLT_DATE"] - batch_processing["WIP_ACT_START_DATE"]).dt.days
-    )
-
-    # Step 2: Mark delayed batches
-    batch_processing["is_delayed"] = batch_processing["processing_days"] > 2
-
-    # Step 3: Count delayed batches per line
-    delayed_by_line = (
-        batch_processing[batch_processing["is_delayed"]]
-        .groupby("LINE_NO")
-        .size()
-        .reset_index(name="delayed_batches")
-        .sort_values("delayed_batches", ascending=False)
-    )
-
+async def get_delayed_batches_by_line(threshold_days: int = ThresholdDays, filters: dict = ChartFilters):
     return JSONResponse(content={
-        "lines": delayed_by_line["LINE_NO"].astype(str).tolist(),        # x-axis
-        "delayed_batches": delayed_by_line["delayed_batches"].tolist(),
+        **await chart_data("delayed-batches-by-line", filters, threshold_days),
         "ai_insights": """
         # What this chart shows
 - The **number of delayed batches** (processing time > 2 days) per process line.  
@@ -369,36 +593,9 @@ def get_delayed_batches_by_line():
 
 # API endpoint for delayed vs total batches per line
 @app.get("/delayed-vs-total-batches")
-def get_delayed_vs_total_batches():
-    # Step 1: Compute batch-level processing_days
-    batch_processing = (
-        df.groupby(["WIP_BATCH_ID", "LINE_NO"])
-          .agg({"WIP_ACT_START_DATE": "min", "WIP_CMPLT_DATE": "max"})
-          .reset_index()
-    )
-    batch_processing["processing_days"] = (
-        (batch_processing["WIP_CMPLT_DATE"] - batch_processing["WIP_ACT_START_DATE"]).dt.days
-    )
-    batch_processing["is_delayed"] = batch_processing["processing_days"] > 2
-
-    # Step 2: Aggregate per line
-    line_stats = batch_processing.groupby("LINE_NO").agg(
-        total_batches=("WIP_BATCH_ID", "count"),
-        delayed_batches=("is_delayed", "sum")
-    ).reset_index()
-
-    # On-time = total - delayed
-    line_stats["on_time_batches"] = line_stats["total_batches"] - line_stats["delayed_batches"]
-
-    # Sort by total workload (largest first)
-    line_stats = line_stats.sort_values("total_batches", ascending=False)
-
+async def get_delayed_vs_total_batches(threshold_days: int = ThresholdDays, filters: dict = ChartFilters):
     return JSONResponse(content={
-        "lines": line_stats["LINE_NO"].astype(str).tolist(),
-        "total_batches": line_stats["total_batches"].tolist(),
-        "delayed_batches": line_stats["delayed_batches"].tolist(),
-        "on_time_batches": line_stats["on_time_batches"].tolist(),
-
+        **await chart_data("delayed-vs-total-batches", filters, threshold_days),
         "ai_insights": """
         # What this chart shows
 - **Total workload (batches)** per process line, split into:
@@ -443,35 +640,9 @@ def get_delayed_vs_total_batches():
 
 # API endpoint for top 15 formulas by delay rate
 @app.get("/top-delay-formulas")
-def get_top_delay_formulas():
-    # --- Compute batch-level processing_days ---
-    batch_processing = (
-        df.groupby(["WIP_BATCH_ID", "FORMULA_ID"])
-          .agg({"WIP_ACT_START_DATE": "min", "WIP_CMPLT_DATE": "max"})
-          .reset_index()
-    )
-    batch_processing["processing_days"] = (
-        (batch_processing["WIP_CMPLT_DATE"] - batch_processing["WIP_ACT_START_DATE"]).dt.days
-    )
-    batch_processing["is_delayed"] = batch_processing["processing_days"] > 2
-
-    # --- Aggregate by formula: total & delayed ---
-    delay_by_formula = batch_processing.groupby("FORMULA_ID").agg(
-        total_batches=("WIP_BATCH_ID", "count"),
-        delayed_batches=("is_delayed", "sum")
-    ).reset_index()
-
-    # --- Compute delay rate (%) ---
-    delay_by_formula["delay_rate"] = (
-        (delay_by_formula["delayed_batches"] / delay_by_formula["total_batches"]) * 100
-    )
-
-    # --- Top 15 formulas ---
-    top_delay_formulas = delay_by_formula.sort_values("delay_rate", ascending=False).head(15)
-
+async def get_top_delay_formulas(threshold_days: int = ThresholdDays, filters: dict = ChartFilters):
     return JSONResponse(content={
-        "formula_ids": top_delay_formulas["FORMULA_ID"].astype(str).tolist(),
-        "delay_rates": top_delay_formulas["delay_rate"].round(2).tolist(),
+        **await chart_data("top-delay-formulas", filters, threshold_days),
         "ai_insights": """
         # What this chart shows
 - The chart compares the **average scrap factor per production line**.  
@@ -516,42 +687,9 @@ def get_top_delay_formulas():
 
 # API endpoint for monthly delay rate
 @app.get("/monthly-delay-rate")
-def get_monthly_delay_rate():
-    # Compute batch-level processing days
-    batch_processing = (
-        df.groupby("WIP_BATCH_ID")
-          .agg({"WIP_ACT_START_DATE": "min", "WIP_CMPLT_DATE": "max"})
-          .reset_index()
-    )
-    batch_processing["processing_days"] = (
-        (batch_processing["WIP_CMPLT_DATE"] - batch_processing["WIP_ACT_START_DATE"]).dt.days
-    )
-
-    # Extract month
-    batch_processing["month"] = batch_processing["WIP_ACT_START_DATE"].dt.to_period("M")
-
-    # Monthly delay stats
-    delay_by_month = (
-        batch_processing.assign(is_delayed=batch_processing["processing_days"] > 2)
-        .groupby("month")
-        .agg(
-            total_batches=("WIP_BATCH_ID", "count"),
-            delayed_batches=("is_delayed", "sum")
-        )
-        .reset_index()
-    )
-    delay_by_month["delay_rate"] = (
-        delay_by_month["delayed_batches"] / delay_by_month["total_batches"] * 100
-    )
-
-    # Convert Period → Timestamp → string
-    delay_by_month["month"] = delay_by_month["month"].dt.to_timestamp()
-    delay_by_month["month"] = delay_by_month["month"].dt.strftime("%Y-%m")
-
+async def get_monthly_delay_rate(threshold_days: int = ThresholdDays, filters: dict = ChartFilters):
     return JSONResponse(content={
-        "months": delay_by_month["month"].tolist(),
-        "delay_rates": delay_by_month["delay_rate"].round(2).tolist(),
-        "threshold": 50,
+        **await chart_data("monthly-delay-rate", filters, threshold_days),
         "ai_insights": """
         
 # ⏱️ Monthly Delay Rate (%) – Analysis
@@ -602,13 +740,9 @@ def get_monthly_delay_rate():
 
 # API endpoint for average scrap factor per line
 @app.get("/line-scrap-factor")
-def get_line_scrap_factor():
-    # Group by line to compute mean scrap factor
-    line_scrap = df.groupby("LINE_NO")["SCRAP_FACTOR"].mean().reset_index()
-
+async def get_line_scrap_factor(filters: dict = ChartFilters):
     return JSONResponse(content={
-        "lines": line_scrap["LINE_NO"].astype(str).tolist(),
-        "avg_scrap_factor": line_scrap["SCRAP_FACTOR"].round(4).tolist(),
+        **await chart_data("line-scrap-factor", filters),
     "ai_insights": """
     # 🚨 Delay Reasons by Line – Analysis
 
@@ -663,63 +797,453 @@ def get_line_scrap_factor():
 
 # 📌 Delay reasons by line
 @app.get("/delay-reasons-by-line")
-def get_delay_reasons_by_line():
-    local_df = df.copy()
+async def get_delay_reasons_by_line(
+    top_n_reasons: int = Query(None, ge=1, description="Keep only the N most frequent reasons per line"),
+    filters: dict = ChartFilters,
+):
+    # Lines slice the row cube; only dates and formulas need a filtered view
+    lines = filters.pop("lines", None)
+    return JSONResponse(content=await chart_data(
+        "delay-reasons-by-line", filters, top_n_reasons=top_n_reasons, lines=lines,
+    ))
 
-    # Ensure processing_days column exists
-    if "processing_days" not in local_df.columns:
-        local_df["processing_days"] = (
-            (local_df["WIP_CMPLT_DATE"] - local_df["WIP_ACT_START_DATE"]).dt.days
-        )
 
-    # Filter delayed batches
-    line_reason = (
-        local_df[local_df["processing_days"] > 2]
-        .dropna(subset=["REASON"])
-        .groupby(["LINE_NO", "REASON"])
-        .size()
-        .reset_index(name="count")
-    )
+@app.get("/delay-reasons-top10")
+async def get_top_delay_reasons(filters: dict = ChartFilters):
+    return JSONResponse(content=await chart_data("delay-reasons-top10", filters))
+
+
+# Several charts in one request. The filters are applied once and every chart
+# reads the same filtered snapshot (one version, one set of indexes and cubes).
+# With "Accept: application/x-ndjson" each chart is streamed as one
+# {"chart": ..., "data": ...} line as soon as it is computed. AI insights stay
+# on the individual chart endpoints.
+@app.get("/dashboard")
+async def get_dashboard(
+    request: Request,
+    names: list[str] = Query(None, alias="charts", description="Charts to include (default: all)"),
+    threshold_days: int = ThresholdDays,
+    filters: dict = ChartFilters,
+    months: list[str] = Query(None, description="Only these months (YYYY-MM)"),
+):
+    names = names or list(charts.CHARTS)
+    unknown = [name for name in names if name not in charts.CHARTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown chart(s): {', '.join(unknown)}")
+    if months:
+        try:
+            [np.datetime64(month, "M") for month in months]
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid month: {exc}")
+        filters = {**filters, "months": months}
+
+    snapshot = await request_snapshot()
+    echo = {
+        "start": None, "end": None, "lines": None, "formulas": None, "months": None,
+        **{name: value.isoformat() if isinstance(value, date) else value for name, value in filters.items()},
+        "threshold_days": threshold_days,
+    }
+
+    if wants_ndjson(request):
+        async def stream():
+            yield JSONResponse(content={"version": snapshot.version, "filters": echo}).body + b"\n"
+            for name in names:
+                try:
+                    data = await offloader.run(snapshot, [name], filters, threshold_days)
+                except OffloadTimeout as exc:  # headers are gone; report it in the stream
+                    yield JSONResponse(content={"chart": name, "error": str(exc)}).body + b"\n"
+                    continue
+                yield JSONResponse(content={"chart": name, "data": data[name]}).body + b"\n"
+        return StreamingResponse(stream(), media_type=NDJSON_MEDIA_TYPE)
+
+    try:
+        payloads = await offloader.run(snapshot, names, filters, threshold_days)
+    except OffloadTimeout as exc:
+        raise HTTPException(status_code=504, detail=str(exc))
+    return JSONResponse(content={"version": snapshot.version, "filters": echo, "charts": payloads})
+
+
+# Processing-day percentiles per line / formula / month (any combination, or
+# none for one overall row), merged from the snapshot's quantile sketch.
+# Exact below quantiles.EXACT_DAYS, within RELATIVE_ACCURACY above.
+@app.get("/processing-days-percentiles")
+def get_processing_days_percentiles(
+    by: list[str] = Query(["LINE_NO"], description="Group by: month, LINE_NO, FORMULA_ID (by= alone: overall)"),
+    q: list[float] = Query([0.5, 0.9, 0.99], description="Quantiles to report, each in [0, 1]"),
+    months: list[str] = Query(None, description="Only these months (YYYY-MM)"),
+    lines: list[str] = Query(None, description="Only these lines"),
+    formulas: list[str] = Query(None, description="Only these formulas"),
+):
+    by = [dim for dim in by if dim]
+    if any(dim not in SKETCH_DIMENSIONS for dim in by) or len(set(by)) != len(by):
+        raise HTTPException(status_code=400, detail=f"by must be distinct values of {', '.join(SKETCH_DIMENSIONS)}")
+    if not all(0 <= p <= 1 for p in q):
+        raise HTTPException(status_code=400, detail="quantiles must be between 0 and 1")
+    where = {
+        dim: values
+        for dim, values in (("month", months), ("LINE_NO", lines), ("FORMULA_ID", formulas))
+        if values is not None
+    }
+    sketch = current_snapshot().quantile_sketch
+    try:
+        with stage("aggregate", rows=sketch.codes.shape[1]):
+            labels, codes, counts, values = quantiles(sketch, q, by, where)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    with stage("format"):
+        names = [
+            month_labels(values) if dim == "month" else [str(v) for v in values]
+            for dim, values in zip(by, labels)
+        ]
+        groups = []
+        for g in range(len(counts)):
+            group = {dim: names[i][codes[i, g]] for i, dim in enumerate(by)}
+            group["batches"] = int(counts[g])
+            group.update({
+                quantile_name(p): None if np.isnan(value) else float(value) for p, value in zip(q, values[g])
+            })
+            groups.append(group)
+
+    return JSONResponse(content={
+        "by": by,
+        "quantiles": q,
+        "groups": groups,
+        "exact_below_days": EXACT_DAYS,
+        "relative_accuracy": RELATIVE_ACCURACY,
+    })
 
-    # Convert to structured JSON
-    result = {}
-    for _, row in line_reason.iterrows():
-        line = str(row["LINE_NO"])
-        reason = row["REASON"]
-        count = int(row["count"])
-        if line not in result:
-            result[line] = {}
-        result[line][reason] = count
+
+# Any metrics grouped by any dimensions, from the one group-by engine the
+# per-dimension charts use. Batch-level by default; grain=rows also groups by
+# REASON and adds mean_scrap. sort + top return only the first groups.
+@app.get("/aggregate")
+async def get_aggregate(
+    by: list[str] = Query(["LINE_NO"], description="Group by: month, LINE_NO, FORMULA_ID (rows: also REASON)"),
+    metrics: list[str] = Query(
+        ["count", "delayed", "delay_rate"], alias="metric", description=f"Metrics: {', '.join(engine.METRICS)}",
+    ),
+    grain: str = Query("batches", pattern="^(batches|rows)$"),
+    threshold_days: int = ThresholdDays,
+    filters: dict = ChartFilters,
+    months: list[str] = Query(None, description="Only these months (YYYY-MM)"),
+    sort: str = Query(None, description="Metric to order the groups by (default: label order)"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    top: int = Query(None, ge=1, description="Only the first groups in sort order"),
+    min_count: int = Query(None, ge=1, description="Only groups with at least this many batches / rows"),
+):
+    by = [dim for dim in by if dim]
+    if months:
+        try:
+            [np.datetime64(month, "M") for month in months]
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid month: {exc}")
+        filters = {**filters, "months": months}
+    try:
+        engine.validate(by, metrics, grain, sort)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    snapshot = await request_snapshot()
+    args = (by, metrics, grain, threshold_days, filters, min_count and {"count": min_count}, sort, order == "desc", top)
+    if engine.uses_index(by, metrics, grain, filters):
+        result = await run_in_threadpool(engine.aggregate, snapshot, *args)
+    else:
+        try:
+            result = await offloader.call(snapshot, engine.aggregate, *args, what="aggregate")
+        except OffloadTimeout as exc:
+            raise HTTPException(status_code=504, detail=str(exc))
+
+    def plain(column):
+        if column.name == "month":
+            return month_labels(column)
+        if column.name in by:
+            return column.astype(str).tolist()
+        return column.astype(object).where(column.notna(), None).tolist()
+
+    with stage("format"):
+        labels = {dim: plain(result[dim]) for dim in by}
+        values = {metric: plain(result[metric]) for metric in metrics}
 
     return JSONResponse(content={
-        "delay_reasons_by_line": result,
-        "threshold_days": 2
+        "by": by,
+        "grain": grain,
+        "threshold_days": threshold_days,
+        "labels": labels,
+        "values": values,
     })
 
 
-@app.get("/delay-reasons-top10")
-def get_top_delay_reasons():
-    if "processing_days" not in df.columns:
-        df["processing_days"] = (df["WIP_CMPLT_DATE"] - df["WIP_ACT_START_DATE"]).dt.days
-
-    delayed = df[df["processing_days"] > 2].dropna(subset=["REASON"])  # fixed threshold = 2
-
-    delay_reasons = (
-        delayed.groupby("REASON")
-        .size()
-        .reset_index(name="count")
-        .sort_values("count", ascending=False)
-        .head(10)
+# Monthly control-chart alerts per line: monthly means above a fixed number of
+# days, plus Shewhart / EWMA / CUSUM excursions against each line's running
+# baseline. The chart state is kept up to date incrementally (see alerts.py).
+@app.get("/alerts")
+def get_alerts(
+    threshold_days: float = Query(
+        alerts.ALERT_MEAN_DAYS, alias="threshold", ge=0, description="Flag monthly means above this many days",
+    ),
+    lines: list[str] = Query(None, description="Only these lines"),
+    since: str = Query(None, description="Only months from this one on (YYYY-MM)"),
+    kinds: list[str] = Query(None, alias="kind", description=f"Alert kinds: {', '.join(alerts.ALERT_KINDS)}"),
+):
+    kinds = kinds or list(alerts.ALERT_KINDS)
+    unknown = [kind for kind in kinds if kind not in alerts.ALERT_KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown alert kind(s): {', '.join(unknown)}")
+    if since is not None:
+        try:
+            np.datetime64(since, "M")
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid month: {exc}")
+
+    snapshot = current_snapshot()
+    with stage("aggregate"):
+        found = snapshot.control_charts.alerts(threshold_days, lines, since, kinds)
+
+    return JSONResponse(content={
+        "version": snapshot.version,
+        "threshold_days": threshold_days,
+        "parameters": {
+            "min_baseline_batches": alerts.MIN_BASELINE,
+            "shewhart_limit": alerts.SHEWHART_LIMIT,
+            "ewma_lambda": alerts.EWMA_LAMBDA,
+            "ewma_limit": alerts.EWMA_LIMIT,
+            "cusum_k": alerts.CUSUM_K,
+            "cusum_h": alerts.CUSUM_H,
+        },
+        "counts": {kind: sum(alert["kind"] == kind for alert in found) for kind in kinds},
+        "alerts": found,
+    })
+
+
+# The individual batches behind a chart, one page at a time. Pages use keyset
+# cursors over a pre-sorted batch index: pass next_cursor back (with the same
+# filters and sort) to continue; deep pages cost the same as the first.
+@app.get("/batches")
+def get_batches(
+    lines: list[str] = Query(None, description="Only these lines"),
+    formulas: list[str] = Query(None, description="Only these formulas"),
+    months: list[str] = Query(None, description="Only batches started in these months (YYYY-MM)"),
+    reasons: list[str] = Query(None, description="Only batches with a row giving one of these reasons"),
+    min_days: float = Query(None, ge=0, description="Only batches with at least this many processing days"),
+    sort: str = Query("processing_days", pattern="^(processing_days|date)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+):
+    snapshot = current_snapshot()
+    with stage("index"):
+        index = snapshot.batch_index()
+    try:
+        with stage("aggregate"):
+            positions, next_cursor = index.page(
+                sort, order, limit, cursor,
+                lines=lines, formulas=formulas, months=months, reasons=reasons, min_days=min_days,
+            )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    with stage("format", rows=len(positions)):
+        batches = index.records(positions)
+    return JSONResponse(content={
+        "batches": batches,
+        "next_cursor": next_cursor,
+        "sort": sort,
+        "order": order,
+        "limit": limit,
+        "version": snapshot.version,
+    })
+
+
+def export_format(request, format):
+    if format is None:
+        format = "csv" if "text/csv" in request.headers.get("accept", "") else "ndjson"
+    return format, export.FORMATS[format]
+
+
+# The batch table, streamed as NDJSON (default) or CSV in chunks, so memory
+# stays flat and clients start reading before the export is finished
+@app.get("/export/batches")
+def export_batches(
+    request: Request,
+    format: str = Query(None, pattern="^(ndjson|csv)$", description="Overrides Accept negotiation"),
+    filters: dict = ChartFilters,
+):
+    format, media_type = export_format(request, format)
+    snapshot = current_snapshot()
+    positions = None
+    if filters:
+        with stage("filter", rows=len(snapshot.batches)):
+            positions = snapshot.filter_index("batches").select(
+                start=filters.get("start") and day_number(filters["start"]),
+                end=filters.get("end") and day_number(filters["end"]),
+                LINE_NO=filters.get("lines"),
+                FORMULA_ID=filters.get("formulas"),
+            )
+    return StreamingResponse(
+        export.batch_chunks(snapshot.batches, positions, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="batches.{format}"'},
     )
 
-    total_delayed = delay_reasons["count"].sum()
-    delay_reasons["share_percent"] = (delay_reasons["count"] / total_delayed * 100).round(2)
 
-    return {
-        "top_delay_reasons": delay_reasons.to_dict(orient="records"),
-        "threshold_days": 2
+# Batch counts, delays and processing-day statistics per group, streamed like
+# /export/batches; "delayed" is at the default threshold
+@app.get("/export/aggregates")
+def export_aggregates(
+    request: Request,
+    by: list[str] = Query(list(export.AGGREGATE_DIMENSIONS), description="Group by: month, LINE_NO, FORMULA_ID"),
+    format: str = Query(None, pattern="^(ndjson|csv)$", description="Overrides Accept negotiation"),
+    filters: dict = ChartFilters,
+):
+    unknown = [dim for dim in by if dim not in export.AGGREGATE_DIMENSIONS]
+    if unknown or len(set(by)) != len(by):
+        detail = f"by must be distinct values of {', '.join(export.AGGREGATE_DIMENSIONS)}"
+        raise HTTPException(status_code=400, detail=detail)
+    format, media_type = export_format(request, format)
+
+    snapshot = current_snapshot()
+    # Lines and formulas slice the stored cube; only a date range needs a filtered view
+    dates = {name: filters[name] for name in ("start", "end") if name in filters}
+    if dates:
+        snapshot = snapshot.filtered(**dates)
+    where = {dim: filters[name] for dim, name in (("LINE_NO", "lines"), ("FORMULA_ID", "formulas")) if name in filters}
+    try:
+        chunks = export.aggregate_chunks(snapshot, by, where, format)
+        first = next(chunks, b"")  # roll-up errors surface here, before the response starts
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return StreamingResponse(
+        itertools.chain([first], chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="aggregates.{format}"'},
+    )
+
+
+# Generic slice / dice / roll-up over the pre-aggregated cubes
+@app.get("/cube")
+def get_cube(
+    by: list[str] = Query([], description="Dimensions to keep: month, LINE_NO, FORMULA_ID, REASON (rows only), is_delayed"),
+    grain: str = Query("batches", pattern="^(batches|rows)$"),
+    months: list[str] = Query(None, description="Only these months (YYYY-MM)"),
+    lines: list[str] = Query(None),
+    formulas: list[str] = Query(None),
+    reasons: list[str] = Query(None),
+    is_delayed: bool = Query(None, description=f"Delayed at {DELAY_THRESHOLD_DAYS} days"),
+):
+    snapshot = current_snapshot()
+    cube = snapshot.batch_cube if grain == "batches" else snapshot.row_cube
+
+    where = {
+        dim: values
+        for dim, values in [("month", months), ("LINE_NO", lines), ("FORMULA_ID", formulas),
+                            ("REASON", reasons), ("is_delayed", None if is_delayed is None else [is_delayed])]
+        if values is not None
     }
+    try:
+        with stage("aggregate", rows=cube.codes.shape[1]):
+            labels, cells = cube.rollup(by, where=where)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    mean, std = mean_and_std(cells)
+
+    def cell_values(values):
+        # NaN (empty cells) -> null
+        return np.where(np.isnan(values), None, values).tolist()
+
+    return JSONResponse(content={
+        "grain": grain,
+        "by": by,
+        "labels": {
+            dim: month_labels(values) if dim == "month" else [str(v) for v in values]
+            for dim, values in zip(by, labels)
+        },
+        "count": cells["count"].astype(int).tolist(),
+        "sum": cells["sum"].tolist(),
+        "mean": cell_values(mean),
+        "std": cell_values(std),
+        "version": snapshot.version,
+    })
+
+
+# Append new / updated WIP rows (CSV, JSON or Parquet body) without a full rebuild.
+# Only the touched batches and aggregates are recomputed; the new snapshot is
+# published atomically and matches a full rebuild from all rows.
+@app.post("/ingest")
+async def ingest_rows(request: Request):
+    body = await request.body()
+    try:
+        with stage("parse"):
+            delta = await run_in_threadpool(read_rows, body, request.headers.get("content-type"))
+        with stage("merge", rows=len(delta)):
+            summary = await run_in_threadpool(append_rows, delta)
+    except UnsupportedFormat as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except (ValueError, TypeError, KeyError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return summary
+
+
+# Ad-hoc read-only SQL over the rows / batches tables (see sqlstore.py for the
+# schema). One statement with ? or :name parameters; rows are capped at the
+# store's max_rows (or limit, if lower) and the query is cut off at its timeout.
+@app.post("/query")
+def post_query(
+    sql: str = Body(..., embed=True, max_length=20_000),
+    params: list | dict = Body(None, embed=True, description="Values for ? (list) or :name (object) parameters"),
+    limit: int = Body(None, embed=True, ge=1),
+):
+    if sql_store is None:
+        raise HTTPException(status_code=404, detail="The SQL store is not enabled (set WIP_SQL_DIR)")
+    try:
+        with stage("query"):
+            result = sql_store.query(sql, params or (), limit)
+    except QueryTimeout as exc:
+        raise HTTPException(status_code=504, detail=str(exc))
+    except LookupError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    except sqlite3.Error as exc:
+        raise HTTPException(status_code=400, detail=f"{type(exc).__name__}: {exc}")
+    return JSONResponse(content=result)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Liveness: answers at once and never loads the dataset
+@app.get("/healthz")
+def get_healthz():
+    snapshot = loaded_snapshot()
+    return JSONResponse(content={
+        "status": "ok",
+        "ready": snapshot is not None,
+        "version": None if snapshot is None else snapshot.version,
+    })
+
+
+# Builds the snapshot (and starts the offload workers) ahead of real traffic;
+# point a deploy hook or scheduled ping here when running with LAZY_START
+@app.get("/warmup")
+def get_warmup():
+    started = time.perf_counter()
+    snapshot = current_snapshot()
+    offloader.warm(snapshot)
+    return JSONResponse(content={
+        "status": "ok",
+        "version": snapshot.version,
+        "rows": len(snapshot.rows),
+        "batches": len(snapshot.batches),
+        "seconds": round(time.perf_counter() - started, 3),
+    })
+
+
+# Paths reported by name in the metrics (anything else is "other")
+ROUTE_PATHS = {route.path for route in app.routes}
 
 
 if __name__ == "__main__":
+    import uvicorn  # only needed to serve locally; serverless hosts bring their own
+
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
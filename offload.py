@@ -0,0 +1,289 @@
+"""Heavy chart computations in a bounded process pool.
+
+pandas holds the GIL through a long groupby. On the threadpool, a few
+filtered or row-level charts therefore stall every other request, cache
+hits included. :class:`Offloader` sends those computations to worker
+processes, and the async handlers await the result.
+
+Workers never receive the data with a task. The main process writes each
+snapshot version once to a spool file (the :mod:`shared_store` format), on
+a background thread as soon as the version is published (see
+:meth:`Offloader.spool`). Every worker maps that file read-only and keeps
+it attached until the version changes. A task carries only a module-level function and its small
+arguments (chart names, filters, threshold, ...). Only the result travels
+back.
+
+Two limits keep cheap endpoints fast under mixed load:
+
+* at most ``concurrency`` heavy computations run or wait in the pool;
+* each one gets ``timeout`` seconds, including the wait for a slot.
+
+With ``workers=0``, heavy computations run on a local thread pool under the
+same limits. Unfiltered index and cube lookups take milliseconds, so they
+always stay on Starlette's threadpool. Settings come from ``WIP_OFFLOAD_WORKERS``,
+``WIP_OFFLOAD_CONCURRENCY`` and ``WIP_OFFLOAD_TIMEOUT``.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+import charts
+from dataset import DELAY_THRESHOLD_DAYS
+from metrics import stage
+from shared_store import attach_snapshot, write_snapshot
+
+# Charts that scan a whole row table instead of reading an index or cube
+HEAVY_CHARTS = {"line-scrap-factor", "delay-reasons-top10"}
+
+# Filtered views a worker keeps for repeated filters (e.g. a streamed dashboard)
+WORKER_VIEWS = 8
+
+
+class OffloadTimeout(TimeoutError):
+    """A heavy computation did not get a slot or finish within the timeout."""
+
+
+def compute(snapshot, names, filters, threshold_days, options):
+    """Payload per chart name, computed on ``snapshot.filtered(**filters)``."""
+    view = snapshot
+    if filters:
+        with stage("filter", rows=len(snapshot.rows)):
+            view = _filtered(snapshot, filters)
+    return render(view, names, threshold_days, options)
+
+
+def render(view, names, threshold_days, options):
+    return {name: charts.render(name, view, threshold_days, **options) for name in names}
+
+
+# Worker process state: the attached spool file and its recent filtered views
+_attached = {"path": None, "snapshot": None, "views": {}}
+
+
+def _attach(path):
+    if _attached["path"] != path:
+        _attached.update(path=path, snapshot=attach_snapshot(path), views={})
+
+
+def _filtered(snapshot, filters):
+    if snapshot is not _attached["snapshot"]:
+        return snapshot.filtered(**filters)
+    views = _attached["views"]
+    key = repr(sorted(filters.items()))
+    view = views.pop(key, None)
+    if view is None:
+        view = snapshot.filtered(**filters)
+    views[key] = view  # most recent last
+    while len(views) > WORKER_VIEWS:
+        views.pop(next(iter(views)))
+    return view
+
+
+def _call_in_worker(path, fn, args):
+    _attach(path)
+    return fn(_attached["snapshot"], *args)
+
+
+def _pool_context():
+    # Never plain fork: this process runs threads (server, watcher). A fork
+    # server is a clean process that has imported pandas once, so workers
+    # start fast; spawn where there is none (Windows)
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["offload"])
+    return context
+
+
+class Offloader:
+    """Runs chart computations, sending the heavy ones to a process pool."""
+
+    def __init__(self, workers=2, concurrency=None, timeout=30.0, spool_dir=None):
+        self.workers = workers
+        self.concurrency = concurrency or max(1, workers) * 2
+        self.timeout = timeout
+        self._spool_dir = spool_dir
+        self._owns_spool_dir = spool_dir is None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._spooler = None  # one thread: spool files are written in publish order
+        self._spooling = None  # ((version, loaded_at), future of its path)
+        self._spooled = None  # ((version, loaded_at), path) of the newest file written
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls):
+        default_workers = min(4, max(1, (os.cpu_count() or 2) // 2))
+        workers = int(os.environ.get("WIP_OFFLOAD_WORKERS", default_workers))
+        concurrency = int(os.environ.get("WIP_OFFLOAD_CONCURRENCY", "0")) or None
+        timeout = float(os.environ.get("WIP_OFFLOAD_TIMEOUT", "30"))
+        return cls(workers, concurrency, timeout, os.environ.get("WIP_OFFLOAD_DIR"))
+
+    def is_heavy(self, names, filters):
+        # A filtered view scans the selected facts
+        return bool(filters) or any(name in HEAVY_CHARTS for name in names)
+
+    async def run(self, snapshot, names, filters=None, threshold_days=DELAY_THRESHOLD_DAYS, **options):
+        """Payload per chart name; raises :class:`OffloadTimeout` past the timeout."""
+        filters = filters or {}
+        if not self.is_heavy(names, filters):
+            return await run_in_threadpool(compute, snapshot, names, filters, threshold_days, options)
+        return await self.call(snapshot, compute, names, filters, threshold_days, options, what=", ".join(names))
+
+    async def call(self, snapshot, fn, *args, what=None):
+        """``fn(snapshot, *args)`` in the pool, under the concurrency and time limits.
+
+        ``fn`` must be a module-level function so workers can import it.
+        """
+        what = what or fn.__name__
+        with stage("offload"):
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise OffloadTimeout(f"no free slot for {what} within {self.timeout:g}s") from None
+            self.in_flight += 1
+            try:
+                future = await self._submit(snapshot, fn, args)
+            except BaseException:
+                self._release(loop)
+                raise
+            # The slot stays taken until the worker is really done, even after a timeout
+            future.add_done_callback(lambda _: self._release(loop))
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise OffloadTimeout(f"{what} did not finish within {self.timeout:g}s") from None
+            except concurrent.futures.BrokenExecutor:  # a worker died
+                self._reset()
+                raise
+            self.completed += 1
+            return result
+
+    def warm(self, snapshot):
+        """Start the workers and spool ``snapshot`` before the first heavy request."""
+        if self.workers > 0:
+            path = self._spool_path(snapshot)
+            for _ in range(self.workers):
+                self._get_executor().submit(_attach, path)
+
+    def spool(self, snapshot):
+        """Future of ``snapshot``'s spool file path, written on the spooler thread.
+
+        Register it with ``dataset.on_publish`` so each version is written
+        before the first heavy request asks for it. A version superseded
+        before its turn is skipped; its future then gives None.
+        """
+        if self.workers <= 0:
+            return None
+        key = (snapshot.version, snapshot.loaded_at)
+        with self._lock:
+            if self._spooling is not None and self._spooling[0] == key:
+                return self._spooling[1]
+            if self._spooler is None:
+                self._spooler = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="offload-spool")
+            future = self._spooler.submit(self._write_spool, snapshot, key)
+            self._spooling = (key, future)
+            return future
+
+    def _release(self, loop):
+        def release():
+            self.in_flight -= 1
+            self._slots.release()
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:  # loop already closed
+            pass
+
+    async def _submit(self, snapshot, fn, args):
+        if self.workers <= 0:
+            context = contextvars.copy_context()  # keeps the request's stage timings
+            return self._get_executor().submit(context.run, fn, snapshot, *args)
+        path = None
+        while path is None:  # None: a newer version took the spool first, ask again
+            path = await asyncio.wrap_future(self.spool(snapshot))
+        return self._get_executor().submit(_call_in_worker, path, fn, args)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.workers <= 0:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.concurrency, thread_name_prefix="offload",
+                    )
+                else:
+                    self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=_pool_context())
+            return self._executor
+
+    def _spool_path(self, snapshot):
+        path = None
+        while path is None:
+            path = self.spool(snapshot).result()
+        return path
+
+    def _write_spool(self, snapshot, key):
+        """Write ``snapshot``'s spool file (spooler thread); None if no longer wanted."""
+        with self._lock:
+            if self._spooled is not None and self._spooled[0] == key:
+                return self._spooled[1]
+            if self._spooling is None or self._spooling[0] != key:
+                return None  # superseded while queued (or closed)
+            if self._spool_dir is None:
+                self._spool_dir = tempfile.mkdtemp(prefix="wip-offload-")
+                atexit.register(shutil.rmtree, self._spool_dir, True)
+            spool_dir = self._spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        name = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        path = os.path.join(spool_dir, f"{name}.snap")
+        write_snapshot(snapshot, path)  # outside the lock: requests never wait on the write itself
+        with self._lock:
+            previous, self._spooled = self._spooled, (key, path)
+        if previous is not None:
+            # Workers still attached to the old version keep their mapping
+            os.unlink(previous[1])
+        return path
+
+    def _reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """Stop the workers and the spooler, and remove the spool files."""
+        self._reset()
+        with self._lock:
+            spooler, self._spooler, self._spooling = self._spooler, None, None
+        if spooler is not None:
+            spooler.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            if self._owns_spool_dir and self._spool_dir is not None:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+                self._spool_dir = None
+            elif self._spooled is not None:
+                os.unlink(self._spooled[1])
+            self._spooled = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,95 @@
+"""Mergeable processing-day quantile sketches.
+
+Means hide the long right tail of processing days, so percentiles are kept
+as a sketch. It is a :class:`cube.Cube` with one more dimension, the
+*bucket* of each batch's processing days:
+
+* days below ``EXACT_DAYS`` get a bucket of their own, so those quantiles
+  are exact;
+* longer durations fall into logarithmic buckets, as in DDSketch. A
+  reported quantile is then within ``RELATIVE_ACCURACY`` of the true value.
+
+Merging two sketches is adding their bucket counts. Cube merges therefore
+keep the sketch current on ingest. Any roll-up (all lines of a quarter, one
+formula over all months, ...) is a sparse cube roll-up onto
+``by + ["day_bucket"]`` followed by a cumulative sum over the buckets of
+each group. Only populated cells are read, so any combination of
+dimensions works. Raw values are never sorted.
+Quantiles use the nearest-rank definition: the smallest value with at least
+``q * n`` values at or below it.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from cube import Cube
+
+EXACT_DAYS = 100
+RELATIVE_ACCURACY = 0.01
+
+SKETCH_DIMENSIONS = ("month", "LINE_NO", "FORMULA_ID")
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+def bucket_of(days):
+    """Bucket number of each processing-days value (NaN stays NaN)."""
+    days = np.asarray(days, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_bucket = EXACT_DAYS + np.floor(np.log(days / EXACT_DAYS) / _LOG_GAMMA)
+    return np.where(days < EXACT_DAYS, np.floor(days), log_bucket)
+
+
+def bucket_value(buckets):
+    """Value reported for each bucket: itself when exact, else within the relative accuracy."""
+    buckets = np.asarray(buckets, dtype=np.float64)
+    lower = EXACT_DAYS * _GAMMA ** (buckets - EXACT_DAYS)
+    return np.where(buckets < EXACT_DAYS, buckets, lower * 2 * _GAMMA / (1 + _GAMMA))
+
+
+def build_sketch(batches):
+    """Quantile sketch of ``batches`` over ``SKETCH_DIMENSIONS`` x ``day_bucket``."""
+    frame = pd.DataFrame({dim: batches[dim] for dim in SKETCH_DIMENSIONS})
+    frame["day_bucket"] = bucket_of(batches["processing_days"].to_numpy(dtype=np.float64, na_value=np.nan))
+    frame["processing_days"] = batches["processing_days"]
+    return Cube.from_frame(frame, SKETCH_DIMENSIONS + ("day_bucket",))
+
+
+def quantile_name(q):
+    """``0.5`` -> ``"p50"``, ``0.999`` -> ``"p99.9"``."""
+    return f"p{round(q * 100, 6):g}"
+
+
+def quantiles(sketch, qs, by=(), where=None):
+    """Quantiles of every non-empty ``by`` group.
+
+    Returns ``(labels, codes, counts, values)``: the labels of each ``by``
+    dimension, the codes of each group (shape ``(len(by), groups)``, in
+    label order), the batch count of each group and its values with one
+    column per ``q``. Without ``by`` there is always exactly one group
+    (count 0 and NaN values when nothing matches).
+    """
+    labels, codes, cells = sketch.sparse_rollup(list(by) + ["day_bucket"], where=where)
+    counts = cells["size"]
+    buckets = np.asarray(labels[-1], dtype=np.float64)[codes[-1]]
+
+    # Cells come ordered by group, then bucket; a group starts where a by code changes
+    first = np.ones(len(counts), dtype=bool)
+    first[1:] = (codes[:-1, 1:] != codes[:-1, :-1]).any(axis=0)
+    starts = np.flatnonzero(first)
+    group = np.cumsum(first) - 1
+    cumulative = np.cumsum(counts)
+    within = cumulative - (cumulative[starts] - counts[starts])[group]  # running count inside the group
+    totals = within[np.append(starts[1:], len(counts)) - 1] if len(counts) else np.zeros(0)
+
+    values = np.full((len(starts), len(qs)), np.nan)
+    for i, q in enumerate(qs):
+        rank = np.maximum(np.ceil(q * totals - 1e-9), 1)
+        reached = np.flatnonzero(within >= rank[group])
+        hit, at = np.unique(group[reached], return_index=True)  # first bucket reaching the rank
+        values[hit, i] = bucket_value(buckets[reached[at]])
+    if not by and not len(starts):
+        return [], np.zeros((0, 1), dtype=np.intp), np.zeros(1), np.full((1, len(qs)), np.nan)
+    return labels[:-1], codes[:-1, starts], totals, values
@@ -0,0 +1,99 @@
+"""Background hot-reload of the source workbook.
+
+A daemon thread polls the workbook (or the newest ``.xlsx`` in a drop
+directory). When a file has changed and its size and mtime have settled, the
+thread loads it and builds a complete new snapshot, then publishes it. The
+swap is a single reference assignment: requests already running keep the
+snapshot they started with, and new requests see the new one. If the reload
+fails, the current snapshot stays in place.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+
+from dataset import build_snapshot, current_snapshot, publish
+from loader import load_wip
+
+log = logging.getLogger(__name__)
+
+
+def newest_workbook(drop_dir):
+    """Most recently modified ``.xlsx`` in ``drop_dir`` (Excel lock files skipped)."""
+    candidates = [
+        path for path in glob.glob(os.path.join(drop_dir, "*.xlsx"))
+        if not os.path.basename(path).startswith("~$")
+    ]
+    return max(candidates, key=os.path.getmtime, default=None)
+
+
+class WorkbookWatcher(threading.Thread):
+    """Poll for workbook changes and publish a rebuilt snapshot."""
+
+    def __init__(self, path=None, drop_dir=None, interval=5.0, cache_dir=None, load=None):
+        super().__init__(name="workbook-watcher", daemon=True)
+        if not path and not drop_dir:
+            raise ValueError("WorkbookWatcher needs a workbook path or a drop directory")
+        self.path = path
+        self.drop_dir = drop_dir
+        self.interval = interval
+        self.cache_dir = cache_dir
+        # path -> Snapshot; e.g. shared_store.shared_snapshot in multi-worker mode
+        self.load = load or (lambda path: build_snapshot(load_wip(path, cache_dir=self.cache_dir)))
+        self.reloads = 0
+        self.last_error = None
+        self._stopped = threading.Event()
+        # A drop directory may already hold a newer workbook than the one served
+        self._seen = None if drop_dir else self._stat(path)
+        self._pending = None
+
+    def _source(self):
+        return newest_workbook(self.drop_dir) if self.drop_dir else self.path
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        return (path, st.st_size, st.st_mtime_ns)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """Check once; reload when a change has been stable for one interval."""
+        stat = self._stat(self._source())
+        if stat is None or stat == self._seen:
+            self._pending = None
+            return False
+        if stat != self._pending:
+            # Still being written (or just appeared): wait one more poll
+            self._pending = stat
+            return False
+
+        self._pending = None
+        self._seen = stat
+        return self.reload(stat[0])
+
+    def reload(self, path):
+        started = time.perf_counter()
+        try:
+            snapshot = self.load(path)
+        except Exception as exc:  # keep serving the old snapshot
+            self.last_error = repr(exc)
+            log.exception("Reloading %s failed, keeping the current dataset", path)
+            return False
+
+        if snapshot.version == current_snapshot().version:
+            return False  # touched, content unchanged
+        publish(snapshot)
+        self.reloads += 1
+        self.last_error = None
+        log.info("Published dataset %s from %s in %.2fs", snapshot.version, path, time.perf_counter() - started)
+        return True
@@ -0,0 +1,97 @@
+"""Size-bounded LRU cache of fully serialized chart responses.
+
+Chart outputs depend only on the route, its query parameters and the dataset
+version, so a response can be stored as the exact bytes that were sent and
+replayed without touching pandas. Keys include the dataset version and the
+whole cache is cleared whenever a new snapshot is published.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    __slots__ = ("status_code", "headers", "body")
+
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers.items())
+
+
+class ResponseCache:
+    """Thread-safe LRU keyed by ``cache_key`` with a byte budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def cache_key(request, version):
+    """(route, normalized query, representation, dataset version).
+
+    Parameters are sorted by name but repeated values keep their order, since
+    e.g. ``by=month&by=LINE_NO`` fixes the axis order of the result.
+    """
+    query = tuple(sorted(request.query_params.multi_items(), key=lambda item: item[0]))
+    accept_encoding = request.headers.get("accept-encoding", "")
+    representation = (
+        request.headers.get("accept", ""),
+        "br" in accept_encoding,
+        "gzip" in accept_encoding,
+    )
+    return (request.url.path, query, representation, version)
+
+
+response_cache = ResponseCache(int(float(os.environ.get("RESPONSE_CACHE_MB", "64")) * 1024 * 1024))
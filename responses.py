@@ -0,0 +1,61 @@
+"""HTTP helpers for large chart payloads: ETags, content negotiation, brotli.
+
+gzip is handled app-wide by Starlette's ``GZipMiddleware``. Brotli is used
+when the optional ``brotli`` package is installed and the client accepts it;
+responses that already carry a ``Content-Encoding`` pass through the gzip
+middleware untouched.
+"""
+import hashlib
+
+import numpy as np
+from fastapi.responses import Response
+
+from metrics import stage
+
+try:
+    import brotli
+except ImportError:  # optional, gzip still applies
+    brotli = None
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+# Compressing tiny bodies costs more than it saves
+MIN_COMPRESS_SIZE = 1024
+
+
+def etag(version, *parts):
+    """Strong ETag for one representation of one dataset version."""
+    variant = hashlib.sha1(repr(parts).encode()).hexdigest()[:10]
+    return f'"{version}-{variant}"'
+
+
+def not_modified(request, tag):
+    """True when the request's ``If-None-Match`` already covers ``tag``."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return "*" in candidates or tag in candidates
+
+
+def prefers_binary(request):
+    accept = request.headers.get("accept", "")
+    return BINARY_MEDIA_TYPE in accept and "application/json" not in accept
+
+
+def pack_int32(values):
+    """Pack whole-day values as little-endian int32, dropping missing ones."""
+    values = np.asarray(values, dtype=np.float64)
+    return values[~np.isnan(values)].astype("<i4").tobytes()
+
+
+def encoded_response(request, body, media_type, headers=None):
+    """Response for ``body``, brotli-compressed when possible."""
+    headers = dict(headers or {})
+    headers.setdefault("Vary", "Accept, Accept-Encoding")
+    accept_encoding = request.headers.get("accept-encoding", "")
+    if brotli is not None and "br" in accept_encoding and len(body) >= MIN_COMPRESS_SIZE:
+        with stage("compress"):
+            body = brotli.compress(body, quality=5)
+        headers["Content-Encoding"] = "br"
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,108 @@
+"""Serverless entry point (see vercel.json).
+
+Importing :mod:`main` pulls in pandas, numpy, FastAPI and every route, and
+the dataset still has to be built after that. This module is plain ASGI on
+the standard library only, so the platform has an app within milliseconds:
+
+* ``/healthz`` answers at once, even while the first load is running;
+* any other request (``/warmup`` included) imports :mod:`main` and builds
+  the snapshot once, on a thread, then is handed to ``main.app``;
+* startup is acknowledged at once. ``main.app``'s own lifespan (watcher,
+  offload warm-up) starts once main is imported, and shutdown is forwarded
+  to it.
+
+``main`` runs with ``WIP_LAZY_START=1`` here, so importing it does not load
+the workbook; the load happens explicitly below, off the event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+os.environ.setdefault("WIP_LAZY_START", "1")
+
+log = logging.getLogger(__name__)
+
+_app = None
+_app_lock = threading.Lock()
+
+# (messages to main.app's lifespan, its replies, the task running it), once started
+_main_lifespan = None
+_main_lifespan_lock = asyncio.Lock()
+
+
+def _load_app():
+    global _app
+    with _app_lock:
+        if _app is None:
+            started = time.perf_counter()
+            import main
+
+            imported = time.perf_counter()
+            main.current_snapshot()
+            log.info(
+                "imported main in %.3fs, loaded the dataset in %.3fs",
+                imported - started, time.perf_counter() - imported,
+            )
+            _app = main.app
+    return _app
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _start_main_lifespan():
+    """Run ``main.app``'s lifespan startup, once, after main is imported."""
+    global _main_lifespan
+    async with _main_lifespan_lock:
+        if _main_lifespan is not None:
+            return
+        inbox, replies = asyncio.Queue(), asyncio.Queue()
+        scope = {"type": "lifespan", "asgi": {"version": "3.0", "spec_version": "2.0"}, "state": {}}
+        task = asyncio.get_running_loop().create_task(_app(scope, inbox.get, replies.put))
+        await inbox.put({"type": "lifespan.startup"})
+        reply = await replies.get()
+        if reply["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"main.app failed to start: {reply.get('message', '')}")
+        _main_lifespan = (inbox, replies, task)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            async with _main_lifespan_lock:
+                if _main_lifespan is None:
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+                inbox, replies, task = _main_lifespan
+                await inbox.put(message)
+                await send(await replies.get())
+                await task
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if _app is None:
+        if scope["type"] == "http" and scope["path"] == "/healthz":
+            # Same body as main's /healthz before a snapshot exists
+            await _send_json(send, 200, {"status": "ok", "ready": False, "version": None})
+            return
+        await asyncio.get_running_loop().run_in_executor(None, _load_app)
+    if _main_lifespan is None:
+        await _start_main_lifespan()
+    await _app(scope, receive, send)
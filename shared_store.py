@@ -0,0 +1,189 @@
+"""Dataset snapshots shared by several worker processes through mmap.
+
+With ``uvicorn --workers N`` (or gunicorn) every worker used to parse the
+workbook and build its own copy of every frame and aggregate. With
+``WIP_SHARED_DIR`` set, the snapshot is written once to a single file. Each
+worker then maps that file read-only, and the arrays behind its frames,
+cubes and indexes point straight into the mapping. The pages sit in the OS
+page cache and all workers share them, so adding a worker costs little more
+than the interpreter itself.
+
+File layout: a small pickle (protocol 5) holds the structure, and every
+numpy buffer it references is stored out-of-band. Each buffer starts at a
+64-byte aligned offset. Datetime arrays are stored as int64 views, because
+numpy would otherwise pickle them in-band. Object arrays cannot live
+out-of-band, but with the compact schema only the category lists are
+objects. Those are small, and every worker keeps its own copy.
+
+Only one process builds a given source. The others wait on an ``fcntl``
+lock and then attach the file it wrote. ``python shared_store.py <xlsx>``
+pre-builds the file before the workers start.
+"""
+import io
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+from alerts import CELLS
+from dataset import Snapshot, build_snapshot
+from loader import file_fingerprint, load_wip
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; building is then unsynchronized
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"WIPSNAP1"
+ALIGNMENT = 64
+_HEADER = struct.Struct("<8sQQ")  # magic, pickle offset, pickle length
+
+SNAPSHOT_FIELDS = (
+    "version", "rows", "batches", "delayed_rows", "delay_index", "batch_cube", "row_cube", "quantile_sketch",
+    "control_charts",
+)
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _as_dtype(values, dtype):
+    return values.view(np.dtype(dtype))
+
+
+class _Pickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in "mM":
+            return _as_dtype, (obj.view(np.int64), obj.dtype.str)
+        return NotImplemented
+
+
+def write_snapshot(snapshot, path):
+    """Write ``snapshot`` to ``path`` (atomically) in the mappable layout."""
+    buffers = []
+    state = {field: getattr(snapshot, field) for field in SNAPSHOT_FIELDS}
+    out = io.BytesIO()
+    _Pickler(out, protocol=5, buffer_callback=buffers.append).dump(state)
+    payload = out.getvalue()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(b"\0" * _HEADER.size)
+            table = []
+            for buffer in buffers:
+                raw = buffer.raw()
+                offset = _aligned(fh.tell())
+                fh.write(b"\0" * (offset - fh.tell()))
+                fh.write(raw)
+                table.append((offset, raw.nbytes))
+            meta = pickle.dumps((table, payload), protocol=5)
+            meta_offset = fh.tell()
+            fh.write(meta)
+            fh.seek(0)
+            fh.write(_HEADER.pack(MAGIC, meta_offset, len(meta)))
+        os.chmod(tmp, 0o644)  # mkstemp is owner-only
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def attach_snapshot(path):
+    """Map ``path`` read-only and rebuild the snapshot on top of the mapping."""
+    with open(path, "rb") as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, meta_offset, meta_length = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a shared snapshot file")
+    table, payload = pickle.loads(view[meta_offset:meta_offset + meta_length])
+    # Arrays keep the slices, and through them the mapping, alive
+    state = pickle.loads(payload, buffers=[view[offset:offset + n] for offset, n in table])
+    charts = state.get("control_charts")
+    if charts is not None and set(charts.cells) != set(CELLS):
+        charts = None  # written with the older cell layout
+    return Snapshot(
+        state["version"], state["rows"], state["batches"], state["delayed_rows"],
+        delay_index=state["delay_index"], batch_cube=state["batch_cube"], row_cube=state["row_cube"],
+        # Rebuilt for files written before they existed
+        quantile_sketch=state.get("quantile_sketch"),
+        control_charts=charts,
+    )
+
+
+class _BuildLock:
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+
+    def __enter__(self):
+        self._fh = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+        self._fh.close()
+
+
+def _read_index(index_path):
+    try:
+        with open(index_path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def shared_snapshot(path, shared_dir, cache_dir=None):
+    """Attach the shared snapshot of workbook ``path``, building it if needed.
+
+    The first process to see a new workbook version builds the file while
+    holding the lock. Processes that arrive while it builds block on the
+    lock and then attach the result instead of parsing the workbook again.
+    """
+    os.makedirs(shared_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    index_path = os.path.join(shared_dir, f"{stem}.json")
+
+    with _BuildLock(os.path.join(shared_dir, f".{stem}.lock")):
+        index = _read_index(index_path)
+        fingerprint = file_fingerprint(path, known=index)
+        if index and index["sha1"] == fingerprint["sha1"] and os.path.exists(os.path.join(shared_dir, index["entry"])):
+            entry = index["entry"]
+        else:
+            entry = f"{stem}-{fingerprint['sha1'][:16]}.snap"
+            write_snapshot(build_snapshot(load_wip(path, cache_dir=cache_dir)), os.path.join(shared_dir, entry))
+            with open(f"{index_path}.tmp", "w") as fh:
+                json.dump({"entry": entry, **fingerprint}, fh)
+            os.replace(f"{index_path}.tmp", index_path)
+            if index and index["entry"] != entry:
+                # Workers still mapping the old file keep it until they drop it
+                try:
+                    os.unlink(os.path.join(shared_dir, index["entry"]))
+                except OSError:
+                    pass
+            log.info("Built shared snapshot %s", entry)
+
+    return attach_snapshot(os.path.join(shared_dir, entry))
+
+
+if __name__ == "__main__":
+    # Pre-build before starting workers: python shared_store.py [xlsx] [shared_dir]
+    logging.basicConfig(level=logging.INFO)
+    source = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("WIP_SOURCE", "batch_details.xlsx")
+    target = sys.argv[2] if len(sys.argv) > 2 else os.environ.get("WIP_SHARED_DIR", ".wip_shared")
+    print(shared_snapshot(source, target))
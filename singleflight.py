@@ -0,0 +1,92 @@
+"""Single-flight coalescing: identical concurrent calls share one computation.
+
+When a dashboard opens it fires every chart at once, and several users
+often open it together. Right after a reload has cleared the response
+cache, all of those requests miss together. Without coalescing, each one
+would run the same pandas work. With it, the first caller for a key
+computes, and callers that arrive while it runs wait for that result (or
+its exception).
+
+:class:`SingleFlight` is for threads (sync handlers, snapshot loads).
+:class:`AsyncSingleFlight` is for coroutines on one event loop (the
+response cache middleware). Nothing is remembered after a call finishes,
+because caching is the response cache's job.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Thread-safe coalescing of ``fn(*args)`` calls per key."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return ``(result, shared)``; ``shared`` is True for callers that waited."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """Coalescing of ``await factory()`` per key within one event loop.
+
+    The leader's work runs as its own task, and every caller awaits it
+    through ``asyncio.shield``. If the first client disconnects, the
+    others still get the result.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, factory):
+        """Return ``(result, shared)``; ``shared`` is True for callers that waited."""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.leaders += 1
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda _, key=key: self._tasks.pop(key, None))
+        return await asyncio.shield(task), shared
@@ -0,0 +1,300 @@
+"""Embedded SQLite copy of the dataset for ad-hoc, read-only queries.
+
+With ``WIP_SQL_DIR`` set, every published snapshot is also written to
+``<dir>/wip-<version>.sqlite``. The file has two tables, ``rows`` and
+``batches``, plus a one-row ``meta`` table. They are indexed on batch id,
+line, formula, reason (rows) and start date. Dates are ``YYYY-MM-DD`` text
+and months ``YYYY-MM``, so ranges compare as strings and use the indexes.
+``is_delayed`` is at the default delay threshold. The file is built on
+a background thread after each publish and reused across restarts for the
+same source version. Publishes that arrive while a build runs are
+coalesced: only the newest one is built next. Until it is ready, queries
+see the previous version.
+
+Queries go through :meth:`SQLStore.query`:
+
+* connections are opened read-only (``mode=ro``, ``query_only``), and an
+  authorizer refuses anything but reading: no PRAGMA, ATTACH or writes;
+* only one statement per call, with ``?`` or ``:name`` parameters. Each
+  pooled connection keeps its compiled statements, so a repeated query is
+  prepared once per connection;
+* at most ``pool_size`` queries run at once, on pooled connections shared
+  by all threadpool workers;
+* results stop at ``max_rows`` rows, and a query is interrupted once
+  ``timeout`` seconds have passed (waiting for a connection included).
+
+Settings come from ``WIP_SQL_DIR``, ``WIP_SQL_POOL``, ``WIP_SQL_MAX_ROWS``
+and ``WIP_SQL_TIMEOUT``.
+"""
+import concurrent.futures
+import contextlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from dataset import DELAY_THRESHOLD_DAYS
+from schema import date_values
+
+log = logging.getLogger(__name__)
+
+# Compiled statements kept per pooled connection
+STATEMENT_CACHE = 256
+
+# SQLite virtual machine steps between two deadline checks
+PROGRESS_STEPS = 10_000
+
+# NUMERIC keeps integer ids / lines / formulas as integers and anything else as text
+SCHEMA = """
+CREATE TABLE meta (version TEXT, loaded_at REAL, threshold_days INTEGER);
+CREATE TABLE batches (
+    WIP_BATCH_ID NUMERIC, LINE_NO NUMERIC, FORMULA_ID NUMERIC,
+    WIP_ACT_START_DATE TEXT, WIP_CMPLT_DATE TEXT,
+    processing_days INTEGER, month TEXT, is_delayed INTEGER
+);
+CREATE TABLE rows (
+    WIP_BATCH_ID NUMERIC, LINE_NO NUMERIC, FORMULA_ID NUMERIC, REASON TEXT,
+    WIP_ACT_START_DATE TEXT, WIP_CMPLT_DATE TEXT, SCRAP_FACTOR REAL,
+    processing_days INTEGER, month TEXT, is_delayed INTEGER
+);
+"""
+INDEXES = """
+CREATE UNIQUE INDEX batches_batch ON batches (WIP_BATCH_ID);
+CREATE INDEX batches_line ON batches (LINE_NO);
+CREATE INDEX batches_formula ON batches (FORMULA_ID);
+CREATE INDEX batches_start ON batches (WIP_ACT_START_DATE);
+CREATE INDEX rows_batch ON rows (WIP_BATCH_ID);
+CREATE INDEX rows_line ON rows (LINE_NO);
+CREATE INDEX rows_formula ON rows (FORMULA_ID);
+CREATE INDEX rows_reason ON rows (REASON);
+CREATE INDEX rows_start ON rows (WIP_ACT_START_DATE);
+"""
+TABLE_COLUMNS = {
+    "batches": (
+        "WIP_BATCH_ID", "LINE_NO", "FORMULA_ID", "WIP_ACT_START_DATE", "WIP_CMPLT_DATE",
+        "processing_days", "month", "is_delayed",
+    ),
+    "rows": (
+        "WIP_BATCH_ID", "LINE_NO", "FORMULA_ID", "REASON", "WIP_ACT_START_DATE", "WIP_CMPLT_DATE",
+        "SCRAP_FACTOR", "processing_days", "month", "is_delayed",
+    ),
+}
+
+# Authorizer actions a read-only query needs; everything else is denied
+_ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+
+class QueryTimeout(TimeoutError):
+    """A query did not get a connection or finish within the time limit."""
+
+
+def _column(frame, name):
+    """``frame[name]`` as a list of values sqlite3 can bind (None for missing)."""
+    series = frame[name]
+    if name in ("WIP_ACT_START_DATE", "WIP_CMPLT_DATE"):
+        days = date_values(series).to_numpy().astype("datetime64[D]")
+        text = np.datetime_as_string(days).astype(object)
+        text[np.isnat(days)] = None
+        return text.tolist()
+    if name == "month":
+        return series.dt.strftime("%Y-%m").astype(object).where(series.notna(), None).tolist()
+    if name == "is_delayed":
+        return series.astype(np.int64).tolist()
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def build_database(snapshot, path):
+    """Write ``snapshot`` to a new SQLite file at ``path`` (replaced atomically)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".wip-", suffix=".sqlite", dir=directory)
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")  # a half-written temp file is just discarded
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "INSERT INTO meta VALUES (?, ?, ?)",
+                (snapshot.version, snapshot.loaded_at, DELAY_THRESHOLD_DAYS),
+            )
+            for table, columns in TABLE_COLUMNS.items():
+                frame = getattr(snapshot, table)
+                values = zip(*(_column(frame, name) for name in columns))
+                conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", values)
+            conn.executescript(INDEXES)
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+class SQLStore:
+    """Versioned SQLite files of the published snapshots and a pool of read-only connections."""
+
+    def __init__(self, directory, pool_size=4, max_rows=10_000, timeout=5.0):
+        self.directory = directory
+        self.pool_size = pool_size
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle = []  # (path, connection)
+        self._current = None  # (version, path)
+        # One builder thread, and at most one queued build: the newest pending snapshot
+        self._builder = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="sqlstore")
+        self._pending = None
+        self._queued = None
+        self.queries = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls):
+        """The configured store, or None when ``WIP_SQL_DIR`` is unset."""
+        directory = os.environ.get("WIP_SQL_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            pool_size=int(os.environ.get("WIP_SQL_POOL", "4")),
+            max_rows=int(os.environ.get("WIP_SQL_MAX_ROWS", "10000")),
+            timeout=float(os.environ.get("WIP_SQL_TIMEOUT", "5")),
+        )
+
+    @property
+    def version(self):
+        current = self._current
+        return None if current is None else current[0]
+
+    def refresh(self, snapshot):
+        """Build ``snapshot``'s file in the background (an ``on_publish`` callback).
+
+        A snapshot still waiting for the builder is replaced, not built. The
+        returned future is done once ``snapshot`` or a newer one is built.
+        """
+        with self._lock:
+            if self._pending is None:
+                self._queued = self._builder.submit(self._build_pending)
+            self._pending = snapshot
+            return self._queued
+
+    def _build_pending(self):
+        with self._lock:
+            snapshot, self._pending = self._pending, None
+        self._build(snapshot)
+
+    def _build(self, snapshot):
+        path = os.path.join(self.directory, f"wip-{snapshot.version}.sqlite")
+        try:
+            # Versions are content hashes (reuse the file), except "local-N" for frames without a source
+            if snapshot.version.startswith("local-") or not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                started = time.perf_counter()
+                build_database(snapshot, path)
+                log.info("Wrote SQL store %s in %.2fs", path, time.perf_counter() - started)
+        except Exception:
+            log.exception("Building the SQL store for %s failed", snapshot.version)
+            return
+        with self._lock:
+            previous, self._current = self._current, (snapshot.version, path)
+            stale = [conn for conn_path, conn in self._idle if conn_path != path]
+            self._idle = [(conn_path, conn) for conn_path, conn in self._idle if conn_path == path]
+        for conn in stale:
+            conn.close()
+        # Only the file this store published before: workers sharing the
+        # directory may be on other versions (e.g. after their own ingest)
+        if previous is not None and previous[1] != path:
+            with contextlib.suppress(OSError):  # still open elsewhere (Windows)
+                os.unlink(previous[1])
+
+    def _open(self, path):
+        conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE,
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.set_authorizer(lambda action, *_: sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY)
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self, deadline):
+        """``(version, connection)`` from the pool, for the newest built version."""
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise QueryTimeout(f"no free SQL connection within {self.timeout:g}s")
+        try:
+            with self._lock:
+                if self._current is None:
+                    raise LookupError("the SQL store is still being built")
+                version, path = self._current
+                conn = next((c for p, c in self._idle if p == path), None)
+                if conn is not None:
+                    self._idle = [(p, c) for p, c in self._idle if c is not conn]
+            if conn is None:
+                conn = self._open(path)
+            try:
+                yield version, conn
+            finally:
+                with self._lock:
+                    keep = self._current is not None and self._current[1] == path
+                    if keep:
+                        self._idle.append((path, conn))
+                if not keep:
+                    conn.close()
+        finally:
+            self._slots.release()
+
+    def query(self, sql, params=(), limit=None):
+        """``{"version", "columns", "rows", "truncated"}`` of one read-only statement.
+
+        Raises :class:`QueryTimeout` past the time limit, ``LookupError``
+        before the first file is built and ``sqlite3.Error`` for anything
+        SQLite rejects (syntax, writes, bad parameters).
+        """
+        limit = self.max_rows if limit is None else min(limit, self.max_rows)
+        deadline = time.monotonic() + self.timeout
+        self.queries += 1
+        with self.connection(deadline) as (version, conn):
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+            cursor = None
+            try:
+                cursor = conn.execute(sql, params)
+                rows = cursor.fetchmany(limit + 1)
+                columns = [column[0] for column in cursor.description or ()]
+            except sqlite3.OperationalError:
+                if time.monotonic() > deadline:
+                    self.timeouts += 1
+                    raise QueryTimeout(f"query did not finish within {self.timeout:g}s") from None
+                raise
+            finally:
+                if cursor is not None:
+                    cursor.close()
+                conn.set_progress_handler(None, 0)
+        return {
+            "version": version,
+            "columns": columns,
+            "rows": [[value.hex() if isinstance(value, bytes) else value for value in row] for row in rows[:limit]],
+            "truncated": len(rows) > limit,
+        }
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "idle_connections": len(self._idle),
+            "queries": self.queries,
+            "timeouts": self.timeouts,
+        }
+
+    def close(self):
+        self._builder.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            conn.close()
@@ -0,0 +1,19 @@
+from bench.generate import generate
+from dataset import build_snapshot
+from ingest import merge_rows
+
+
+def test_ingest_matches_rebuild():
+    raw = generate(20_000, seed=11)
+    # Shuffled halves: the delta both adds batches and updates existing ones
+    order = raw.sample(frac=1, random_state=3).index
+    base, delta = raw.loc[order[:12_000]], raw.loc[order[12_000:]]
+
+    merged, summary = merge_rows(build_snapshot(base), delta)
+    rebuilt = build_snapshot(raw)
+    assert summary["batches_updated"] > 0
+
+    for threshold in (2, 3, 30):
+        expected = rebuilt.control_charts.alerts(threshold)
+        assert expected
+        assert merged.control_charts.alerts(threshold) == expected
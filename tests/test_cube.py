@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench.generate import generate
+from dataset import build_snapshot
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return build_snapshot(generate(20_000, seed=5))
+
+
+@pytest.mark.parametrize("keep, where", [(["bogus"], None), (["REASON"], None), (["LINE_NO"], {"bogus": ["1"]})])
+def test_unknown_dimension_is_a_value_error(snapshot, keep, where):
+    with pytest.raises(ValueError, match="Unknown cube dimension"):
+        snapshot.batch_cube.rollup(keep, where)
+    with pytest.raises(ValueError, match="Unknown cube dimension"):
+        snapshot.batch_cube.sparse_rollup(keep, where)
+
+
+def expected_cells(frame, keep, where=None):
+    for dim, values in (where or {}).items():
+        frame = frame[frame[dim].astype(str).isin({str(v) for v in values})]
+    days = frame["processing_days"].astype("float64")
+    return (
+        frame.assign(days=days, days_sq=days * days)
+        .groupby(keep, observed=True, sort=True)
+        .agg(size=("days", "size"), count=("days", "count"), sum=("days", "sum"), sum_sq=("days_sq", "sum"))
+    )
+
+
+def group_keys(expected):
+    return [key if isinstance(key, tuple) else (key,) for key in expected.index]
+
+
+CASES = [
+    ("batches", ["LINE_NO"], None),
+    ("batches", ["month", "FORMULA_ID"], {"LINE_NO": ["1", "2", "3"]}),
+    ("batches", ["month", "LINE_NO", "is_delayed"], None),
+    ("rows", ["LINE_NO", "REASON"], {"is_delayed": [True]}),
+]
+
+
+@pytest.mark.parametrize("grain, keep, where", CASES)
+def test_rollup_matches_groupby(snapshot, grain, keep, where):
+    labels, cells = snapshot.rollup(grain, keep, where)
+    expected = expected_cells(getattr(snapshot, grain), keep, where)
+    nonzero = np.nonzero(cells["size"])
+    got_keys = list(zip(*(labels[d][codes] for d, codes in enumerate(nonzero))))
+    assert got_keys == group_keys(expected)
+    for name in ("size", "count", "sum", "sum_sq"):
+        np.testing.assert_allclose(cells[name][nonzero], expected[name].to_numpy())
+
+
+@pytest.mark.parametrize("grain, keep, where", CASES)
+def test_sparse_rollup_matches_groupby(snapshot, grain, keep, where):
+    labels, codes, cells = snapshot.sparse_rollup(grain, keep, where)
+    expected = expected_cells(getattr(snapshot, grain), keep, where)
+    got_keys = list(zip(*(labels[d][codes[d]] for d in range(len(keep)))))
+    assert got_keys == group_keys(expected)
+    for name in ("size", "count", "sum", "sum_sq"):
+        np.testing.assert_allclose(cells[name], expected[name].to_numpy())
+
+
+@pytest.mark.parametrize("grain, keep, where", CASES)
+def test_view_rollups_match_groupby(snapshot, grain, keep, where):
+    view = snapshot.filtered(start=pd.Timestamp("2023-01-01").date())
+    expected = expected_cells(getattr(view, grain), keep, where)
+    labels, codes, cells = view.sparse_rollup(grain, keep, where)
+    assert list(zip(*(labels[d][codes[d]] for d in range(len(keep))))) == group_keys(expected)
+    np.testing.assert_allclose(cells["sum"], expected["sum"].to_numpy())
+    labels, dense = view.rollup(grain, keep, where)
+    np.testing.assert_allclose(dense["sum"][tuple(codes)], expected["sum"].to_numpy())
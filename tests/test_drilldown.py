@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from bench.generate import generate
+from dataset import build_snapshot
+from drilldown import encode_cursor
+
+
+@pytest.fixture(scope="module")
+def index():
+    return build_snapshot(generate(20_000, seed=19)).batch_index()
+
+
+def all_pages(index, limit, **options):
+    positions, cursor = [], None
+    while True:
+        page, cursor = index.page(limit=limit, cursor=cursor, **options)
+        assert len(page) == limit or cursor is None
+        positions.append(page)
+        if cursor is None:
+            return np.concatenate(positions)
+
+
+@pytest.mark.parametrize("options", [
+    {"sort": "processing_days", "order": "desc"},
+    {"sort": "date", "order": "asc", "lines": ["1", "2"]},
+    {"sort": "processing_days", "order": "asc", "min_days": 3},
+])
+def test_pages_cover_one_big_page(index, options):
+    whole, _ = index.page(limit=10**9, **options)
+    paged = all_pages(index, 97, **options)
+    np.testing.assert_array_equal(paged, whole)
+    assert len(np.unique(paged)) == len(paged)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "e30", encode_cursor("date", "asc", 0, 1)])
+def test_invalid_cursor_is_rejected(index, cursor):
+    with pytest.raises(ValueError):
+        index.page(sort="processing_days", order="desc", cursor=cursor)
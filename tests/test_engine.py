@@ -0,0 +1,85 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+from bench.generate import generate
+from dataset import build_snapshot
+from schema import date_values
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return build_snapshot(generate(20_000, seed=17))
+
+
+def expected_metrics(frame, by, threshold_days):
+    days = frame["processing_days"].astype("float64")
+    grouped = frame.assign(days=days, late=days > threshold_days).groupby(by, observed=True, sort=True)
+    result = grouped.agg(
+        count=("days", "size"), delayed=("late", "sum"),
+        mean_days=("days", "mean"), min_days=("days", "min"), max_days=("days", "max"),
+    )
+    result["delay_rate"] = result["delayed"] / result["count"] * 100
+    return result.reset_index()
+
+
+@pytest.mark.parametrize("by", [["LINE_NO"], ["FORMULA_ID"], ["month", "LINE_NO"]])
+@pytest.mark.parametrize("threshold_days", [2, 5])
+def test_batch_metrics_match_groupby(snapshot, by, threshold_days):
+    metrics = ["count", "delayed", "delay_rate", "mean_days", "min_days", "max_days"]
+    got = engine.aggregate(snapshot, by, metrics, threshold_days=threshold_days)
+    expected = expected_metrics(snapshot.batches, by, threshold_days)
+    assert len(got) == len(expected)
+    for dim in by:
+        assert got[dim].astype(str).tolist() == expected[dim].astype(str).tolist()
+    for metric in metrics:
+        np.testing.assert_allclose(got[metric].to_numpy(dtype=float), expected[metric].to_numpy(dtype=float))
+
+
+def test_row_metrics_and_filters(snapshot):
+    filters = {"start": date(2023, 1, 1), "lines": ["1", "2", "3"]}
+    got = engine.aggregate(snapshot, ["REASON"], ["count", "mean_scrap"], grain="rows", filters=filters)
+
+    rows = snapshot.rows
+    started = date_values(rows["WIP_ACT_START_DATE"]) >= pd.Timestamp(filters["start"])
+    selected = rows[started & rows["LINE_NO"].astype(str).isin(filters["lines"])]
+    expected = selected.groupby("REASON", observed=True).agg(
+        count=("REASON", "size"), mean_scrap=("SCRAP_FACTOR", "mean"),
+    ).reset_index()
+    assert got["REASON"].tolist() == expected["REASON"].tolist()
+    assert got["count"].tolist() == expected["count"].tolist()
+    np.testing.assert_allclose(got["mean_scrap"].to_numpy(), expected["mean_scrap"].to_numpy(), rtol=1e-6)
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_top_groups_match_a_full_sort(snapshot, descending):
+    full = engine.aggregate(snapshot, ["FORMULA_ID"], ["count", "mean_days"])
+    top = engine.aggregate(snapshot, ["FORMULA_ID"], ["count", "mean_days"], sort="count", descending=descending, top=15)
+    # Ties keep label order
+    ordered = full.assign(label=np.arange(len(full))).sort_values(
+        ["count", "label"], ascending=[not descending, True], kind="stable",
+    )
+    pd.testing.assert_frame_equal(top, ordered.head(15).drop(columns="label").reset_index(drop=True))
+
+
+def test_top_k_partial_selection():
+    rng = np.random.default_rng(0)
+    key = rng.integers(0, 20, 1_000).astype(float)
+    key[rng.choice(1_000, 50, replace=False)] = np.nan
+    full = np.lexsort((np.arange(len(key)), np.where(np.isnan(key), np.inf, -key)))
+    for k in (0, 1, 15, 999, 1_000, 2_000):
+        np.testing.assert_array_equal(engine.top_k(key, k), full[:k])
+
+
+def test_invalid_arguments(snapshot):
+    for by, metrics, grain, sort in [
+        (["REASON"], ["count"], "batches", None),
+        (["LINE_NO"], ["bogus"], "batches", None),
+        (["LINE_NO"], ["mean_scrap"], "batches", None),
+        (["LINE_NO"], ["count"], "batches", "delayed"),
+    ]:
+        with pytest.raises(ValueError):
+            engine.aggregate(snapshot, by, metrics, grain=grain, sort=sort)
@@ -0,0 +1,34 @@
+import io
+
+import pandas as pd
+import pytest
+
+import cube
+import export
+from bench.generate import generate
+from dataset import build_snapshot
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return build_snapshot(generate(20_000, seed=9))
+
+
+def test_aggregates_are_not_capped_by_dense_cells(snapshot, monkeypatch):
+    # Far fewer than month x line x formula x delayed: a dense roll-up would refuse
+    monkeypatch.setattr(cube, "MAX_DENSE_CELLS", 100)
+    by = list(export.AGGREGATE_DIMENSIONS)
+    body = b"".join(export.aggregate_chunks(snapshot, by, fmt="csv", chunk_rows=1_000))
+    got = pd.read_csv(io.BytesIO(body), dtype={"month": str, "LINE_NO": str, "FORMULA_ID": str})
+
+    batches = snapshot.batches
+    expected = (
+        batches.assign(month=batches["month"].dt.strftime("%Y-%m"))
+        .groupby(by, observed=True, sort=True)
+        .agg(total_batches=("WIP_BATCH_ID", "size"), delayed_batches=("is_delayed", "sum"))
+        .reset_index()
+    )
+    assert len(got) == len(expected) > 100
+    assert got[by].astype(str).values.tolist() == expected[by].astype(str).values.tolist()
+    assert got["total_batches"].tolist() == expected["total_batches"].tolist()
+    assert got["delayed_batches"].tolist() == expected["delayed_batches"].tolist()
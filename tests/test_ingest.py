@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import charts
+from bench.generate import generate
+from dataset import BATCH_CUBE_DIMENSIONS, ROW_CUBE_DIMENSIONS, build_snapshot
+from ingest import merge_rows
+from quantiles import SKETCH_DIMENSIONS, quantiles
+
+
+@pytest.fixture(scope="module")
+def snapshots():
+    raw = generate(20_000, seed=13)
+    order = raw.sample(frac=1, random_state=4).index
+    base, delta = raw.loc[order[:15_000]], raw.loc[order[15_000:]].copy()
+
+    # A line, formula and reason the base has never seen
+    fresh = delta.index[:50]
+    delta.loc[fresh, "LINE_NO"] = raw["LINE_NO"].max() + 1
+    delta.loc[fresh, "FORMULA_ID"] = raw["FORMULA_ID"].max() + 1
+    delta.loc[fresh, "REASON"] = "new reason"
+    # An existing batch whose completion moves later, so its old facts are replaced
+    replaced = base.iloc[0].copy()
+    replaced["WIP_CMPLT_DATE"] = replaced["WIP_CMPLT_DATE"] + pd.Timedelta(days=40)
+    delta = pd.concat([delta, replaced.to_frame().T.astype(base.dtypes)])
+
+    merged, summary = merge_rows(build_snapshot(base), delta)
+    return merged, build_snapshot(pd.concat([base, delta])), summary
+
+
+def test_delta_adds_categories_and_replaces_batches(snapshots):
+    merged, _, summary = snapshots
+    assert summary["batches_added"] > 0
+    assert summary["batches_updated"] > 0
+    assert "new reason" in merged.row_cube.labels["REASON"]
+
+
+def test_batches_table(snapshots):
+    merged, rebuilt, _ = snapshots
+    pd.testing.assert_frame_equal(merged.batches, rebuilt.batches)
+
+
+@pytest.mark.parametrize("name", list(charts.CHARTS))
+def test_chart_payloads(snapshots, name):
+    merged, rebuilt, _ = snapshots
+    assert charts.render(name, merged) == charts.render(name, rebuilt)
+
+
+@pytest.mark.parametrize("grain, dims", [("batches", BATCH_CUBE_DIMENSIONS), ("rows", ROW_CUBE_DIMENSIONS)])
+def test_cube_cells(snapshots, grain, dims):
+    merged, rebuilt, _ = snapshots
+    got_labels, got_codes, got = merged.sparse_rollup(grain, list(dims))
+    want_labels, want_codes, want = rebuilt.sparse_rollup(grain, list(dims))
+    for got_dim, want_dim in zip(got_labels, want_labels):
+        assert got_dim.equals(want_dim)
+    np.testing.assert_array_equal(got_codes, want_codes)
+    for name, values in want.items():
+        np.testing.assert_array_equal(got[name], values)
+
+
+def test_quantiles(snapshots):
+    merged, rebuilt, _ = snapshots
+    got = quantiles(merged.quantile_sketch, (0.5, 0.9, 0.99), SKETCH_DIMENSIONS)
+    want = quantiles(rebuilt.quantile_sketch, (0.5, 0.9, 0.99), SKETCH_DIMENSIONS)
+    for got_dim, want_dim in zip(got[0], want[0]):
+        assert got_dim.equals(want_dim)
+    for got_values, want_values in zip(got[1:], want[1:]):
+        np.testing.assert_array_equal(got_values, want_values)
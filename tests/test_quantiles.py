@@ -0,0 +1,47 @@
+import math
+
+import numpy as np
+import pytest
+
+from bench.generate import generate
+from dataset import build_snapshot
+from quantiles import RELATIVE_ACCURACY, quantiles
+
+QS = (0.5, 0.9, 0.99)
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return build_snapshot(generate(20_000, seed=7))
+
+
+def nearest_rank(values, q):
+    values = np.sort(values)
+    return values[max(math.ceil(q * len(values) - 1e-9), 1) - 1]
+
+
+def test_three_dimension_grouping(snapshot):
+    by = ["month", "LINE_NO", "FORMULA_ID"]
+    labels, codes, counts, values = quantiles(snapshot.quantile_sketch, QS, by)
+
+    batches = snapshot.batches.dropna(subset=["processing_days"])
+    expected = {key: group["processing_days"].to_numpy(dtype=np.float64)
+                for key, group in batches.groupby(by, observed=True)}
+    assert len(counts) == len(expected)
+    for g in range(len(counts)):
+        key = tuple(labels[d][codes[d, g]] for d in range(len(by)))
+        days = expected[key]
+        assert counts[g] == len(days)
+        for i, q in enumerate(QS):
+            assert values[g, i] == pytest.approx(nearest_rank(days, q), rel=RELATIVE_ACCURACY)
+
+
+def test_no_grouping_and_empty_selection(snapshot):
+    labels, codes, counts, values = quantiles(snapshot.quantile_sketch, QS)
+    days = snapshot.batches["processing_days"].dropna().to_numpy(dtype=np.float64)
+    assert counts.tolist() == [len(days)]
+    assert values[0] == pytest.approx([nearest_rank(days, q) for q in QS], rel=RELATIVE_ACCURACY)
+
+    labels, codes, counts, values = quantiles(snapshot.quantile_sketch, QS, where={"LINE_NO": []})
+    assert counts.tolist() == [0]
+    assert np.isnan(values).all()
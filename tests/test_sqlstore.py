@@ -0,0 +1,89 @@
+import os
+import sqlite3
+
+import pytest
+
+from bench.generate import generate
+from dataset import build_snapshot
+from sqlstore import QueryTimeout, SQLStore
+
+
+@pytest.fixture(scope="module")
+def snapshots():
+    return [build_snapshot(generate(2_000, seed=seed)) for seed in (1, 2, 3)]
+
+
+def built(store, snapshot):
+    store.refresh(snapshot).result()
+    return store
+
+
+def test_workers_sharing_a_directory_keep_each_others_files(tmp_path, snapshots):
+    first, second, third = snapshots
+    a = built(SQLStore(str(tmp_path)), first)
+    b = built(SQLStore(str(tmp_path)), second)
+    built(b, third)
+    try:
+        files = sorted(os.listdir(tmp_path))
+        assert f"wip-{first.version}.sqlite" in files  # a's current file
+        assert f"wip-{second.version}.sqlite" not in files  # b's own previous file
+        assert a.query("SELECT count(*) FROM batches")["rows"] == [[len(first.batches)]]
+    finally:
+        a.close()
+        b.close()
+
+
+@pytest.fixture
+def store(tmp_path, snapshots):
+    store = built(SQLStore(str(tmp_path), pool_size=2, max_rows=100, timeout=0.5), snapshots[0])
+    yield store
+    store.close()
+
+
+def test_select_with_parameters(store, snapshots):
+    batches = snapshots[0].batches
+    line = str(batches["LINE_NO"].iloc[0])
+    result = store.query("SELECT count(*) AS n FROM batches WHERE LINE_NO = :line", {"line": line})
+    assert result["columns"] == ["n"]
+    assert result["rows"] == [[int((batches["LINE_NO"].astype(str) == line).sum())]]
+    assert result["version"] == snapshots[0].version
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM batches",
+    "INSERT INTO meta VALUES ('x', 0, 0)",
+    "DROP TABLE rows",
+    "ATTACH DATABASE ':memory:' AS other",
+    "PRAGMA query_only = OFF",
+    "SELECT 1; DELETE FROM batches",
+])
+def test_anything_but_reading_is_refused(store, sql):
+    with pytest.raises(sqlite3.Error):
+        store.query(sql)
+    assert store.query("SELECT count(*) FROM batches")["rows"][0][0] > 0
+
+
+def test_row_cap_sets_truncated(store):
+    result = store.query("SELECT WIP_BATCH_ID FROM batches")
+    assert len(result["rows"]) == store.max_rows and result["truncated"]
+    result = store.query("SELECT WIP_BATCH_ID FROM batches", limit=10)
+    assert len(result["rows"]) == 10 and result["truncated"]
+    result = store.query("SELECT WIP_BATCH_ID FROM batches LIMIT 5")
+    assert len(result["rows"]) == 5 and not result["truncated"]
+
+
+def test_long_query_times_out(store):
+    endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+    with pytest.raises(QueryTimeout):
+        store.query(endless)
+    assert store.timeouts == 1
+    assert store.query("SELECT 1")["rows"] == [[1]]  # the connection is usable again
+
+
+def test_queries_before_the_first_build(tmp_path):
+    store = SQLStore(str(tmp_path))
+    try:
+        with pytest.raises(LookupError):
+            store.query("SELECT 1")
+    finally:
+        store.close()